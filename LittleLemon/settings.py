@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'LittleLemonAPI.middleware.RequestMetricsMiddleware',
+    'LittleLemonAPI.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -129,10 +132,157 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'LittleLemonAPI.authentication.CachingTokenAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'LittleLemonAPI.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
     'DEFAULT_THROTTLE_RATES': {
         'anon': '10/minute',
         'user': '30/minute',
     }
 }
+
+# State a change made in one process has to change for every process: the versions of the
+# tables behind ETags and the menu index, and the read-your-writes pins of the replica
+# router. The 'shared' directory cache is shared by every worker on the host; point
+# SHARED_CACHE at a Redis or Memcached alias to share it between hosts. With a local-memory
+# cache, responses carry no ETag and the menu index stays off.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'shared_cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+SHARED_CACHE = 'shared'
+
+# Cache for menu listing pages. Use 'LittleLemonAPI.cache.DjangoMenuCache' with an
+# 'ALIAS' entry to share pages between processes through a Django cache backend.
+MENU_CACHE = {
+    'BACKEND': 'LittleLemonAPI.cache.LocalMenuCache',
+    'MAX_ENTRIES': 512,
+    'TIMEOUT': 300,
+}
+
+# Where the throttles keep their counters. The default SQLite file is shared by every
+# worker on the host; use 'LittleLemonAPI.throttling.CacheRateStore' with an 'ALIAS' of a
+# Redis or Memcached cache to share them between hosts.
+THROTTLE_STORE = {
+    'BACKEND': 'LittleLemonAPI.throttling.SQLiteRateStore',
+    'PATH': BASE_DIR / 'throttle.sqlite3',
+}
+
+# Recently seen tokens with their user, kept in each process to skip the token query.
+# Logging out or changing a user records the time of the change in SHARED_CACHE, and every
+# process checks it on each hit, so a revoked token stops working at once everywhere.
+TOKEN_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 30,
+}
+
+# Seconds a user's group memberships stay cached between requests in the default cache, 0
+# to resolve them on every request. A membership change drops the entry from that cache, so
+# only turn this on when CACHES['default'] is shared by every process, such as Redis or
+# Memcached. With a per-process cache, other processes keep the old roles, a removed manager
+# included, for up to this many seconds.
+ROLE_CACHE_TIMEOUT = 0
+
+# New orders are written to an outbox and assigned to the least loaded delivery crew
+# member. IN_PROCESS runs the dispatcher in a thread of the web process, started by its
+# first request, otherwise run `manage.py run_dispatcher` next to it.
+ORDER_DISPATCH = {
+    'IN_PROCESS': True,
+    'POLL_INTERVAL': 5,
+    'BATCH_SIZE': 50,
+}
+
+# Keeps a per day and menu item sales rollup up to date on checkout, so sales reports
+# do not rescan every order item. migrate builds it from the existing orders, and
+# `manage.py rebuild_sales_rollup` rebuilds it. Changing the date of an order moves its
+# sales to the new day.
+SALES_ROLLUP = True
+
+# Most SQL queries a request to each route may run, token authentication included. Going
+# over logs a warning, or fails the request when QUERY_BUDGET_STRICT is on as in the tests.
+QUERY_BUDGETS = {
+    'GET api/menu-items': 3,
+    'GET api/menu-items/<int:id>': 2,
+    'GET api/cart/menu-items': 2,
+    'POST api/cart/menu-items': 3,
+    # Two more with ?include_archived=1&expand=items, for the archived orders and their items
+    'GET api/orders': 6,
+    # One more for an archived order, looked up in the live table first
+    'GET api/orders/<int:id>': 4,
+    'POST api/orders': 10,
+}
+QUERY_BUDGET_STRICT = False
+
+# Production tuning of SQLite, off unless LITTLELEMON_SQLITE_PRODUCTION=1. It switches to
+# write-ahead logging so writers no longer block readers, tunes the page cache, memory
+# mapping and busy timeout of every connection, and keeps connections for CONN_MAX_AGE
+# seconds instead of opening one per request.
+SQLITE_TUNING = {
+    'ENABLED': os.environ.get('LITTLELEMON_SQLITE_PRODUCTION') == '1',
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    'CACHE_SIZE': -20000,
+    'MMAP_SIZE': 256 * 1024 * 1024,
+    'BUSY_TIMEOUT': 5000,
+    'CONN_MAX_AGE': 600,
+}
+
+# Read replicas, as aliases of DATABASES. Safe requests read from one of them unless their
+# client wrote in the last REPLICA_STICKY_SECONDS, and then read their own writes from the
+# primary. LITTLELEMON_REPLICA_DB adds a replica that is kept in sync outside of Django.
+DATABASE_ROUTERS = ['LittleLemonAPI.routers.ReplicaRouter']
+REPLICA_DATABASES = []
+REPLICA_STICKY_SECONDS = 5
+
+if os.environ.get('LITTLELEMON_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['LITTLELEMON_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append('replica')
+
+# Serves the menu and order reads from the async views of LittleLemonAPI/async_views.py,
+# which only pays off when running under ASGI. On with LITTLELEMON_ASYNC_VIEWS=1.
+ASYNC_READ_VIEWS = os.environ.get('LITTLELEMON_ASYNC_VIEWS') == '1'
+
+# Identical menu and order GETs arriving while the first one is being computed wait for its
+# result instead of running the same queries (LittleLemonAPI/coalesce.py). Order reads are
+# only shared between requests of the same user. Waiters give up after TIMEOUT seconds
+# and compute their own.
+REQUEST_COALESCING = {
+    'ENABLED': True,
+    'TIMEOUT': 5,
+}
+
+# POST /api/batch runs up to MAX_REQUESTS API calls in one request, authenticated and
+# throttled once. Batches sent with "concurrent": true run their reads on WORKERS threads.
+BATCH_REQUESTS = {
+    'MAX_REQUESTS': 20,
+    'WORKERS': 4,
+}
+
+# Answers menu listings without a search from a sorted copy of the menu kept in each process
+# (LittleLemonAPI/menu_index.py), reloaded after the menu changes. Worth it for large menus.
+MENU_INDEX = os.environ.get('LITTLELEMON_MENU_INDEX') == '1'
+
+# `manage.py archive_orders` moves delivered orders older than AGE_DAYS, BATCH_SIZE at a
+# time, to the archive tables. GET orders/<id> still finds them, GET orders lists them
+# with ?include_archived=1. Run it from cron, or keep it running with --every.
+ORDER_ARCHIVE = {
+    'AGE_DAYS': 365,
+    'BATCH_SIZE': 1000,
+}
+
+from LittleLemonAPI.sqlite import configure_database
+for database in DATABASES.values():
+    configure_database(database, SQLITE_TUNING)
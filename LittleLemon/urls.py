@@ -13,13 +13,14 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.authtoken import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/', include('LittleLemonAPI.urls')),
+    path('api/', include('LittleLemonAPI.async_urls' if settings.ASYNC_READ_VIEWS else 'LittleLemonAPI.urls')),
     path('api/', include('djoser.urls')),
     path(r'token/login', views.obtain_auth_token),
 ]
@@ -0,0 +1,77 @@
+"""Moves delivered orders past a given age out of the order tables into ArchivedOrder and ArchivedOrderItem
+
+The live tables then only hold recent and undelivered orders, which every order listing and lookup reads.
+Archived orders keep their ids and columns. GET orders/<id> falls back to the archive and GET orders
+includes it with ?include_archived=1. The sales rollup is left as is, archived sales still count.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from .models import Order, OrderItem, OrderEvent, ArchivedOrder, ArchivedOrderItem
+from . import conditional
+import datetime
+
+ORDER_COLUMNS = ['id', 'user_id', 'delivery_crew_id', 'status', 'total', 'date', 'item_count', 'crew_username']
+ITEM_COLUMNS = ['id', 'order_id', 'menuitem_id', 'quantity', 'unit_price', 'price']
+
+
+def archive_settings():
+  options = {'AGE_DAYS': 365, 'BATCH_SIZE': 1000}
+  options.update(getattr(settings, 'ORDER_ARCHIVE', {}))
+  return options
+
+
+def archivable(older_than):
+  """The delivered orders dated before older_than whose outbox rows were all processed"""
+  pending = OrderEvent.objects.filter(order=OuterRef('pk'), processed__isnull=True)
+  return Order.objects.filter(status=True, date__lt=older_than).exclude(Exists(pending))
+
+
+def _table(model):
+  return connection.ops.quote_name(model._meta.db_table)
+
+
+def _copy(cursor, source, target, columns, key, ids):
+  names = ', '.join(connection.ops.quote_name(column) for column in columns)
+  cursor.execute(
+    'INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s IN (%s)' % (_table(target), names, names, _table(source), key, ', '.join(['%s'] * len(ids))),
+    ids,
+  )
+  return cursor.rowcount
+
+
+def _delete(cursor, model, key, ids):
+  cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (_table(model), key, ', '.join(['%s'] * len(ids))), ids)
+
+
+def archive_batch(older_than, batch_size):
+  """Archives the oldest batch_size archivable orders in one transaction, returning (orders, items) moved"""
+  with transaction.atomic():
+    ids = list(archivable(older_than).order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+      return 0, 0
+    # Plain SQL, since deleting through the ORM would take the orders out of the sales rollup
+    with connection.cursor() as cursor:
+      _copy(cursor, Order, ArchivedOrder, ORDER_COLUMNS, 'id', ids)
+      items = _copy(cursor, OrderItem, ArchivedOrderItem, ITEM_COLUMNS, 'order_id', ids)
+      _delete(cursor, OrderEvent, 'order_id', ids)
+      _delete(cursor, OrderItem, 'order_id', ids)
+      _delete(cursor, Order, 'id', ids)
+    conditional.bump_on_commit('orders')
+  return len(ids), items
+
+
+def archive_orders(age_days=None, batch_size=None, max_batches=None, today=None):
+  """Archives every delivered order older than age_days, batch by batch, returning (orders, items) moved"""
+  options = archive_settings()
+  age_days = options['AGE_DAYS'] if age_days is None else age_days
+  older_than = (today or datetime.date.today()) - datetime.timedelta(days=age_days)
+  orders = items = batches = 0
+  while max_batches is None or batches < max_batches:
+    moved_orders, moved_items = archive_batch(older_than, batch_size or options['BATCH_SIZE'])
+    if not moved_orders:
+      break
+    orders += moved_orders
+    items += moved_items
+    batches += 1
+  return orders, items
@@ -0,0 +1,10 @@
+from django.urls import path
+from . import async_views, urls
+
+# The routes of urls.py with the menu and order reads served by async views, which only pays off under ASGI
+urlpatterns = [
+  path('menu-items', async_views.menu_items),
+  path('menu-items/<int:id>', async_views.single_menu_item),
+  path('orders', async_views.orders),
+  path('orders/<int:id>', async_views.single_order),
+] + urls.urlpatterns
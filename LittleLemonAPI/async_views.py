@@ -0,0 +1,162 @@
+"""Async versions of the menu and order reads, routed by async_urls.py when ASYNC_READ_VIEWS is on
+
+They read the database through the async ORM, so under ASGI a request waiting on the database or on a
+slow client holds no worker thread. The in-process caches are read directly. The listings read their
+parameters and build their querysets with listings.py, as the sync views do. Every other method on
+these routes is handed to the sync view in views.py.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from .models import MenuItem, Order, ArchivedOrder
+from .serializers import MenuItemSerializer, MenuItemListSerializer, OrderItemListSerializer
+from .authentication import CachingTokenAuthentication
+from .cache import menu_cache
+from .menu_index import menu_index
+from .conditional import conditional
+from .coalesce import coalesce
+from .pagination import InvalidCursor
+from .renderers import FastJSONRenderer
+from .roles import aget_roles
+from .throttling import UserRateThrottle, AnonRateThrottle
+from . import listings, views
+import functools
+
+ASYNC_METHODS = ('GET', 'HEAD')
+
+
+def json_response(data, status=status.HTTP_200_OK):
+  return HttpResponse(FastJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def error_response(error):
+  """The response DRF's exception handler gives for an APIException"""
+  response = json_response({"detail": error.detail}, error.status_code)
+  if isinstance(error, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+    response.status_code = status.HTTP_401_UNAUTHORIZED
+    response['WWW-Authenticate'] = CachingTokenAuthentication.keyword
+  if getattr(error, 'wait', None):
+    response['Retry-After'] = '%d' % error.wait
+  return response
+
+
+async def check_request(request, throttle_classes, authenticated):
+  """Authentication, permission and throttling as DRF runs them before a view, raising an APIException"""
+  result = await CachingTokenAuthentication().aauthenticate(request)
+  request.user, request.auth = result or (AnonymousUser(), None)
+  if authenticated and not request.user.is_authenticated:
+    raise exceptions.NotAuthenticated()
+
+  waits = []
+  for throttle_class in throttle_classes:
+    throttle = throttle_class()
+    if not await throttle.aallow_request(request, None):
+      waits.append(throttle.wait())
+  if waits:
+    raise exceptions.Throttled(max((wait for wait in waits if wait is not None), default=None))
+
+
+def async_api_view(sync_view, throttle_classes, authenticated=False):
+  """Serves GET and HEAD with the decorated coroutine and every other method with the sync DRF view"""
+  def decorator(view):
+    @csrf_exempt
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+      if request.method not in ASYNC_METHODS:
+        return await sync_to_async(sync_view)(request, *args, **kwargs)
+      try:
+        await check_request(request, throttle_classes, authenticated)
+      except exceptions.APIException as error:
+        return error_response(error)
+      return await view(request, *args, **kwargs)
+    return wrapper
+  return decorator
+
+
+@async_api_view(views.menu_items, [UserRateThrottle, AnonRateThrottle])
+@conditional('menu')
+@coalesce('menu')
+async def menu_items(request):
+  listing = listings.MenuListing(request.GET)
+  if listing.message:
+    return json_response({"message": listing.message}, status.HTTP_400_BAD_REQUEST)
+
+  cache_key = menu_cache.make_key(listing.cache_params())
+  cached_items = menu_cache.get(cache_key)
+  if cached_items is not None:
+    return json_response(cached_items)
+
+  index = None
+  if listing.uses_index(menu_index.enabled()):
+    # Loading the index reads the database, which only happens once per menu change
+    index = menu_index.fresh() or await sync_to_async(menu_index.current)()
+  if index is not None:
+    try:
+      data = listing.from_index(index)
+    except InvalidCursor:
+      return json_response({"message": "Invalid cursor"}, status.HTTP_400_BAD_REQUEST)
+    if data is not None:
+      views.cache_menu_page(cache_key, data)
+      return json_response(data)
+
+  # Checking for the full-text index queries the database the first time
+  menu_items = await sync_to_async(listing.queryset)() if listing.search else listing.queryset()
+  if listing.cursor is not None:
+    try:
+      menu_items, next_cursor = await listing.keyset(menu_items).apage(listing.cursor)
+    except InvalidCursor:
+      return json_response({"message": "Invalid cursor"}, status.HTTP_400_BAD_REQUEST)
+    data = {"results": await MenuItemListSerializer(menu_items).adata(), "next": next_cursor}
+  else:
+    menu_items = listing.ordered(menu_items)
+    # Counted here so the paginator does not count synchronously
+    data = await MenuItemListSerializer(listing.offset_page(menu_items, await menu_items.acount())).adata()
+  views.cache_menu_page(cache_key, data)
+  return json_response(data)
+
+
+@async_api_view(views.single_menu_item, [UserRateThrottle], authenticated=True)
+@conditional('menu')
+@coalesce('menu')
+async def single_menu_item(request, id):
+  try:
+    item = await MenuItem.objects.aget(pk=id)
+  except MenuItem.DoesNotExist:
+    return json_response({"message": "The item does not exist"}, status.HTTP_404_NOT_FOUND)
+  return json_response(MenuItemSerializer(item).data)
+
+
+@async_api_view(views.orders, [UserRateThrottle], authenticated=True)
+@conditional('orders', per_user=True)
+@coalesce('orders', per_user=True)
+async def orders(request):
+  listing = listings.OrderListing(request.GET, listings.visible_orders(await aget_roles(request), request.user))
+  if listing.message:
+    return json_response({"message": listing.message}, status.HTTP_400_BAD_REQUEST)
+
+  if listing.cursor is None:
+    data = []
+    for rows in listing.unpaged():
+      # Prefetching the items of an expanded listing needs the rows read first
+      data += await listing.serializer_class([order async for order in rows] if listing.expand else rows).adata()
+    return json_response(data)
+
+  try:
+    orders, next_cursor = await listing.keyset().apage_across(listing.archived, listing.cursor)
+  except InvalidCursor:
+    return json_response({"message": "Invalid cursor"}, status.HTTP_400_BAD_REQUEST)
+  return json_response({"results": await listing.serializer_class(orders).adata(), "next": next_cursor})
+
+
+@async_api_view(views.single_order, [UserRateThrottle], authenticated=True)
+@conditional('orders', per_user=True)
+@coalesce('orders', per_user=True)
+async def single_order(request, id):
+  order = await Order.objects.filter(pk=id).afirst() or await ArchivedOrder.objects.filter(pk=id).afirst()
+  if order is None:
+    return json_response({"detail": "No Order matches the given query."}, status.HTTP_404_NOT_FOUND)
+  if order.user_id != request.user.id:
+    return json_response({"message": "This order is not yours."}, status.HTTP_403_FORBIDDEN)
+  return json_response(await OrderItemListSerializer(order.orderitem_set.all()).adata())
@@ -0,0 +1,179 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from .shared import shared_cache
+import copy
+import threading
+import time
+
+
+def _revoked_key(user_id):
+  return 'token-cache:revoked:%s' % user_id
+
+
+class TokenCache:
+  """In-process least recently used cache of token key -> (user, token), each entry living TIMEOUT seconds
+
+  Signals drop entries when a token is deleted, a user changes or a group membership changes. They also
+  store the time of the change for the user in the shared cache, and every hit checks it, so the entries
+  other processes read before the change stop being served at once.
+  """
+
+  def __init__(self, max_entries=10000, timeout=30):
+    self.max_entries = max_entries
+    self.timeout = timeout
+    self._entries = OrderedDict()
+    self._keys_by_user = {}
+    self._lock = threading.Lock()
+    # Bumped by every invalidation, so a lookup that raced with one does not store what it read
+    self._generation = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+
+  def generation(self):
+    """Taken before reading the token, the local generation and the time the read started"""
+    return self._generation, time.time()
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or entry[0] < time.monotonic():
+        if entry is not None:
+          self._remove(key)
+        self.misses += 1
+        return None
+    revoked = shared_cache().get(_revoked_key(entry[1][0].pk))
+    with self._lock:
+      if revoked is not None and revoked >= entry[2]:
+        # Changed in some process after the entry was read
+        if self._entries.get(key) is entry:
+          self._remove(key)
+          self.invalidations += 1
+        self.misses += 1
+        return None
+      if key in self._entries:
+        self._entries.move_to_end(key)
+      self.hits += 1
+      return entry[1]
+
+  def set(self, key, value, generation):
+    user = value[0]
+    generation, read_at = generation
+    with self._lock:
+      if generation != self._generation:
+        return
+      self._entries[key] = (time.monotonic() + self.timeout, value, read_at)
+      self._entries.move_to_end(key)
+      self._keys_by_user.setdefault(user.pk, set()).add(key)
+      while len(self._entries) > self.max_entries:
+        self._remove(next(iter(self._entries)))
+        self.evictions += 1
+
+  def _remove(self, key):
+    expires, (user, token), read_at = self._entries.pop(key)
+    keys = self._keys_by_user.get(user.pk)
+    if keys is not None:
+      keys.discard(key)
+      if not keys:
+        del self._keys_by_user[user.pk]
+
+  def revoke(self, user_ids):
+    """Tells every process that entries of these users read until now are stale"""
+    now = time.time()
+    # Kept past the longest an entry lives, after which no entry read before the change remains
+    shared_cache().set_many({_revoked_key(user_id): now for user_id in user_ids}, self.timeout + 1)
+
+  def forget_token(self, key, user_id=None):
+    if user_id is not None:
+      self.revoke([user_id])
+    with self._lock:
+      self._generation += 1
+      if key in self._entries:
+        self._remove(key)
+        self.invalidations += 1
+
+  def forget_users(self, user_ids):
+    self.revoke(user_ids)
+    with self._lock:
+      self._generation += 1
+      for user_id in user_ids:
+        for key in list(self._keys_by_user.get(user_id, ())):
+          self._remove(key)
+          self.invalidations += 1
+
+  def clear(self):
+    with self._lock:
+      self._generation += 1
+      self._entries.clear()
+      self._keys_by_user.clear()
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      "entries": len(self._entries),
+      "max_entries": self.max_entries,
+      "timeout": self.timeout,
+      "hits": self.hits,
+      "misses": self.misses,
+      "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+      "evictions": self.evictions,
+      "invalidations": self.invalidations,
+    }
+
+
+def build_token_cache():
+  options = getattr(settings, 'TOKEN_CACHE', {})
+  return TokenCache(max_entries=options.get('MAX_ENTRIES', 10000), timeout=options.get('TIMEOUT', 30))
+
+
+token_cache = build_token_cache()
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+  """TokenAuthentication that skips the token and user query for recently seen tokens
+
+  Group memberships are not part of the entry, they are resolved by roles.user_roles() on every request.
+  """
+
+  def authenticate_credentials(self, key):
+    entry = token_cache.get(key)
+    if entry is None:
+      generation = token_cache.generation()
+      entry = super().authenticate_credentials(key)
+      token_cache.set(key, entry, generation)
+    user, token = entry
+    # Each request gets its own copy, so nothing a view caches on the user leaks into the next request
+    return copy.copy(user), token
+
+  async def aauthenticate(self, request):
+    """authenticate() for async views, reading unknown tokens through the async ORM"""
+    auth = get_authorization_header(request).split()
+    if not auth or auth[0].lower() != self.keyword.lower().encode():
+      return None
+    if len(auth) == 1:
+      raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+    if len(auth) > 2:
+      raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain spaces.'))
+    try:
+      key = auth[1].decode()
+    except UnicodeError:
+      raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain invalid characters.'))
+
+    entry = token_cache.get(key)
+    if entry is None:
+      generation = token_cache.generation()
+      model = self.get_model()
+      try:
+        token = await model.objects.select_related('user').aget(key=key)
+      except model.DoesNotExist:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+      if not token.user.is_active:
+        raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+      entry = (token.user, token)
+      token_cache.set(key, entry, generation)
+    user, token = entry
+    return copy.copy(user), token
@@ -0,0 +1,150 @@
+"""Runs the sub-requests of a POST to /api/batch in-process, against the routes of urls.py
+
+The batch is authenticated and throttled once, by the batch view. Each sub-request then goes straight to
+its view as the same user with the throttles skipped, but without the middleware: it is not counted in
+the route metrics and is never answered with a 304. Writes run in order, each committing on its own as a
+separate call would. With concurrent on, the reads between two writes run together on a thread pool.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from urllib.parse import unquote_to_bytes
+from . import routers
+import contextvars
+import io
+import json
+import threading
+
+PREFIX = '/api/'
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+# Headers that belong to the batch itself rather than to its sub-requests
+BATCH_HEADERS = ('CONTENT_TYPE', 'CONTENT_LENGTH', 'QUERY_STRING', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE')
+
+
+def batch_settings():
+  options = {'MAX_REQUESTS': 20, 'WORKERS': 4}
+  options.update(getattr(settings, 'BATCH_REQUESTS', {}))
+  return options
+
+
+class SubRequest:
+  def __init__(self, method, path, query, body, match):
+    self.method = method
+    self.path = path
+    self.query = query
+    self.body = body
+    self.match = match
+
+
+def parse(specs):
+  """Validates the [{"method", "path", "body"}] of a batch and resolves their views, raising a ValidationError"""
+  limit = batch_settings()['MAX_REQUESTS']
+  if not isinstance(specs, list) or not specs:
+    raise ValidationError({"requests": ["Send a list of requests"]})
+  if len(specs) > limit:
+    raise ValidationError({"requests": ["A batch is limited to %d requests" % limit]})
+
+  subs, errors = [], []
+  for index, spec in enumerate(specs):
+    if not isinstance(spec, dict) or not isinstance(spec.get('path'), str):
+      errors.append("Request %d needs a path" % index)
+      continue
+    method = str(spec.get('method', 'GET')).upper()
+    path, separator, query = spec['path'].partition('?')
+    if method not in METHODS:
+      errors.append("Request %d: %s is not allowed" % (index, method))
+      continue
+    try:
+      match = resolve('/' + path[len(PREFIX):], urlconf='LittleLemonAPI.urls') if path.startswith(PREFIX) else None
+    except Resolver404:
+      match = None
+    if match is None:
+      errors.append("Request %d: %s is not an API route" % (index, path))
+    elif getattr(match.func, 'cls', None) is None or match.route == 'batch':
+      # Streams and the batch route itself
+      errors.append("Request %d: %s cannot be batched" % (index, path))
+    else:
+      subs.append(SubRequest(method, path, query, spec.get('body'), match))
+  if errors:
+    raise ValidationError({"requests": errors})
+  return subs
+
+
+def build_request(request, sub):
+  """The sub-request as the WSGI request its view expects, already authenticated as the batch's user"""
+  environ = {key: value for key, value in request.META.items() if key not in BATCH_HEADERS}
+  body = b'' if sub.body is None else json.dumps(sub.body).encode()
+  environ.update({
+    'REQUEST_METHOD': sub.method,
+    'SCRIPT_NAME': '',
+    'PATH_INFO': unquote_to_bytes(sub.path).decode('iso-8859-1'),
+    'QUERY_STRING': sub.query,
+    'CONTENT_TYPE': 'application/json',
+    'CONTENT_LENGTH': str(len(body)),
+    'wsgi.input': io.BytesIO(body),
+  })
+  sub_request = WSGIRequest(environ)
+  # Picked up by DRF instead of running the authenticators again
+  sub_request._force_auth_user = request.user
+  sub_request._force_auth_token = request.auth
+  sub_request.batched = True
+  return sub_request
+
+
+def run(request, sub):
+  response = sub.match.func(build_request(request, sub), *sub.match.args, **sub.match.kwargs)
+  if not isinstance(response, Response):
+    response.close()
+    return {"status": 400, "body": {"message": "This route cannot be batched"}}
+  return {"status": response.status_code, "body": response.data}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+  """The threads shared by every concurrent batch of the process, started on first use"""
+  global _pool
+  with _pool_lock:
+    if _pool is None:
+      _pool = ThreadPoolExecutor(max_workers=batch_settings()['WORKERS'], thread_name_prefix='batch')
+    return _pool
+
+
+def run_in_thread(request, sub):
+  # The pool's threads keep their connections for CONN_MAX_AGE, as request threads do
+  close_old_connections()
+  try:
+    return run(request, sub)
+  finally:
+    close_old_connections()
+
+
+def execute(request, subs, concurrent=False):
+  """The {"status", "body"} of each sub-request, in the order they were sent"""
+  if not concurrent:
+    return [run(request, sub) for sub in subs]
+
+  results = [None] * len(subs)
+  reads = []
+
+  def collect():
+    for index, future in reads:
+      results[index] = future.result()
+    reads.clear()
+
+  for index, sub in enumerate(subs):
+    if sub.method in routers.SAFE_METHODS:
+      # Each read sees the batch's context, such as whether reads go to a replica
+      reads.append((index, pool().submit(contextvars.copy_context().run, run_in_thread, request, sub)))
+    else:
+      # A write waits for the reads sent before it, and the reads after it wait for the write
+      collect()
+      results[index] = run(request, sub)
+  collect()
+  return results
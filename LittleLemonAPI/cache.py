@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from . import conditional
+import hashlib
+import threading
+import time
+
+
+class LocalMenuCache:
+  """In-process least recently used cache for menu listing pages"""
+
+  def __init__(self, max_entries=512, timeout=300):
+    self.max_entries = max_entries
+    self.timeout = timeout
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+    self._version = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def make_key(self, params):
+    # The key is bound to the catalog version at lookup time, so a page computed while the
+    # catalog changes is stored under an outdated version and never served. The shared menu
+    # version is part of it too, for changes made by other processes.
+    return (self._version, conditional.version('menu')[0], params)
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or entry[0] < time.monotonic():
+        if entry is not None:
+          del self._entries[key]
+        self.misses += 1
+        return None
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return entry[1]
+
+  def set(self, key, value):
+    with self._lock:
+      if key[0] != self._version:
+        return
+      self._entries[key] = (time.monotonic() + self.timeout, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def bump_version(self):
+    with self._lock:
+      self._version += 1
+      self._entries.clear()
+
+  def clear(self):
+    self.bump_version()
+
+  def stats(self):
+    return {
+      "backend": "local",
+      "version": self._version,
+      "entries": len(self._entries),
+      "max_entries": self.max_entries,
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+    }
+
+
+class DjangoMenuCache:
+  """Stores menu listing pages in a Django cache backend so they can be shared between processes"""
+
+  version_key = 'menu-catalog:version'
+
+  def __init__(self, alias='default', timeout=300):
+    self.alias = alias
+    self.timeout = timeout
+    self.hits = 0
+    self.misses = 0
+
+  @property
+  def cache(self):
+    return caches[self.alias]
+
+  def version(self):
+    return self.cache.get_or_set(self.version_key, 0, timeout=None)
+
+  def make_key(self, params):
+    digest = hashlib.sha1(repr(params).encode()).hexdigest()
+    return 'menu-catalog:%d:%s' % (self.version(), digest)
+
+  def get(self, key):
+    value = self.cache.get(key)
+    if value is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return value
+
+  def set(self, key, value):
+    self.cache.set(key, value, timeout=self.timeout)
+
+  def bump_version(self):
+    self.cache.add(self.version_key, 0, timeout=None)
+    self.cache.incr(self.version_key)
+
+  def clear(self):
+    self.bump_version()
+
+  def stats(self):
+    # Evictions happen inside the cache backend and cannot be observed from here
+    return {
+      "backend": self.alias,
+      "version": self.version(),
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": None,
+    }
+
+
+def build_menu_cache():
+  options = dict(getattr(settings, 'MENU_CACHE', {}))
+  backend = import_string(options.pop('BACKEND', 'LittleLemonAPI.cache.LocalMenuCache'))
+  return backend(**{name.lower(): value for name, value in options.items()})
+
+
+menu_cache = build_menu_cache()
@@ -0,0 +1,54 @@
+from django.core import exceptions
+from django.db.models import Sum, F, Window
+from rest_framework.exceptions import ValidationError
+from .models import Cart, MenuItem
+from .reports import CENTS
+from decimal import Decimal
+
+
+def fits(field, value):
+  """Whether a computed amount fits the digits of the decimal column it is stored in"""
+  try:
+    field.run_validators(field.to_python(value))
+  except exceptions.ValidationError:
+    return False
+  return True
+
+
+def add_to_cart(user, lines):
+  """Sets the quantity of each (title, quantity) line in a user's cart, in one query for the items and one upsert"""
+  quantities = dict(lines)
+  items = {}
+  for item in MenuItem.objects.filter(title__in=list(quantities)).only('id', 'title', 'price').order_by('id'):
+    items.setdefault(item.title, item)
+  unknown = [title for title in quantities if title not in items]
+  if unknown:
+    raise ValidationError({"menu item": ["Unknown menu item %s" % title for title in unknown]})
+
+  rows = [
+    Cart(user=user, menuitem=items[title], quantity=quantity, unit_price=items[title].price, price=items[title].price * quantity)
+    for title, quantity in quantities.items()
+  ]
+  too_large = [row for row in rows if not fits(Cart._meta.get_field('price'), row.price)]
+  if too_large:
+    raise ValidationError({"quantity": ["%d of %s cost more than a cart line can hold" % (row.quantity, row.menuitem.title) for row in too_large]})
+  # The unique (menuitem, user) constraint turns adding an item already in the cart into an update
+  Cart.objects.bulk_create(
+    rows, update_conflicts=True, unique_fields=['menuitem', 'user'], update_fields=['quantity', 'unit_price', 'price'],
+  )
+  return rows
+
+
+def cart_contents(user):
+  """The rows of a user's cart with their titles and the cart total, read in one joined query"""
+  rows = list(
+    Cart.objects.filter(user=user).order_by('id')
+    .values('quantity', 'unit_price', 'price', title=F('menuitem__title'))
+    .annotate(total=Window(Sum('price')))
+  )
+  total = Decimal(rows[0]['total']).quantize(CENTS) if rows else Decimal('0.00')
+  items = [
+    {"menuitem": row['title'], "quantity": row['quantity'], "unit price": row['unit_price'], "price": row['price']}
+    for row in rows
+  ]
+  return items, total
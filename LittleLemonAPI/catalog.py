@@ -0,0 +1,148 @@
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from .models import Category, MenuItem
+from .serializers import MenuItemImportSerializer
+from .cache import menu_cache
+from . import conditional
+import csv
+import itertools
+import json
+import time
+
+EXPORT_FIELDS = ['title', 'price', 'featured', 'category']
+
+
+class ImportReport:
+  def __init__(self):
+    self.created = 0
+    self.updated = 0
+    self.unchanged = 0
+    self.errors = []
+    self._start = time.perf_counter()
+
+  @property
+  def rows(self):
+    return self.created + self.updated + self.unchanged + len(self.errors)
+
+  def as_dict(self, max_errors=100):
+    seconds = time.perf_counter() - self._start
+    return {
+      "created": self.created,
+      "updated": self.updated,
+      "unchanged": self.unchanged,
+      "invalid": len(self.errors),
+      "errors": self.errors[:max_errors],
+      "seconds": round(seconds, 3),
+      "rows_per_second": round(self.rows / seconds) if seconds else None,
+    }
+
+
+def read_lines(stream):
+  """Decoded lines of a binary stream, read one at a time so the upload is never held in memory"""
+  for line in iter(stream.readline, b''):
+    yield line.decode('utf-8-sig')
+
+
+def parse_csv(lines):
+  """(line number, row) pairs of a CSV file with a title,price,featured,category header"""
+  reader = csv.DictReader(lines)
+  for row in reader:
+    yield reader.line_num, row
+
+
+def parse_ndjson(lines):
+  """(line number, row) pairs of a file with one JSON object per line"""
+  for number, line in enumerate(lines, start=1):
+    if line.strip():
+      try:
+        yield number, json.loads(line)
+      except ValueError:
+        yield number, None
+
+
+PARSERS = {
+  'csv': parse_csv,
+  'ndjson': parse_ndjson,
+}
+
+
+def import_menu(rows, batch_size=1000, report=None):
+  """Creates or updates menu items, matched on their title, in one transaction per batch"""
+  report = report or ImportReport()
+  rows = iter(rows)
+  # One serializer validates every row, building its fields once rather than per row
+  validator = MenuItemImportSerializer()
+  while True:
+    batch = list(itertools.islice(rows, batch_size))
+    if not batch:
+      break
+    _import_batch(batch, report, validator)
+  # Bulk writes send no signals, so cached menu pages are dropped here once the import is done
+  transaction.on_commit(menu_cache.bump_version)
+  conditional.bump_on_commit('menu')
+  return report
+
+
+def _import_batch(batch, report, validator):
+  valid = {}
+  for number, row in batch:
+    if not isinstance(row, dict):
+      report.errors.append({"line": number, "errors": "Not an object"})
+      continue
+    try:
+      data = validator.run_validation(row)
+    except ValidationError as error:
+      report.errors.append({"line": number, "errors": error.detail})
+      continue
+    # The last row wins when a title appears twice in the same batch
+    valid[data['title']] = (number, data)
+
+  slugs = {data['category'] for number, data in valid.values()}
+  categories = {}
+  for category in Category.objects.filter(slug__in=slugs):
+    categories.setdefault(category.slug, category)
+
+  with transaction.atomic():
+    existing = {}
+    for item in MenuItem.objects.filter(title__in=list(valid)):
+      existing.setdefault(item.title, item)
+
+    to_create, to_update = [], []
+    for title, (number, data) in valid.items():
+      category = categories.get(data['category'])
+      if category is None:
+        report.errors.append({"line": number, "errors": {"category": ["Unknown category %s" % data['category']]}})
+        continue
+      item = existing.get(title)
+      if item is None:
+        to_create.append(MenuItem(title=title, price=data['price'], featured=data['featured'], category=category))
+      elif (item.price, item.featured, item.category_id) == (data['price'], data['featured'], category.id):
+        report.unchanged += 1
+      else:
+        item.price, item.featured, item.category = data['price'], data['featured'], category
+        to_update.append(item)
+
+    MenuItem.objects.bulk_create(to_create)
+    MenuItem.objects.bulk_update(to_update, ['price', 'featured', 'category'])
+  report.created += len(to_create)
+  report.updated += len(to_update)
+
+
+class EchoBuffer:
+  """Lets csv.writer hand each written line back instead of buffering it"""
+
+  def write(self, value):
+    return value
+
+
+def export_menu(file_format='csv', chunk_size=2000):
+  """Yields the whole catalog as CSV or NDJSON lines, reading it from the database in chunks"""
+  rows = MenuItem.objects.order_by('id').values_list('title', 'price', 'featured', 'category__slug').iterator(chunk_size=chunk_size)
+  if file_format == 'csv':
+    writer = csv.writer(EchoBuffer())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+      yield writer.writerow(row)
+  else:
+    for title, price, featured, category in rows:
+      yield json.dumps({"title": title, "price": str(price), "featured": featured, "category": category}) + '\n'
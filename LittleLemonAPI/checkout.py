@@ -0,0 +1,32 @@
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from .models import Cart, Order, OrderItem, OrderEvent
+from .carts import fits
+from .dispatch import order_placed
+from . import reports
+import datetime
+
+
+def checkout(user):
+  """Turns a user's cart into an order in a single transaction and returns the order"""
+
+  with transaction.atomic():
+    # Cart rows already hold validated prices, so only the foreign key id of the menu item is needed
+    cart = list(Cart.objects.filter(user=user).only('id', 'menuitem_id', 'quantity', 'unit_price', 'price'))
+    total = sum((row.price for row in cart), 0)
+    if not fits(Order._meta.get_field('total'), total):
+      raise ValidationError({"message": "The cart costs more than an order can hold"})
+    order = Order.objects.create(user=user, total=total, date=datetime.date.today(), item_count=len(cart))
+    OrderItem.objects.bulk_create([
+      OrderItem(order=order, menuitem_id=row.menuitem_id, quantity=row.quantity, unit_price=row.unit_price, price=row.price)
+      for row in cart
+    ])
+    if reports.rollup_enabled():
+      reports.record_sales(order.date, [(row.menuitem_id, row.quantity, row.price) for row in cart])
+    # Only the rows that were read are deleted, so items added concurrently stay in the cart
+    Cart.objects.filter(pk__in=[row.pk for row in cart]).delete()
+    # The outbox row commits with the order, so the dispatcher picks it up even after a restart
+    OrderEvent.objects.create(order=order)
+    transaction.on_commit(order_placed)
+
+  return order
@@ -0,0 +1,162 @@
+"""Single-flight coalescing of identical GETs that arrive while the first one is still being computed
+
+The first request for a key runs the view. Identical requests arriving before it finishes wait for its
+response data instead of running the same queries, each still authenticated, throttled and rendered
+on its own. The key holds the path, the query string, the versions of the tables the view reads and,
+for per-user views, the user and their roles, so no one is handed data they could not have read.
+"""
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.response import Response
+from .conditional import version
+from .roles import get_roles, aget_roles
+from . import routers
+import asyncio
+import functools
+import threading
+
+COALESCED_METHODS = ('GET',)
+
+
+def coalesce_settings():
+  options = {'ENABLED': True, 'TIMEOUT': 5}
+  options.update(getattr(settings, 'REQUEST_COALESCING', {}))
+  return options
+
+
+class Flight:
+  def __init__(self):
+    self.done = threading.Event()
+    self.response = None
+
+
+class SingleFlight:
+  """Runs one computation per key at a time, handing its result to the callers that asked meanwhile
+
+  Callers that wait longer than the timeout, or whose leader failed or returned a response that cannot
+  be copied, such as a stream, compute their own.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._flights = {}
+    self._async_flights = {}
+    self.leaders = 0
+    self.followers = 0
+    self.timeouts = 0
+
+  def run(self, key, compute, timeout):
+    with self._lock:
+      flight = self._flights.get(key)
+      leader = flight is None
+      if leader:
+        flight = self._flights[key] = Flight()
+        self.leaders += 1
+      else:
+        self.followers += 1
+
+    if leader:
+      try:
+        flight.response = compute()
+        return flight.response
+      finally:
+        with self._lock:
+          del self._flights[key]
+        flight.done.set()
+
+    if not flight.done.wait(timeout):
+      with self._lock:
+        self.timeouts += 1
+      return compute()
+    shared = self._share(flight.response)
+    return shared if shared is not None else compute()
+
+  async def arun(self, key, compute, timeout):
+    """run() for coroutines, coalescing the requests served by the same event loop"""
+    loop = asyncio.get_running_loop()
+    flights = self._async_flights.setdefault(loop, {})
+    flight = flights.get(key)
+    if flight is None:
+      flight = flights[key] = asyncio.ensure_future(compute())
+      with self._lock:
+        self.leaders += 1
+      try:
+        # Shielded, so a leader whose client went away does not cancel the followers' response
+        return await asyncio.shield(flight)
+      finally:
+        del flights[key]
+        if not flights:
+          self._async_flights.pop(loop, None)
+
+    with self._lock:
+      self.followers += 1
+    try:
+      response = await asyncio.wait_for(asyncio.shield(flight), timeout)
+    except asyncio.TimeoutError:
+      with self._lock:
+        self.timeouts += 1
+      return await compute()
+    except Exception:
+      return await compute()
+    shared = self._share(response)
+    return shared if shared is not None else await compute()
+
+  def _share(self, response):
+    """A copy of the leader's response for a follower, or None when it cannot be shared"""
+    if isinstance(response, Response):
+      # Each request renders its own response, only the data is shared
+      return Response(response.data, status=response.status_code)
+    if type(response) is HttpResponse:
+      return HttpResponse(response.content, status=response.status_code, content_type=response['Content-Type'])
+    return None
+
+  def stats(self):
+    with self._lock:
+      return {"leaders": self.leaders, "followers": self.followers, "timeouts": self.timeouts}
+
+  def clear(self):
+    with self._lock:
+      self._flights.clear()
+      self.leaders = self.followers = self.timeouts = 0
+    self._async_flights.clear()
+
+
+single_flight = SingleFlight()
+
+
+def _key(view, request, names, roles):
+  parts = [view.__module__, view.__qualname__, request.path, tuple(sorted((name, tuple(values)) for name, values in request.GET.lists()))]
+  parts += [version(name)[0] for name in names]
+  parts.append(routers.reads_from_replica())
+  if roles is not None:
+    parts += [request.user.pk, tuple(sorted(roles))]
+  return tuple(parts)
+
+
+def coalesce(*names, per_user=False, timeout=None):
+  """Coalesces identical concurrent GETs of the view, see the module docstring
+
+  names are the groups of tables of conditional.version() the view reads. Views whose response depends
+  on the user pass per_user. Followers wait at most timeout seconds, REQUEST_COALESCING's by default.
+  """
+  def decorator(view):
+    if iscoroutinefunction(view):
+      @functools.wraps(view)
+      async def async_wrapper(request, *args, **kwargs):
+        options = coalesce_settings()
+        if request.method not in COALESCED_METHODS or not options['ENABLED']:
+          return await view(request, *args, **kwargs)
+        key = _key(view, request, names, await aget_roles(request) if per_user else None)
+        return await single_flight.arun(key, lambda: view(request, *args, **kwargs), timeout or options['TIMEOUT'])
+      return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+      options = coalesce_settings()
+      if request.method not in COALESCED_METHODS or not options['ENABLED']:
+        return view(request, *args, **kwargs)
+      key = _key(view, request, names, get_roles(request) if per_user else None)
+      return single_flight.run(key, lambda: view(request, *args, **kwargs), timeout or options['TIMEOUT'])
+    return wrapper
+  return decorator
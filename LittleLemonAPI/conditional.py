@@ -0,0 +1,107 @@
+from asgiref.sync import iscoroutinefunction
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from .roles import get_roles, aget_roles
+from .shared import shared_cache, is_shared
+from . import routers
+import functools
+import hashlib
+import time
+import uuid
+
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+
+def _cache_key(name):
+  return 'changes:%s' % name
+
+
+def version(name):
+  """The (token, last modified timestamp) of a group of tables, started afresh if the cache lost it
+
+  Versions live in the shared cache, so a change committed by any process, a management command
+  included, is seen by every other one.
+  """
+  cache = shared_cache()
+  current = cache.get(_cache_key(name))
+  if current is None:
+    current = (uuid.uuid4().hex, int(time.time()))
+    # Concurrent first readers agree on whichever token was stored first
+    if not cache.add(_cache_key(name), current, None):
+      current = cache.get(_cache_key(name), current)
+  return current
+
+
+def bump(name):
+  """Marks the tables as changed, so every validator handed out for them stops matching"""
+  cache = shared_cache()
+  previous = cache.get(_cache_key(name))
+  timestamp = int(time.time())
+  if previous is not None:
+    # Last-Modified has a one second resolution, two changes in the same second still need different dates
+    timestamp = max(timestamp, previous[1] + 1)
+  cache.set(_cache_key(name), (uuid.uuid4().hex, timestamp), None)
+
+
+def bump_on_commit(name):
+  transaction.on_commit(lambda: bump(name))
+
+
+def _validators(request, names, roles):
+  versions = [version(name) for name in names]
+  parts = [request.get_full_path()] + [token for token, timestamp in versions]
+  if roles is not None:
+    parts += [str(request.user.pk), ','.join(sorted(roles))]
+  etag = quote_etag(hashlib.sha1('\n'.join(parts).encode()).hexdigest())
+  return etag, max(timestamp for token, timestamp in versions)
+
+
+def _can_validate(response):
+  # A lagging replica may still serve rows older than the version the validators stand for
+  return response.status_code == 200 and not routers.reads_from_replica()
+
+
+def _with_validators(response, etag, last_modified):
+  response['ETag'] = etag
+  response['Last-Modified'] = http_date(last_modified)
+  return response
+
+
+def conditional(*names, per_user=False):
+  """Answers GET and HEAD with a 304 when the client's ETag or date is still current, before the view runs
+
+  The ETag covers the versions of the named tables and the full path, plus the user and their roles
+  when the response depends on who asks. Works on sync and async views. Without a shared cache the
+  versions could not tell a change made by another process, so no validators are handed out.
+  """
+  def decorator(view):
+    if iscoroutinefunction(view):
+      @functools.wraps(view)
+      async def async_wrapper(request, *args, **kwargs):
+        if request.method not in CONDITIONAL_METHODS or not is_shared():
+          return await view(request, *args, **kwargs)
+
+        etag, last_modified = _validators(request, names, await aget_roles(request) if per_user else None)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+          response = await view(request, *args, **kwargs)
+          if not _can_validate(response):
+            return response
+        return _with_validators(response, etag, last_modified)
+      return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+      if request.method not in CONDITIONAL_METHODS or not is_shared():
+        return view(request, *args, **kwargs)
+
+      etag, last_modified = _validators(request, names, get_roles(request) if per_user else None)
+      response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+      if response is None:
+        response = view(request, *args, **kwargs)
+        if not _can_validate(response):
+          return response
+      return _with_validators(response, etag, last_modified)
+    return wrapper
+  return decorator
@@ -0,0 +1,155 @@
+from collections import deque
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from .models import Order, OrderEvent
+from .roles import DELIVERY_CREW
+from . import conditional, streams
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def dispatch_settings():
+  options = {'IN_PROCESS': False, 'POLL_INTERVAL': 5, 'BATCH_SIZE': 50}
+  options.update(getattr(settings, 'ORDER_DISPATCH', {}))
+  return options
+
+
+class DispatchMetrics:
+  """Counts assignments and keeps the latest assignment latencies, from checkout to assignment"""
+
+  def __init__(self, max_samples=1000):
+    self._lock = threading.Lock()
+    self._latencies = deque(maxlen=max_samples)
+    self.assigned = 0
+    self.unassigned = 0
+
+  def record(self, latency, assigned):
+    with self._lock:
+      self._latencies.append(latency)
+      if assigned:
+        self.assigned += 1
+      else:
+        self.unassigned += 1
+
+  def stats(self):
+    with self._lock:
+      latencies = sorted(self._latencies)
+    def pick(pct):
+      return latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))] if latencies else None
+    return {
+      "assigned": self.assigned,
+      "unassigned": self.unassigned,
+      "latency_p50": pick(50),
+      "latency_p99": pick(99),
+    }
+
+
+metrics = DispatchMetrics()
+
+
+def least_loaded_crew():
+  """The delivery crew member with the fewest undelivered orders"""
+  return User.objects.filter(groups__name=DELIVERY_CREW, is_active=True).annotate(
+    load=Count('delivery_crew', filter=Q(delivery_crew__status=False))
+  ).order_by('load', 'id').first()
+
+
+def assign_delivery(order):
+  """Assigns the order to the least loaded delivery crew member unless someone already has it"""
+  if order.delivery_crew_id is not None:
+    return order.delivery_crew
+  crew = least_loaded_crew()
+  if crew is not None and Order.objects.filter(pk=order.pk, delivery_crew__isnull=True).update(delivery_crew=crew, crew_username=crew.username):
+    order.delivery_crew, order.crew_username = crew, crew.username
+    streams.order_changed(order)
+    # A queryset update sends no signals
+    conditional.bump_on_commit('orders')
+  return crew
+
+
+def process_pending(batch_size=50):
+  """Handles the oldest unprocessed outbox rows and returns how many were processed"""
+  processed = 0
+  for event in OrderEvent.objects.filter(processed__isnull=True).select_related('order').order_by('id')[:batch_size]:
+    with transaction.atomic():
+      # Claiming the row first keeps two workers from handling the same order
+      now = timezone.now()
+      if not OrderEvent.objects.filter(pk=event.pk, processed__isnull=True).update(processed=now):
+        continue
+      crew = assign_delivery(event.order)
+    metrics.record((now - event.created).total_seconds(), crew is not None)
+    processed += 1
+  return processed
+
+
+class DispatchWorker:
+  """Background thread draining the order outbox, woken up on checkout and polling as a fallback"""
+
+  def __init__(self, poll_interval=5, batch_size=50):
+    self.poll_interval = poll_interval
+    self.batch_size = batch_size
+    self._wakeup = threading.Event()
+    self._stopping = threading.Event()
+    self._thread = None
+
+  @property
+  def running(self):
+    return self._thread is not None and self._thread.is_alive()
+
+  def start(self):
+    if not self.running:
+      self._stopping.clear()
+      self._thread = threading.Thread(target=self.run, name='order-dispatch', daemon=True)
+      self._thread.start()
+
+  def stop(self, timeout=None):
+    self._stopping.set()
+    self._wakeup.set()
+    if self._thread is not None:
+      self._thread.join(timeout)
+
+  def notify(self):
+    self._wakeup.set()
+
+  def run(self):
+    while not self._stopping.is_set():
+      self._wakeup.clear()
+      try:
+        while process_pending(self.batch_size) and not self._stopping.is_set():
+          pass
+      except Exception:
+        logger.exception('Order dispatch failed, retrying in %s seconds', self.poll_interval)
+      finally:
+        close_old_connections()
+      self._wakeup.wait(self.poll_interval)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_worker():
+  """Starts the in-process worker when it is enabled, returning it, or None when it is not"""
+  global _worker
+  if _worker is not None and _worker.running:
+    return _worker
+  options = dispatch_settings()
+  if not options['IN_PROCESS']:
+    return None
+  with _worker_lock:
+    if _worker is None:
+      _worker = DispatchWorker(options['POLL_INTERVAL'], options['BATCH_SIZE'])
+    _worker.start()
+  return _worker
+
+
+def order_placed():
+  """Called once a checkout is committed, wakes up the in-process worker when it is enabled"""
+  worker = start_worker()
+  if worker is not None:
+    worker.notify()
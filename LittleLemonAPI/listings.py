@@ -0,0 +1,169 @@
+"""The GET listings of menu items and orders, read from their query parameters, shared by views.py and async_views.py
+
+Each listing validates its parameters and builds its querysets without touching the database, so the
+sync views evaluate them directly and the async views await them.
+"""
+from django.core.paginator import Paginator, EmptyPage
+from django.db.models import Prefetch
+from .models import MenuItem, Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+from .serializers import OrderListSerializer, ExpandedOrderListSerializer
+from .pagination import KeysetPaginator
+from .roles import MANAGER, DELIVERY_CREW
+from .search import search_titles
+
+# Orderings backed by an index, which keyset pagination needs to stay cheap on deep pages
+CURSOR_MENU_ORDERINGS = ['price', '-price', 'title', '-title', 'id', '-id']
+CURSOR_ORDER_ORDERINGS = ['date', '-date', 'id', '-id']
+# Columns read for the items nested by ?expand=items
+EXPANDED_ITEM_FIELDS = ('order_id', 'menuitem_id', 'quantity', 'unit_price', 'price', 'menuitem__title')
+# Values of ?include_archived that add the archived orders to the listing
+INCLUDE_ARCHIVED = ('1', 'true')
+
+
+def read_perpage(value, limit):
+  """The ?perpage of a listing as a number, and the message to answer with when it is not one from 1 to limit"""
+  try:
+    perpage = int(value)
+  except (TypeError, ValueError):
+    return None, "perpage must be a whole number"
+  if perpage < 1:
+    return None, "perpage must be at least 1"
+  if perpage > limit:
+    return None, "You are limited to %d results per page" % limit
+  return perpage, None
+
+
+def with_items(orders, item_model):
+  """The orders with their items and the titles of their menu items prefetched, for ?expand=items"""
+  items = item_model.objects.select_related('menuitem').only(*EXPANDED_ITEM_FIELDS).order_by('id')
+  return orders.prefetch_related(Prefetch('orderitem_set', queryset=items))
+
+
+class MenuListing:
+  """A menu_items GET, filtered by ?category, ?to_price and ?search, ordered by ?ordering and paged by ?page or ?cursor
+
+  message holds what to answer with when the parameters are invalid.
+  """
+
+  def __init__(self, params):
+    self.category = params.get('category')
+    self.to_price = params.get('to_price')
+    self.search = params.get('search')
+    self.ordering = params.get('ordering')
+    self.page = params.get('page', 1)
+    self.cursor = params.get('cursor')
+    self.perpage, self.message = read_perpage(params.get('perpage', 2), 10)
+    if self.message is None and self.cursor is not None and (self.ordering or 'id') not in CURSOR_MENU_ORDERINGS:
+      self.message = "Cursor pagination can only order by price, title or id"
+
+  def cache_params(self):
+    return (self.category, self.to_price, self.search, self.ordering, str(self.page), self.perpage, self.cursor)
+
+  def uses_index(self, index_enabled):
+    # Searches are left to the database
+    return index_enabled and not self.search
+
+  def from_index(self, index):
+    """The data from the in-process index, or None when it cannot answer, raising InvalidCursor for a bad cursor"""
+    return index.listing(self.category, self.to_price, self.ordering, self.page, self.perpage, self.cursor)
+
+  def queryset(self):
+    """The filtered menu items, which checks for the full-text index, and so queries the database, on the first search"""
+    menu_items = MenuItem.objects.all()
+    if self.category:
+      # A numeric category is its id, which skips the join, anything else is its slug
+      if self.category.isdigit():
+        menu_items = menu_items.filter(category_id=self.category)
+      else:
+        menu_items = menu_items.filter(category__slug=self.category)
+    if self.to_price:
+      menu_items = menu_items.filter(price__lte=self.to_price)
+    if self.search:
+      menu_items = search_titles(menu_items, self.search)
+    return menu_items
+
+  def keyset(self, menu_items):
+    """The paginator of a ?cursor= listing, opted into with an empty cursor for the first page"""
+    return KeysetPaginator(menu_items, self.ordering or 'id', self.perpage)
+
+  def ordered(self, menu_items):
+    if self.ordering:
+      ordering_fields = self.ordering.split(',')
+      # Ties go by id, in the direction of the last field, so every page and the menu index agree
+      return menu_items.order_by(*ordering_fields, '-id' if ordering_fields[-1].startswith('-') else 'id')
+    if 'search_rank' in menu_items.query.annotations or 'search_rank' in menu_items.query.extra:
+      # Best matches first when searching through the full-text index
+      return menu_items.order_by('search_rank', 'id')
+    if not self.search:
+      return menu_items.order_by('id')
+    return menu_items
+
+  def offset_page(self, menu_items, count=None):
+    """The rows of the ?page of ordered items, counted beforehand when count is given"""
+    paginator = Paginator(menu_items, per_page=self.perpage)
+    if count is not None:
+      paginator.count = count
+    try:
+      return paginator.page(number=self.page).object_list
+    except EmptyPage:
+      return []
+
+
+def visible_orders(roles, user):
+  """The filter on the orders a user may list: every order for managers, their deliveries for the crew, their own for customers"""
+  if MANAGER in roles:
+    return {}
+  if DELIVERY_CREW in roles:
+    return {'delivery_crew': user}
+  return {'user': user}
+
+
+class OrderListing:
+  """An orders GET, with ?include_archived and ?expand=items, paged by ?cursor with ?ordering and ?perpage
+
+  message holds what to answer with when the parameters are invalid.
+  """
+
+  def __init__(self, params, visible):
+    self.orders = Order.objects.filter(**visible)
+    self.archived = []
+    self.serializer_class = OrderListSerializer
+    self.cursor = params.get('cursor')
+    self.ordering = params.get('ordering', 'id')
+    self.perpage = None
+    self.message = self.read(params, visible)
+
+  def read(self, params, visible):
+    # ?include_archived=1 adds the orders moved to the archive by archive_orders
+    include_archived = params.get('include_archived')
+    if include_archived not in (None, '0', 'false') + INCLUDE_ARCHIVED:
+      return "include_archived is either 1 or 0"
+    if include_archived in INCLUDE_ARCHIVED:
+      self.archived = [ArchivedOrder.objects.filter(**visible)]
+
+    # ?expand=items nests the items of each order, fetched for every order in one query
+    expand = params.get('expand')
+    if expand not in (None, 'items'):
+      return "Only items can be expanded"
+    self.expand = bool(expand)
+    if self.expand:
+      self.orders = with_items(self.orders, OrderItem)
+      self.archived = [with_items(rows, ArchivedOrderItem) for rows in self.archived]
+      self.serializer_class = ExpandedOrderListSerializer
+
+    if self.cursor is None:
+      return None
+    if self.ordering not in CURSOR_ORDER_ORDERINGS:
+      return "Cursor pagination can only order by date or id"
+    self.perpage, message = read_perpage(params.get('perpage', 10), 100)
+    return message
+
+  def unpaged(self):
+    """The querysets listed one after the other without a cursor, the archived orders first as they are the older ones"""
+    if self.archived:
+      return [self.archived[0].order_by('id'), self.orders.order_by('id')]
+    return [self.orders]
+
+  def keyset(self):
+    """The paginator of a ?cursor= listing, which pages across the live and archived orders with page_across()"""
+    return KeysetPaginator(self.orders, self.ordering, self.perpage)
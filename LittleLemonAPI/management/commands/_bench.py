@@ -0,0 +1,157 @@
+"""Shared helpers for the benchmark management commands"""
+from contextlib import contextmanager
+from django.contrib.auth.models import User, Group
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.throttling import SimpleRateThrottle
+from unittest import mock
+from LittleLemonAPI.models import Category, MenuItem, Cart, Order, OrderItem
+from LittleLemonAPI.reports import rebuild_rollup
+from LittleLemonAPI.roles import MANAGER, DELIVERY_CREW
+from LittleLemonAPI.sqlite import configure_database
+import copy
+from decimal import Decimal
+import datetime
+import math
+import random
+import time
+
+
+@contextmanager
+def throwaway_database(path=None):
+  """Runs the block against a freshly migrated test database that is destroyed afterwards
+
+  SQLite test databases live in memory unless a file path is given, which concurrent writers need.
+  """
+  old_name = connection.settings_dict['NAME']
+  old_test_name = connection.settings_dict['TEST'].get('NAME')
+  if path is not None:
+    connection.settings_dict['TEST']['NAME'] = path
+  connection.creation.create_test_db(verbosity=0, autoclobber=True)
+  try:
+    yield
+  finally:
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+    connection.settings_dict['TEST']['NAME'] = old_test_name
+
+
+@contextmanager
+def sqlite_tuning(enabled=True):
+  """Runs the block with the production SQLite tuning on or off, whatever the settings say"""
+  saved = copy.deepcopy(connection.settings_dict)
+  connection.close()
+  overrides = {'ENABLED': enabled}
+  if enabled:
+    configure_database(connection.settings_dict, overrides)
+  try:
+    with override_settings(SQLITE_TUNING=overrides):
+      yield
+  finally:
+    connection.close()
+    connection.settings_dict.clear()
+    connection.settings_dict.update(saved)
+
+
+@contextmanager
+def unthrottled():
+  """Lifts the DRF rate limits, which would otherwise turn most benchmark requests into 429s"""
+  with mock.patch.dict(SimpleRateThrottle.THROTTLE_RATES, {scope: None for scope in SimpleRateThrottle.THROTTLE_RATES}):
+    yield
+
+
+class Dataset:
+  """Users with their tokens, menu items and orders seeded by seed()"""
+
+  def __init__(self):
+    self.admin = None
+    self.managers = []
+    self.crew = []
+    self.customers = []
+    self.tokens = {}
+    self.categories = []
+    self.items = []
+    self.orders = []
+
+
+def seed(users=50, categories=10, items=500, orders=2000, items_per_order=3, cart_items=5, days=90, rng=None):
+  """Fills the current database with a synthetic restaurant of the given size"""
+  rng = rng or random.Random(0)
+  data = Dataset()
+  manager_group = Group.objects.get_or_create(name=MANAGER)[0]
+  crew_group = Group.objects.get_or_create(name=DELIVERY_CREW)[0]
+
+  data.admin = User.objects.create_superuser('bench-admin')
+  people = User.objects.bulk_create([User(username='bench-user-%d' % i) for i in range(users)])
+  managers_count = max(1, users // 20)
+  crew_count = max(1, users // 10)
+  data.managers = people[:managers_count]
+  data.crew = people[managers_count:managers_count + crew_count]
+  data.customers = people[managers_count + crew_count:] or people
+  manager_group.user_set.add(*data.managers)
+  crew_group.user_set.add(*data.crew)
+  for token in Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in [data.admin] + people]):
+    data.tokens[token.user_id] = token.key
+
+  data.categories = Category.objects.bulk_create([
+    Category(slug='category-%d' % i, title='Category %d' % i) for i in range(categories)
+  ])
+  data.items = MenuItem.objects.bulk_create([
+    MenuItem(
+      title='Dish %d' % i, price=Decimal(rng.randint(100, 3000)) / 100,
+      featured=rng.random() < 0.1, category=rng.choice(data.categories),
+    )
+    for i in range(items)
+  ], batch_size=2000)
+
+  today = datetime.date.today()
+  lines = [
+    [(item, rng.randint(1, 3)) for item in rng.sample(data.items, min(items_per_order, len(data.items)))]
+    for _ in range(orders)
+  ]
+  data.orders = Order.objects.bulk_create([
+    Order(
+      user=rng.choice(data.customers), delivery_crew=crew, crew_username=crew.username, status=rng.random() < 0.8,
+      total=sum(item.price * quantity for item, quantity in order_lines), item_count=len(order_lines),
+      date=today - datetime.timedelta(days=rng.randrange(days)),
+    )
+    for order_lines, crew in zip(lines, (rng.choice(data.crew) for _ in lines))
+  ], batch_size=2000)
+  OrderItem.objects.bulk_create([
+    OrderItem(order=order, menuitem=item, quantity=quantity, unit_price=item.price, price=item.price * quantity)
+    for order, order_lines in zip(data.orders, lines)
+    for item, quantity in order_lines
+  ], batch_size=2000)
+
+  Cart.objects.bulk_create([
+    Cart(user=customer, menuitem=item, quantity=1, unit_price=item.price, price=item.price)
+    for customer in data.customers
+    for item in rng.sample(data.items, min(cart_items, len(data.items)))
+  ], batch_size=2000)
+  rebuild_rollup()
+  return data
+
+
+def percentile(samples, pct):
+  """Nearest-rank percentile of a list of samples"""
+  if not samples:
+    return 0.0
+  ordered = sorted(samples)
+  rank = max(1, math.ceil(pct / 100 * len(ordered)))
+  return ordered[rank - 1]
+
+
+class Sample:
+  """Times a block and counts the SQL queries it runs"""
+
+  def __enter__(self):
+    self._queries = CaptureQueriesContext(connection)
+    self._queries.__enter__()
+    self._start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    self.seconds = time.perf_counter() - self._start
+    self._queries.__exit__(*exc)
+    self.queries = len(self._queries)
+    return False
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.archive import archive_orders
+import time
+
+
+class Command(BaseCommand):
+  help = 'Moves delivered orders older than ORDER_ARCHIVE\'s AGE_DAYS to the archive tables, batch by batch'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--age-days', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--max-batches', type=int, default=None)
+    parser.add_argument('--every', type=float, default=None, help='Archive again every so many seconds instead of exiting')
+
+  def handle(self, *args, **options):
+    while True:
+      orders, items = archive_orders(options['age_days'], options['batch_size'], options['max_batches'])
+      self.stdout.write('%d orders and %d order items archived' % (orders, items))
+      if options['every'] is None:
+        return
+      try:
+        time.sleep(options['every'])
+      except KeyboardInterrupt:
+        return
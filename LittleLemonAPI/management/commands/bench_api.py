@@ -0,0 +1,235 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+from LittleLemonAPI.models import MenuItem, Cart, Order
+from LittleLemonAPI.roles import MANAGER, DELIVERY_CREW
+from ._bench import sqlite_tuning, throwaway_database, unthrottled, seed, percentile
+import itertools
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+
+class Worker:
+  """One concurrent client, acting as its own customer so workers do not share carts"""
+
+  def __init__(self, data, index):
+    self.data = data
+    self.index = index
+    self.customer = data.customers[index % len(data.customers)]
+    self.manager = data.managers[index % len(data.managers)]
+    self.crew = data.crew[index % len(data.crew)]
+    self.counter = itertools.count()
+    self._clients = {}
+
+  def client(self, user):
+    if user.pk not in self._clients:
+      client = APIClient()
+      client.credentials(HTTP_AUTHORIZATION='Token ' + self.data.tokens[user.pk])
+      self._clients[user.pk] = client
+    return self._clients[user.pk]
+
+  def unique(self, prefix):
+    return '%s %d-%d' % (prefix, self.index, next(self.counter))
+
+  def item(self):
+    return self.data.items[next(self.counter) % len(self.data.items)]
+
+  def order(self):
+    return self.data.orders[next(self.counter) % len(self.data.orders)]
+
+
+def fill_cart(worker, size=5):
+  Cart.objects.filter(user=worker.customer).delete()
+  items = [worker.item() for _ in range(size)]
+  Cart.objects.bulk_create([Cart(user=worker.customer, menuitem=item, quantity=1, unit_price=item.price, price=item.price) for item in {item.pk: item for item in items}.values()])
+
+
+def new_item(worker):
+  return MenuItem.objects.create(title=worker.unique('Bench dish'), price=5, featured=False, category=worker.data.categories[0])
+
+
+def new_order(worker):
+  return Order.objects.create(user=worker.customer, total=1, date='2023-03-01')
+
+
+def add_to_group(user, name):
+  from django.contrib.auth.models import Group
+  Group.objects.get(name=name).user_set.add(user)
+
+
+def home_screen(worker):
+  """The calls the mobile app makes to draw its home screen"""
+  return [
+    {'path': '/api/menu-items?category=category-%d&perpage=10' % (next(worker.counter) % 10)},
+    {'path': '/api/menu-items?category=category-%d&perpage=10' % (next(worker.counter) % 10)},
+    {'path': '/api/menu-items?category=category-%d&perpage=10' % (next(worker.counter) % 10)},
+    {'path': '/api/cart/menu-items'},
+    {'path': '/api/orders?cursor=&ordering=-date&perpage=20'},
+  ]
+
+
+# Every route of LittleLemonAPI/urls.py, as (name, setup) where setup runs untimed and returns the request to time
+SCENARIOS = [
+  ('GET menu-items', lambda w: (w.customer, 'get', '/api/menu-items', {'page': next(w.counter) % 50 + 1, 'perpage': 10})),
+  ('GET menu-items?category&ordering', lambda w: (w.customer, 'get', '/api/menu-items', {'category': 'category-%d' % (next(w.counter) % 10), 'to_price': '15', 'ordering': 'price', 'perpage': 10})),
+  ('GET menu-items?search', lambda w: (w.customer, 'get', '/api/menu-items', {'search': 'dish %d' % (next(w.counter) % 100)})),
+  ('GET menu-items?cursor', lambda w: (w.customer, 'get', '/api/menu-items', {'cursor': '', 'ordering': 'price', 'perpage': 10})),
+  ('POST menu-items', lambda w: (w.manager, 'post', '/api/menu-items', {'title': w.unique('Bench dish'), 'price': '9.50', 'featured': False, 'category': w.data.categories[0].pk})),
+  ('GET menu-items/<id>', lambda w: (w.customer, 'get', '/api/menu-items/%d' % w.item().pk, None)),
+  ('PATCH menu-items/<id>', lambda w: (w.manager, 'patch', '/api/menu-items/%d' % w.item().pk, {'price': '%d.25' % (next(w.counter) % 20 + 1)})),
+  ('DELETE menu-items/<id>', lambda w: (w.manager, 'delete', '/api/menu-items/%d' % new_item(w).pk, None)),
+  ('GET menu-items/export', lambda w: (w.manager, 'get', '/api/menu-items/export', {'type': 'ndjson'})),
+  ('POST menu-items/import', lambda w: (w.manager, 'import', '/api/menu-items/import', ''.join(
+    '{"title": "%s", "price": "4.00", "category": "category-1"}\n' % w.unique('Imported dish') for _ in range(20)))),
+  ('GET menu-items/cache-stats', lambda w: (w.data.admin, 'get', '/api/menu-items/cache-stats', None)),
+  ('GET groups/manager/users', lambda w: (w.data.admin, 'get', '/api/groups/manager/users', None)),
+  ('POST groups/manager/users', lambda w: (w.data.admin, 'post', '/api/groups/manager/users', {'username': w.customer.username})),
+  ('DELETE groups/manager/users/<id>', lambda w: (add_to_group(w.customer, MANAGER) or w.data.admin, 'delete', '/api/groups/manager/users/%d' % w.customer.pk, None)),
+  ('GET groups/delivery-crew/users', lambda w: (w.manager, 'get', '/api/groups/delivery-crew/users', None)),
+  ('POST groups/delivery-crew/users', lambda w: (w.manager, 'post', '/api/groups/delivery-crew/users', {'username': w.customer.username})),
+  ('DELETE groups/delivery-crew/users/<id>', lambda w: (add_to_group(w.customer, DELIVERY_CREW) or w.manager, 'delete', '/api/groups/delivery-crew/users/%d' % w.customer.pk, None)),
+  ('GET cart/menu-items', lambda w: (fill_cart(w) or w.customer, 'get', '/api/cart/menu-items', None)),
+  ('POST cart/menu-items', lambda w: (w.customer, 'post', '/api/cart/menu-items', {'menu item': w.item().title, 'quantity': 2})),
+  ('POST cart/menu-items (batch)', lambda w: (w.customer, 'post', '/api/cart/menu-items', [{'menu item': w.item().title, 'quantity': 2} for _ in range(10)])),
+  ('DELETE cart/menu-items', lambda w: (fill_cart(w) or w.customer, 'delete', '/api/cart/menu-items', None)),
+  ('GET orders (customer)', lambda w: (w.customer, 'get', '/api/orders', None)),
+  ('GET orders (customer, cursor)', lambda w: (w.customer, 'get', '/api/orders', {'cursor': '', 'ordering': '-date', 'perpage': 20})),
+  ('GET orders (crew, cursor)', lambda w: (w.crew, 'get', '/api/orders', {'cursor': '', 'ordering': '-date', 'perpage': 20})),
+  ('GET orders (manager, cursor)', lambda w: (w.manager, 'get', '/api/orders', {'cursor': '', 'ordering': '-date', 'perpage': 50})),
+  ('GET orders (manager, cursor, expanded)', lambda w: (w.manager, 'get', '/api/orders', {'cursor': '', 'ordering': '-date', 'perpage': 50, 'expand': 'items'})),
+  ('POST orders', lambda w: (fill_cart(w) or w.customer, 'post', '/api/orders', None)),
+  ('GET orders/<id>', lambda w: (w.customer, 'get', '/api/orders/%d' % new_order(w).pk, None)),
+  ('PATCH orders/<id>', lambda w: (w.manager, 'patch', '/api/orders/%d' % w.order().pk, {'status': True})),
+  ('DELETE orders/<id>', lambda w: (w.manager, 'delete', '/api/orders/%d' % new_order(w).pk, None)),
+  ('GET orders/dispatch-stats', lambda w: (w.data.admin, 'get', '/api/orders/dispatch-stats', None)),
+  ('GET reports/sales', lambda w: (w.manager, 'get', '/api/reports/sales', {'group': 'item'})),
+  ('GET metrics', lambda w: (w.data.admin, 'get', '/api/metrics', None)),
+  ('POST batch (home screen)', lambda w: (w.customer, 'post', '/api/batch', {'requests': home_screen(w)})),
+]
+
+
+def send(worker, spec):
+  user, method, path, data = spec
+  client = worker.client(user)
+  if method == 'import':
+    return client.generic('POST', path, data, content_type='application/x-ndjson')
+  if method == 'get':
+    return client.get(path, data)
+  return getattr(client, method)(path, data, format='json')
+
+
+def run_scenario(data, setup, workers, requests):
+  """Runs the requests of one scenario spread over concurrent workers"""
+  latencies, queries, errors = [], [], []
+  lock = threading.Lock()
+  # Setup is untimed, running it one worker at a time keeps its writes from contending with each other
+  setup_lock = threading.Lock()
+  per_worker = [requests // workers + (1 if i < requests % workers else 0) for i in range(workers)]
+
+  def work(index):
+    worker = Worker(data, index)
+    try:
+      for _ in range(per_worker[index]):
+        try:
+          with setup_lock:
+            spec = setup(worker)
+          start = time.perf_counter()
+          response = send(worker, spec)
+          if response.streaming:
+            b''.join(response.streaming_content)
+        except Exception as error:
+          with lock:
+            errors.append(repr(error))
+          continue
+        elapsed = time.perf_counter() - start
+        with lock:
+          latencies.append(elapsed * 1000)
+          queries.append(response.wsgi_request.metrics.queries)
+          if response.status_code >= 400:
+            errors.append(response.status_code)
+    finally:
+      connections.close_all()
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(workers) as pool:
+    list(pool.map(work, range(workers)))
+  wall = time.perf_counter() - start
+  return {
+    "requests": len(latencies),
+    "errors": len(errors),
+    "error_samples": sorted(set(map(str, errors)))[:5],
+    "throughput": round(len(latencies) / wall, 1) if wall else None,
+    "p50_ms": round(percentile(latencies, 50), 2),
+    "p95_ms": round(percentile(latencies, 95), 2),
+    "p99_ms": round(percentile(latencies, 99), 2),
+    "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+  }
+
+
+def current_commit():
+  try:
+    return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+class Command(BaseCommand):
+  help = 'Seeds a throwaway database and load tests every API route with concurrent clients'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route')
+    parser.add_argument('--only', help='Only run the routes whose name contains this text')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--compare', help='Results file of an earlier run to compare with')
+
+  def handle(self, *args, **options):
+    scenarios = [(name, setup) for name, setup in SCENARIOS if not options['only'] or options['only'] in name]
+    path = os.path.join(tempfile.mkdtemp(prefix='littlelemon-bench-'), 'bench.sqlite3')
+    results = {}
+    # A tuned file database lets the worker threads write concurrently, the dispatcher would add noise
+    with sqlite_tuning(), throwaway_database(path), unthrottled(), override_settings(ALLOWED_HOSTS=['testserver'], ORDER_DISPATCH={'IN_PROCESS': False}, QUERY_BUDGET_STRICT=False):
+      data = seed(users=options['users'], categories=options['categories'], items=options['items'], orders=options['orders'])
+      for name, setup in scenarios:
+        results[name] = run_scenario(data, setup, options['workers'], options['requests'])
+        self.report(name, results[name])
+
+    output = {
+      "commit": current_commit(),
+      "dataset": {key: options[key] for key in ('users', 'categories', 'items', 'orders')},
+      "workers": options['workers'],
+      "requests_per_route": options['requests'],
+      "routes": results,
+    }
+    if options['json']:
+      with open(options['json'], 'w') as file:
+        json.dump(output, file, indent=2)
+    if options['compare']:
+      with open(options['compare']) as file:
+        self.compare(json.load(file), output)
+
+  def report(self, name, result):
+    self.stdout.write('%-38s %7.1f req/s  p50 %7.2f  p95 %7.2f  p99 %7.2f ms  %5s queries  %d errors' % (
+      name, result['throughput'] or 0, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['queries_per_request'], result['errors'],
+    ))
+
+  def compare(self, before, after):
+    self.stdout.write('\nCompared with %s' % (before.get('commit') or 'the earlier run'))
+    for name, result in after['routes'].items():
+      old = before['routes'].get(name)
+      if not old or not old['p50_ms']:
+        continue
+      self.stdout.write('%-38s p50 %+6.1f%%  p99 %+6.1f%%  queries %s -> %s' % (
+        name, 100 * (result['p50_ms'] / old['p50_ms'] - 1), 100 * (result['p99_ms'] / old['p99_ms'] - 1) if old['p99_ms'] else 0,
+        old['queries_per_request'], result['queries_per_request'],
+      ))
@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from LittleLemonAPI.archive import archive_orders
+from LittleLemonAPI.models import Order, ArchivedOrder
+from ._bench import sqlite_tuning, throwaway_database, unthrottled, seed, percentile, Sample
+import json
+import random
+import time
+
+
+def scenarios(data, live, archived, rng):
+  """(name, user, path, params) of the order reads, with the single order lookups drawn from live or archived ids"""
+  customer, crew, manager = rng.choice(data.customers), rng.choice(data.crew), rng.choice(data.managers)
+  reads = [
+    ('customer orders', customer, '/api/orders', {}),
+    ('customer first page', customer, '/api/orders', {'cursor': '', 'ordering': '-date'}),
+    ('crew first page', crew, '/api/orders', {'cursor': '', 'ordering': '-date'}),
+    ('manager first page', manager, '/api/orders', {'cursor': '', 'ordering': '-date', 'perpage': 50}),
+  ]
+  reads += [('order lookup', owner, '/api/orders/%d' % id, {}) for id, owner in rng.sample(live, min(len(live), 20))]
+  if archived:
+    reads += [('archived lookup', owner, '/api/orders/%d' % id, {}) for id, owner in rng.sample(archived, min(len(archived), 20))]
+    reads.append(('customer with archived', customer, '/api/orders', {'cursor': '', 'ordering': '-date', 'include_archived': '1'}))
+  return reads
+
+
+class Command(BaseCommand):
+  help = 'Measures the order reads on a long order history, before and after archiving its delivered orders'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--days', type=int, default=730, help='Days of history the orders are spread over')
+    parser.add_argument('--age-days', type=int, default=30, help='Age past which delivered orders are archived')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=20, help='Times each read is repeated')
+    parser.add_argument('--database', help='SQLite file to seed instead of an in-memory database, for histories of millions of orders')
+    parser.add_argument('--json', help='Write the results to this file')
+
+  def handle(self, *args, **options):
+    results = {}
+    with sqlite_tuning(), throwaway_database(options['database']), unthrottled(), override_settings(ALLOWED_HOSTS=['testserver'], QUERY_BUDGET_STRICT=False):
+      start = time.perf_counter()
+      data = seed(users=options['users'], items=500, orders=options['orders'], cart_items=0, days=options['days'])
+      self.stdout.write('Seeded %d orders over %d days in %.1f s' % (options['orders'], options['days'], time.perf_counter() - start))
+      client = Client()
+
+      def measure(phase, reads):
+        timings = {}
+        for _ in range(options['rounds']):
+          for name, user, path, params in reads:
+            with Sample() as sample:
+              response = client.get(path, params, headers={'Authorization': 'Token ' + data.tokens[user.id]})
+            if response.status_code != 200:
+              self.stderr.write('%s answered %d' % (path, response.status_code))
+            timings.setdefault(name, []).append(sample.seconds * 1000)
+        for name, samples in timings.items():
+          results.setdefault(name, {})[phase] = {"p50_ms": round(percentile(samples, 50), 3), "p99_ms": round(percentile(samples, 99), 3)}
+
+      live = [(order.id, order.user) for order in data.orders]
+      measure('before', scenarios(data, live, [], random.Random(1)))
+
+      start = time.perf_counter()
+      moved, items = archive_orders(age_days=options['age_days'])
+      seconds = time.perf_counter() - start
+      results['archive'] = {"orders": moved, "items": items, "seconds": round(seconds, 2)}
+      self.stdout.write('Archived %d orders and %d items in %.1f s, %d orders left in the live table' % (
+        moved, items, seconds, Order.objects.count(),
+      ))
+      users = {user.id: user for user in data.customers}
+      live = [(id, users[user_id]) for id, user_id in Order.objects.values_list('id', 'user_id')]
+      archived = [(id, users[user_id]) for id, user_id in ArchivedOrder.objects.values_list('id', 'user_id')]
+      measure('after', scenarios(data, live, archived, random.Random(1)))
+
+    self.stdout.write('%-24s %12s %12s %12s %12s' % ('read', 'before p50', 'before p99', 'after p50', 'after p99'))
+    for name, phases in results.items():
+      if name == 'archive':
+        continue
+      cells = ['%12.3f %12.3f' % (phases[phase]['p50_ms'], phases[phase]['p99_ms']) if phase in phases else '%12s %12s' % ('-', '-') for phase in ('before', 'after')]
+      self.stdout.write('%-24s %s' % (name, ' '.join(cells)))
+
+    if options['json']:
+      with open(options['json'], 'w') as file:
+        json.dump(results, file, indent=2)
@@ -0,0 +1,149 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import include, path
+from ._bench import sqlite_tuning, throwaway_database, unthrottled, seed, percentile
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+
+class AsyncRoutes:
+  """LittleLemon/urls.py as it routes with ASYNC_READ_VIEWS on"""
+  urlpatterns = [path('api/', include('LittleLemonAPI.async_urls'))]
+
+
+def pick_request(data, own_orders, rng):
+  """A customer reading an item, their orders or one of them"""
+  customer = rng.choice(data.customers)
+  headers = {'Authorization': 'Token ' + data.tokens[customer.pk]}
+  kind = rng.random()
+  if kind < 0.4 or not own_orders.get(customer.pk):
+    return '/api/menu-items/%d' % rng.choice(data.items).pk, headers
+  if kind < 0.8:
+    return '/api/orders', headers
+  return '/api/orders/%d' % rng.choice(own_orders[customer.pk]), headers
+
+
+class Results:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.latencies = []
+    self.errors = 0
+
+  def add(self, seconds, status_code):
+    with self.lock:
+      self.latencies.append(seconds * 1000)
+      self.errors += status_code >= 400
+
+  def summary(self, wall):
+    return {
+      "requests": len(self.latencies),
+      "errors": self.errors,
+      "throughput": round(len(self.latencies) / wall, 1),
+      "p50_ms": round(percentile(self.latencies, 50), 2),
+      "p99_ms": round(percentile(self.latencies, 99), 2),
+    }
+
+
+def run_wsgi(data, own_orders, clients, threads, delay, seconds):
+  """Sync views behind a WSGI worker with a fixed number of threads, each held for the whole exchange
+
+  A slow client keeps its thread busy while it sends the request and while it reads the response.
+  """
+  results = Results()
+  worker_threads = threading.BoundedSemaphore(threads)
+  deadline = time.perf_counter() + seconds
+
+  def client_loop(index):
+    rng = random.Random(index)
+    client = Client()
+    try:
+      while time.perf_counter() < deadline:
+        url, headers = pick_request(data, own_orders, rng)
+        start = time.perf_counter()
+        with worker_threads:
+          time.sleep(delay / 2)
+          response = client.get(url, headers=headers)
+          time.sleep(delay / 2)
+        results.add(time.perf_counter() - start, response.status_code)
+    finally:
+      connections.close_all()
+
+  start = time.perf_counter()
+  loops = [threading.Thread(target=client_loop, args=(index,)) for index in range(clients)]
+  for loop in loops:
+    loop.start()
+  for loop in loops:
+    loop.join()
+  return results.summary(time.perf_counter() - start)
+
+
+def run_asgi(data, own_orders, clients, delay, seconds):
+  """The views behind one ASGI event loop, which waits on slow clients without holding a thread"""
+  results = Results()
+
+  async def client_loop(index, deadline):
+    rng = random.Random(index)
+    client = AsyncClient()
+    while time.perf_counter() < deadline:
+      url, headers = pick_request(data, own_orders, rng)
+      start = time.perf_counter()
+      await asyncio.sleep(delay / 2)
+      response = await client.get(url, headers=headers)
+      await asyncio.sleep(delay / 2)
+      results.add(time.perf_counter() - start, response.status_code)
+
+  async def main():
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*(client_loop(index, deadline) for index in range(clients)))
+
+  start = time.perf_counter()
+  asyncio.run(main())
+  return results.summary(time.perf_counter() - start)
+
+
+class Command(BaseCommand):
+  help = 'Compares requests per second of one worker serving many slow clients, sync views under WSGI against async views under ASGI'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--clients', type=int, default=200, help='Concurrent clients')
+    parser.add_argument('--threads', type=int, default=8, help='Threads of the WSGI worker')
+    parser.add_argument('--client-delay', type=float, default=100, help='Milliseconds each client takes to send its request and read the response')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--json', help='Write the results to this file')
+
+  def handle(self, *args, **options):
+    delay = options['client_delay'] / 1000
+    path = os.path.join(tempfile.mkdtemp(prefix='littlelemon-bench-'), 'bench.sqlite3')
+    modes = [
+      ('wsgi, sync views', lambda data: run_wsgi(data, own_orders, options['clients'], options['threads'], delay, options['seconds'])),
+      ('asgi, sync views', lambda data: run_asgi(data, own_orders, options['clients'], delay, options['seconds'])),
+      ('asgi, async views', lambda data: run_asgi(data, own_orders, options['clients'], delay, options['seconds'])),
+    ]
+    results = {}
+    # The first request of each token also reads the token, going over the query budgets, which is expected here and not worth a warning each
+    with sqlite_tuning(), throwaway_database(path), unthrottled(), override_settings(
+      ALLOWED_HOSTS=['testserver'], ORDER_DISPATCH={'IN_PROCESS': False}, QUERY_BUDGETS={},
+    ):
+      data = seed(users=options['clients'], items=options['items'], orders=options['orders'])
+      own_orders = {}
+      for order in data.orders:
+        own_orders.setdefault(order.user_id, []).append(order.pk)
+      for mode, run in modes:
+        with override_settings(ROOT_URLCONF=AsyncRoutes if mode.endswith('async views') else 'LittleLemon.urls'):
+          results[mode] = result = run(data)
+        self.stdout.write('%-18s %8.1f req/s  p50 %8.2f  p99 %8.2f ms  %d errors' % (
+          mode, result['throughput'], result['p50_ms'], result['p99_ms'], result['errors'],
+        ))
+
+    if options['json']:
+      with open(options['json'], 'w') as file:
+        json.dump({"options": {key: options[key] for key in ('clients', 'threads', 'client_delay', 'seconds')}, "modes": results}, file, indent=2)
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from LittleLemonAPI.cache import menu_cache
+from .bench_api import Worker, home_screen
+from ._bench import sqlite_tuning, throwaway_database, unthrottled, seed, percentile
+import json
+import os
+import tempfile
+import time
+
+
+def sequential(worker, calls, round_trip):
+  client = worker.client(worker.customer)
+  statuses = []
+  for call in calls:
+    time.sleep(round_trip)
+    statuses.append(client.get(call['path']).status_code)
+  return statuses
+
+
+def batched(worker, calls, round_trip, concurrent):
+  time.sleep(round_trip)
+  response = worker.client(worker.customer).post('/api/batch', {'requests': calls, 'concurrent': concurrent}, format='json')
+  return [result['status'] for result in response.json()]
+
+
+class Command(BaseCommand):
+  help = 'Compares the latency of the home screen calls made one by one against one batch of them, sequential and concurrent'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--round-trip', type=float, default=0, help='Milliseconds of network round trip added to each HTTP request')
+    parser.add_argument('--json', help='Write the results to this file')
+
+  def handle(self, *args, **options):
+    path = os.path.join(tempfile.mkdtemp(prefix='littlelemon-bench-'), 'bench.sqlite3')
+    round_trip = options['round_trip'] / 1000
+    modes = [
+      ('separate calls', lambda worker, calls: sequential(worker, calls, round_trip)),
+      ('batch', lambda worker, calls: batched(worker, calls, round_trip, False)),
+      ('batch, concurrent', lambda worker, calls: batched(worker, calls, round_trip, True)),
+    ]
+    results = {}
+    with sqlite_tuning(), throwaway_database(path), unthrottled(), override_settings(
+      ALLOWED_HOSTS=['testserver'], ORDER_DISPATCH={'IN_PROCESS': False}, QUERY_BUDGET_STRICT=False,
+    ):
+      data = seed(users=20, items=options['items'], orders=options['orders'])
+      workers = [Worker(data, index) for index in range(len(data.customers))]
+      # Warms the token and role caches of every customer
+      for worker in workers:
+        sequential(worker, home_screen(worker), 0)
+
+      self.stdout.write('%-18s %6s %10s %10s %8s' % ('mode', 'calls', 'p50 ms', 'p99 ms', 'errors'))
+      for mode, run in modes:
+        timings, errors = [], 0
+        for iteration in range(options['iterations']):
+          worker = workers[iteration % len(workers)]
+          calls = home_screen(worker)
+          # Every mode computes the pages instead of reading them from the menu cache
+          menu_cache.clear()
+          start = time.perf_counter()
+          statuses = run(worker, calls)
+          timings.append((time.perf_counter() - start) * 1000)
+          errors += sum(status >= 400 for status in statuses)
+        results[mode] = {"p50_ms": round(percentile(timings, 50), 3), "p99_ms": round(percentile(timings, 99), 3), "errors": errors}
+        self.stdout.write('%-18s %6d %10.3f %10.3f %8d' % (mode, len(calls), results[mode]['p50_ms'], results[mode]['p99_ms'], errors))
+
+    if options['json']:
+      with open(options['json'], 'w') as file:
+        json.dump({"calls": len(home_screen(workers[0])), "round_trip_ms": options['round_trip'], "modes": results}, file, indent=2)
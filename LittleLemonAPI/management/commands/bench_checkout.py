@@ -0,0 +1,41 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from LittleLemonAPI.checkout import checkout
+from LittleLemonAPI.models import Category, MenuItem, Cart
+from ._bench import throwaway_database, percentile, Sample
+from decimal import Decimal
+
+
+class Command(BaseCommand):
+  help = 'Measures queries per checkout and checkout latency across cart sizes on a throwaway database'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--sizes', default='1,10,50,100,200', help='Comma separated cart sizes')
+    parser.add_argument('--iterations', type=int, default=50)
+
+  def handle(self, *args, **options):
+    sizes = [int(size) for size in options['sizes'].split(',')]
+    # The dispatcher would otherwise compete with the checkouts being measured
+    with throwaway_database(), override_settings(ORDER_DISPATCH={'IN_PROCESS': False}):
+      user = User.objects.create_user('bench-customer')
+      category = Category.objects.create(slug='bench', title='Bench')
+      items = MenuItem.objects.bulk_create([
+        MenuItem(title='Item %d' % i, price=Decimal('2.50'), featured=False, category=category)
+        for i in range(max(sizes))
+      ])
+
+      self.stdout.write('%6s %8s %10s %10s' % ('items', 'queries', 'p50 ms', 'p99 ms'))
+      for size in sizes:
+        timings = []
+        queries = 0
+        for _ in range(options['iterations']):
+          Cart.objects.bulk_create([
+            Cart(user=user, menuitem=item, quantity=2, unit_price=item.price, price=item.price * 2)
+            for item in items[:size]
+          ])
+          with Sample() as sample:
+            checkout(user)
+          timings.append(sample.seconds * 1000)
+          queries = max(queries, sample.queries)
+        self.stdout.write('%6d %8d %10.2f %10.2f' % (size, queries, percentile(timings, 50), percentile(timings, 99)))
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from LittleLemonAPI.cache import menu_cache
+from LittleLemonAPI.menu_index import menu_index
+from ._bench import sqlite_tuning, throwaway_database, unthrottled, seed, percentile, Sample
+import json
+import random
+
+
+def pick_params(data, rng):
+  """A menu listing as the clients ask for it: a category or a price cap, an ordering and a page"""
+  params = {'perpage': 10, 'ordering': rng.choice(['price', '-price', 'title', 'id'])}
+  if rng.random() < 0.5:
+    params['category'] = rng.choice(data.categories).slug
+  if rng.random() < 0.5:
+    params['to_price'] = '%d.00' % rng.randint(5, 30)
+  if rng.random() < 0.5:
+    params['cursor'] = ''
+  else:
+    params['page'] = rng.randint(1, 20)
+  return params
+
+
+class Command(BaseCommand):
+  help = 'Compares menu listing latency answered by the database against the in-process menu index, across menu sizes'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Comma separated menu sizes')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--json', help='Write the results to this file')
+
+  def handle(self, *args, **options):
+    sizes = [int(size) for size in options['sizes'].split(',')]
+    results = {}
+    self.stdout.write('%8s %-9s %10s %10s %8s %12s' % ('items', 'mode', 'p50 ms', 'p99 ms', 'queries', 'rebuild ms'))
+    for size in sizes:
+      with sqlite_tuning(), throwaway_database(), unthrottled(), override_settings(ALLOWED_HOSTS=['testserver'], QUERY_BUDGET_STRICT=False):
+        data = seed(users=1, categories=options['categories'], items=size, orders=0)
+        rng = random.Random(size)
+        requests = [pick_params(data, rng) for _ in range(options['requests'])]
+        menu_index.clear()
+        client = Client()
+        bodies = {}
+        for mode, enabled in (('database', False), ('index', True)):
+          with override_settings(MENU_INDEX=enabled):
+            rebuild = None
+            if enabled:
+              with Sample() as sample:
+                menu_index.current()
+              rebuild = sample.seconds * 1000
+            timings, queries, bodies[mode] = [], 0, []
+            for params in requests:
+              # Every request misses the page cache, which is what happens right after a menu change
+              menu_cache.clear()
+              with Sample() as sample:
+                response = client.get('/api/menu-items', params)
+              timings.append(sample.seconds * 1000)
+              queries = max(queries, sample.queries)
+              bodies[mode].append(response.content)
+          results.setdefault(size, {})[mode] = result = {
+            "p50_ms": round(percentile(timings, 50), 3), "p99_ms": round(percentile(timings, 99), 3),
+            "queries": queries, "rebuild_ms": rebuild and round(rebuild, 1),
+          }
+          self.stdout.write('%8d %-9s %10.3f %10.3f %8d %12s' % (
+            size, mode, result['p50_ms'], result['p99_ms'], queries, '%.1f' % rebuild if rebuild else '-',
+          ))
+        differences = sum(index != database for index, database in zip(bodies['index'], bodies['database']))
+        if differences:
+          self.stderr.write('%d of %d responses differ between the database and the index' % (differences, len(requests)))
+        menu_index.clear()
+
+    if options['json']:
+      with open(options['json'], 'w') as file:
+        json.dump(results, file, indent=2)
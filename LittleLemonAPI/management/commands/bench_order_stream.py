@@ -0,0 +1,93 @@
+from django.contrib.auth.models import User, Group
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from rest_framework.authtoken.models import Token
+from LittleLemonAPI.roles import MANAGER
+from LittleLemonAPI.streams import broker
+from ._bench import throwaway_database, percentile
+import asyncio
+import time
+import tracemalloc
+
+
+class Subscriber:
+  """A local client connected straight to the ASGI application, without a server in between"""
+
+  def __init__(self, app, token):
+    self.app = app
+    self.token = token
+    self.events = 0
+    self.received = asyncio.Event()
+    self.disconnected = asyncio.Event()
+    self.status = None
+    self.requested = False
+
+  async def receive(self):
+    if not self.requested:
+      self.requested = True
+      return {'type': 'http.request', 'body': b'', 'more_body': False}
+    await self.disconnected.wait()
+    return {'type': 'http.disconnect'}
+
+  async def send(self, message):
+    if message['type'] == 'http.response.start':
+      self.status = message['status']
+    elif b'event: order' in message.get('body', b''):
+      self.events += 1
+      self.received.set()
+
+  async def run(self):
+    scope = {
+      'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+      'path': '/api/orders/stream', 'raw_path': b'/api/orders/stream', 'query_string': b'', 'root_path': '',
+      'headers': [(b'host', b'localhost'), (b'authorization', b'Token ' + self.token.encode())],
+      'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    await self.app(scope, self.receive, self.send)
+
+
+class Command(BaseCommand):
+  help = 'Opens local order stream subscribers and measures memory per connection and fan-out latency'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--subscribers', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=20)
+
+  def handle(self, *args, **options):
+    with throwaway_database():
+      managers = Group.objects.create(name=MANAGER)
+      users = User.objects.bulk_create([User(username='subscriber-%d' % i) for i in range(options['subscribers'])])
+      managers.user_set.add(*users)
+      tokens = [token.key for token in Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users])]
+      asyncio.run(self.run(tokens, options['events']))
+
+  async def run(self, tokens, event_count):
+    app = get_asgi_application()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    subscribers = [Subscriber(app, token) for token in tokens]
+    tasks = [asyncio.create_task(subscriber.run()) for subscriber in subscribers]
+    while len(broker) < len(subscribers):
+      await asyncio.sleep(0.05)
+    connected = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    latencies = []
+    for i in range(event_count):
+      for subscriber in subscribers:
+        subscriber.received.clear()
+      start = time.perf_counter()
+      broker.publish({'type': 'order', 'id': i, 'user': 0, 'status': True, 'delivery_crew': None, 'previous_delivery_crew': None})
+      await asyncio.gather(*(subscriber.received.wait() for subscriber in subscribers))
+      latencies.append((time.perf_counter() - start) * 1000)
+
+    for subscriber in subscribers:
+      subscriber.disconnected.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    self.stdout.write('subscribers          %d' % len(subscribers))
+    self.stdout.write('memory per idle conn %.1f KiB' % ((connected - before) / len(subscribers) / 1024))
+    self.stdout.write('fan-out p50          %.2f ms' % percentile(latencies, 50))
+    self.stdout.write('fan-out p99          %.2f ms' % percentile(latencies, 99))
+    self.stdout.write('events delivered     %d' % sum(subscriber.events for subscriber in subscribers))
+    self.stdout.write('still subscribed     %d' % len(broker))
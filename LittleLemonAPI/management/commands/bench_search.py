@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.models import Category, MenuItem
+from LittleLemonAPI.search import search_titles
+from ._bench import throwaway_database, percentile, Sample
+from decimal import Decimal
+import random
+
+SYLLABLES = [
+  'la', 'mo', 'ri', 'so', 'ta', 'ke', 'ba', 'ni', 'po', 'lu', 'fe', 'da', 'gri', 'pas', 'ol',
+  'ven', 'tra', 'zu', 'mi', 'ch', 'ro', 'sa', 'be', 'vi', 'no', 'ka', 'ze', 'du', 'pi', 'mar',
+]
+
+
+def synthetic_words(rng, count):
+  """A vocabulary the size of a real multi-location catalog rather than a handful of dish names"""
+  words = set(['lemon', 'souvlaki', 'baklava', 'feta'])
+  while len(words) < count:
+    words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+  return sorted(words)
+
+
+class Command(BaseCommand):
+  help = 'Compares full-text search against the substring search on a synthetic catalog'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--words', type=int, default=5000)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--terms', default='lemon,souvlaki feta,bak,lamo')
+
+  def handle(self, *args, **options):
+    rng = random.Random(0)
+    words = synthetic_words(rng, options['words'])
+    with throwaway_database():
+      category = Category.objects.create(slug='bench', title='Bench')
+      MenuItem.objects.bulk_create((
+        MenuItem(title=' '.join(rng.sample(words, 3)) + ' %d' % i, price=Decimal('9.99'), featured=False, category=category)
+        for i in range(options['items'])
+      ), batch_size=5000)
+
+      self.stdout.write('%-16s %-10s %8s %10s %10s' % ('term', 'mode', 'matches', 'p50 ms', 'p99 ms'))
+      for term in options['terms'].split(','):
+        for mode, filtered in (
+          ('icontains', lambda: MenuItem.objects.filter(title__icontains=term)),
+          ('fulltext', lambda: search_titles(MenuItem.objects.all(), term).order_by('search_rank')),
+        ):
+          timings = []
+          for _ in range(options['iterations']):
+            with Sample() as sample:
+              # The same work as one listing page: a count for the paginator and the first rows
+              matches = filtered().count()
+              list(filtered()[:10])
+            timings.append(sample.seconds * 1000)
+          self.stdout.write('%-16s %-10s %8d %10.2f %10.2f' % (term, mode, matches, percentile(timings, 50), percentile(timings, 99)))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from LittleLemonAPI.models import MenuItem, Order, OrderItem
+from LittleLemonAPI.renderers import FastJSONRenderer
+from LittleLemonAPI.serializers import MenuItemSerializer, OrderSerializer, OrderItemSerializer
+from LittleLemonAPI.serializers import MenuItemListSerializer, OrderListSerializer, OrderItemListSerializer
+from ._bench import throwaway_database, seed, percentile, Sample
+
+LISTINGS = [
+  ('menu items', MenuItem, MenuItemSerializer, MenuItemListSerializer),
+  ('orders', Order, OrderSerializer, OrderListSerializer),
+  ('order items', OrderItem, OrderItemSerializer, OrderItemListSerializer),
+]
+
+
+class Command(BaseCommand):
+  help = 'Compares the ModelSerializer listings with the values() fast path, from the query to the rendered bytes'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--rows', type=int, default=1000, help='Rows per listing')
+    parser.add_argument('--iterations', type=int, default=20)
+
+  def handle(self, *args, **options):
+    rows = options['rows']
+    with throwaway_database():
+      seed(items=rows, orders=rows, items_per_order=1)
+      self.stdout.write('%-12s %-6s %12s %10s %10s' % ('listing', 'mode', 'rows/s', 'p50 ms', 'p99 ms'))
+      for name, model, model_serializer, fast_serializer in LISTINGS:
+        queryset = model.objects.order_by('id')[:rows]
+        modes = (
+          ('model', lambda: JSONRenderer().render(model_serializer(queryset, many=True).data)),
+          ('fast', lambda: FastJSONRenderer().render(fast_serializer(queryset).data)),
+        )
+        if modes[0][1]() != modes[1][1]():
+          self.stderr.write('%s: the fast path renders different bytes' % name)
+        for mode, render in modes:
+          timings = []
+          for _ in range(options['iterations']):
+            with Sample() as sample:
+              render()
+            timings.append(sample.seconds)
+          self.stdout.write('%-12s %-6s %12.0f %10.2f %10.2f' % (
+            name, mode, rows / percentile(timings, 50), percentile(timings, 50) * 1000, percentile(timings, 99) * 1000,
+          ))
@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections, OperationalError
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+from ._bench import sqlite_tuning, throwaway_database, unthrottled, seed, percentile
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+
+def stress(data, workers, seconds, write_ratio):
+  """Mixed menu and order reads with cart and checkout writes from concurrent clients, for a fixed time"""
+  lock = threading.Lock()
+  counts = {"reads": 0, "writes": 0, "locked": 0, "failed": 0}
+  latencies = {"reads": [], "writes": []}
+  deadline = time.perf_counter() + seconds
+
+  def work(index):
+    rng = random.Random(index)
+    customer = data.customers[index % len(data.customers)]
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + data.tokens[customer.pk])
+    try:
+      while time.perf_counter() < deadline:
+        kind = 'writes' if rng.random() < write_ratio else 'reads'
+        start = time.perf_counter()
+        try:
+          if kind == 'reads' and rng.random() < 0.5:
+            response = client.get('/api/menu-items/%d' % rng.choice(data.items).pk)
+          elif kind == 'reads':
+            response = client.get('/api/orders')
+          elif rng.random() < 0.7:
+            response = client.post('/api/cart/menu-items', [
+              {'menu item': item.title, 'quantity': rng.randint(1, 3)} for item in rng.sample(data.items, 3)
+            ], format='json')
+          else:
+            response = client.post('/api/orders')
+        except OperationalError as error:
+          with lock:
+            counts['locked' if 'locked' in str(error) else 'failed'] += 1
+          continue
+        elapsed = time.perf_counter() - start
+        with lock:
+          if response.status_code >= 500:
+            counts['failed'] += 1
+          else:
+            counts[kind] += 1
+            latencies[kind].append(elapsed * 1000)
+    finally:
+      connections.close_all()
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(workers) as pool:
+    list(pool.map(work, range(workers)))
+  wall = time.perf_counter() - start
+  return {
+    **counts,
+    "throughput": round((counts['reads'] + counts['writes']) / wall, 1),
+    "read_p99_ms": round(percentile(latencies['reads'], 99), 2),
+    "write_p99_ms": round(percentile(latencies['writes'], 99), 2),
+  }
+
+
+class Command(BaseCommand):
+  help = 'Compares mixed read and write throughput on SQLite with and without the production tuning'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--json', help='Write the results to this file')
+
+  def handle(self, *args, **options):
+    results = {}
+    for mode, enabled in [('default', False), ('production', True)]:
+      path = os.path.join(tempfile.mkdtemp(prefix='littlelemon-bench-'), 'bench.sqlite3')
+      with sqlite_tuning(enabled), throwaway_database(path), unthrottled(), override_settings(
+        ALLOWED_HOSTS=['testserver'], ORDER_DISPATCH={'IN_PROCESS': False}, QUERY_BUDGET_STRICT=False,
+      ):
+        data = seed(items=options['items'], orders=options['orders'])
+        results[mode] = stress(data, options['workers'], options['seconds'], options['write_ratio'])
+      result = results[mode]
+      self.stdout.write('%-10s %7.1f req/s  %6d reads  %6d writes  %5d locked  %5d failed  p99 read %7.2f  write %7.2f ms' % (
+        mode, result['throughput'], result['reads'], result['writes'], result['locked'], result['failed'],
+        result['read_p99_ms'], result['write_p99_ms'],
+      ))
+
+    if options['json']:
+      with open(options['json'], 'w') as file:
+        json.dump(results, file, indent=2)
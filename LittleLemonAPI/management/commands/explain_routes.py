@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from .bench_api import SCENARIOS, Worker, send
+from ._bench import throwaway_database, unthrottled, seed
+import re
+
+# A table read from end to end, unlike SCAN ... USING INDEX which walks an index and SEARCH which seeks one
+FULL_SCAN = re.compile(r'^SCAN (?!\(|sqlite_)(\S+)$')
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+def query_plan(sql):
+  with connection.cursor() as cursor:
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def explain(data, setup):
+  """Sends one request of a scenario and returns (sql, plan, scanned tables, sorts) for each SELECT it ran"""
+  worker = Worker(data, 0)
+  spec = setup(worker)
+  with CaptureQueriesContext(connection) as queries:
+    response = send(worker, spec)
+    if response.streaming:
+      b''.join(response.streaming_content)
+  results = []
+  for query in queries.captured_queries:
+    sql = query['sql']
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+      continue
+    plan = query_plan(sql)
+    # A scan without a WHERE clause reads every row on purpose, listings are limited by their page size
+    scans = [match.group(1) for match in map(FULL_SCAN.match, plan) if match] if ' WHERE ' in sql else []
+    results.append((sql, plan, scans, TEMP_SORT in plan))
+  return results
+
+
+class Command(BaseCommand):
+  help = 'Runs EXPLAIN QUERY PLAN on the queries of every API route against seeded data and flags full table scans'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--only', help='Only explain scenarios whose name contains this text')
+    parser.add_argument('--verbose', action='store_true', help='Print the plan of every query, not only the flagged ones')
+    parser.add_argument('--strict', action='store_true', help='Exit with an error when a filtered query scans a table')
+
+  def handle(self, *args, **options):
+    if connection.vendor != 'sqlite':
+      raise CommandError('EXPLAIN QUERY PLAN is only understood on SQLite')
+
+    flagged = 0
+    with throwaway_database(), unthrottled(), override_settings(
+      ALLOWED_HOSTS=['testserver'], ORDER_DISPATCH={'IN_PROCESS': False}, QUERY_BUDGET_STRICT=False,
+    ):
+      data = seed(users=50, items=2000, orders=5000)
+      for name, setup in SCENARIOS:
+        if options['only'] and options['only'] not in name:
+          continue
+        results = explain(data, setup)
+        scans = sorted({table for sql, plan, tables, sorts in results for table in tables})
+        sorts = sum(sorts for sql, plan, tables, sorts in results)
+        flagged += bool(scans)
+        notes = ['FULL SCAN of ' + ', '.join(scans)] if scans else []
+        notes += ['%d sorted without an index' % sorts] if sorts else []
+        self.stdout.write('%-42s %3d selects  %s' % (name, len(results), '; '.join(notes) or 'ok'))
+        for sql, plan, tables, sorts in results:
+          if options['verbose'] or tables:
+            self.stdout.write('    ' + sql)
+            for line in plan:
+              self.stdout.write('      ' + line)
+
+    if flagged and options['strict']:
+      raise CommandError('%d routes scan a table to filter it' % flagged)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI import catalog
+import time
+
+
+class Command(BaseCommand):
+  help = 'Writes the whole catalog as CSV or NDJSON without loading it in memory'
+
+  def add_arguments(self, parser):
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=list(catalog.PARSERS), default='csv')
+
+  def handle(self, *args, **options):
+    start = time.perf_counter()
+    rows = 0
+    with open(options['path'], 'w', newline='') as output:
+      for line in catalog.export_menu(options['format']):
+        output.write(line)
+        rows += 1
+    if options['format'] == 'csv':
+      rows -= 1
+    seconds = time.perf_counter() - start
+    self.stdout.write('%d items exported in %.3fs (%d rows/s)' % (rows, seconds, rows / seconds if seconds else 0))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from LittleLemonAPI import catalog
+import json
+
+
+class Command(BaseCommand):
+  help = 'Creates or updates menu items from a CSV or NDJSON file, matching existing items on their title'
+
+  def add_arguments(self, parser):
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=list(catalog.PARSERS), help='Guessed from the file extension by default')
+    parser.add_argument('--batch-size', type=int, default=1000)
+
+  def handle(self, *args, **options):
+    file_format = options['format'] or options['path'].rsplit('.', 1)[-1].lower()
+    if file_format in ('jsonl', 'json'):
+      file_format = 'ndjson'
+    if file_format not in catalog.PARSERS:
+      raise CommandError('Cannot tell the format of %s, pass --format' % options['path'])
+
+    with open(options['path'], 'rb') as stream:
+      rows = catalog.PARSERS[file_format](catalog.read_lines(stream))
+      report = catalog.import_menu(rows, batch_size=options['batch_size']).as_dict()
+
+    for error in report.pop('errors'):
+      self.stderr.write('line %s: %s' % (error['line'], json.dumps(error['errors'])))
+    self.stdout.write('%(created)d created, %(updated)d updated, %(unchanged)d unchanged, %(invalid)d invalid in %(seconds)ss (%(rows_per_second)s rows/s)' % report)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.models import DailySales
+from LittleLemonAPI.reports import rebuild_rollup
+
+
+class Command(BaseCommand):
+  help = 'Recomputes the daily sales rollup from every order item'
+
+  def handle(self, *args, **options):
+    rebuild_rollup()
+    self.stdout.write('%d daily sales rows written' % DailySales.objects.count())
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, DEFAULT_DB_ALIAS
+from LittleLemonAPI import search
+
+
+class Command(BaseCommand):
+  help = 'Rebuilds the full-text search index on menu item titles'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+  def handle(self, *args, **options):
+    connection = connections[options['database']]
+    if not search.is_supported(connection):
+      self.stderr.write('Full-text search is not supported on %s, searches use a substring match' % connection.vendor)
+      return
+    search.rebuild_index(connection)
+    self.stdout.write('Search index rebuilt')
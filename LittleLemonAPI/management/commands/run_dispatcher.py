@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.dispatch import DispatchWorker, dispatch_settings
+
+
+class Command(BaseCommand):
+  help = 'Assigns new orders to the least loaded delivery crew member from the order outbox'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--poll-interval', type=float, default=None)
+
+  def handle(self, *args, **options):
+    dispatch = dispatch_settings()
+    worker = DispatchWorker(options['poll_interval'] or dispatch['POLL_INTERVAL'], dispatch['BATCH_SIZE'])
+    self.stdout.write('Dispatching orders, press CTRL-C to stop')
+    try:
+      worker.run()
+    except KeyboardInterrupt:
+      worker.stop()
@@ -0,0 +1,215 @@
+from bisect import bisect_left, bisect_right
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator, EmptyPage
+from django.db import router
+from .models import Category, MenuItem
+from .pagination import KeysetPaginator
+from .serializers import MenuItemListSerializer
+from .shared import is_shared
+from . import conditional
+import itertools
+import threading
+
+# Orderings the index keeps sorted, each broken by id in the same direction as the database does
+SORT_FIELDS = ('id', 'price', 'title')
+
+# The category of a slug that does not exist, which has no items
+UNKNOWN = object()
+
+
+class MenuEntry:
+  __slots__ = ('id', 'title', 'price', 'featured', 'category_id')
+
+  def __init__(self, id, title, price, featured, category_id):
+    self.id = id
+    self.title = title
+    self.price = price
+    self.featured = featured
+    self.category_id = category_id
+
+
+def sort_key(field):
+  return (lambda entry: entry.id) if field == 'id' else (lambda entry: (getattr(entry, field), entry.id))
+
+
+def walk(entries, start, stop, descending, keep):
+  """The entries between two positions, in either direction, skipping those keep() turns down"""
+  positions = range(stop - 1, start - 1, -1) if descending else range(start, stop)
+  if keep is None:
+    return (entries[position] for position in positions)
+  return (entries[position] for position in positions if keep(entries[position]))
+
+
+class Matches:
+  """The entries between two positions of one ordering that pass the filters, counted beforehand
+
+  The paginator slices it without a copy of the list being made.
+  """
+
+  def __init__(self, entries, start, stop, descending, keep, count):
+    self.entries = entries
+    self.start = start
+    self.stop = stop
+    self.descending = descending
+    self.keep = keep
+    self.count = count
+
+  def __len__(self):
+    return self.count
+
+  def __getitem__(self, index):
+    if self.keep is None:
+      # Unfiltered pages are computed positions, even the deep ones
+      first, last, step = index.indices(self.stop - self.start)
+      last = max(first, last)
+      if self.descending:
+        return list(walk(self.entries, self.stop - last, self.stop - first, True, None))
+      return list(walk(self.entries, self.start + first, self.start + last, False, None))
+    return list(itertools.islice(walk(self.entries, self.start, self.stop, self.descending, self.keep), index.start, index.stop))
+
+
+class MenuIndex:
+  """Every menu item in memory, sorted by id, price and title, for the whole menu and for each category
+
+  Answers the menu_items filters, orderings and both kinds of pages by bisecting those lists, returning
+  what the database would. Anything else, such as a search, is left to the database.
+  """
+
+  def __init__(self, token, rows, categories):
+    self.token = token
+    entries = [MenuEntry(*row) for row in rows]
+    by_category = {}
+    for entry in entries:
+      by_category.setdefault(entry.category_id, []).append(entry)
+    # Keyed by (category id or None for the whole menu, field)
+    self.sorted = {}
+    for field in SORT_FIELDS:
+      self.sorted[None, field] = sorted(entries, key=sort_key(field))
+      for category_id, members in by_category.items():
+        self.sorted[category_id, field] = sorted(members, key=sort_key(field))
+    self.prices = {
+      category_id: [entry.price for entry in members]
+      for (category_id, field), members in self.sorted.items() if field == 'price'
+    }
+    self.category_by_slug = dict(categories)
+
+  @classmethod
+  def load(cls, token):
+    # Read from the primary, a lagging replica would pin old rows to the current version
+    using = router.db_for_write(MenuItem)
+    rows = MenuItem.objects.using(using).values_list('id', 'title', 'price', 'featured', 'category_id')
+    categories = Category.objects.using(using).values_list('slug', 'id')
+    return cls(token, list(rows), list(categories))
+
+  def __len__(self):
+    return len(self.sorted[None, 'id'])
+
+  def filters(self, category, to_price):
+    """The category id and the price cap, each None when not filtered on, or None when only the database can tell"""
+    category_id = limit = None
+    if category:
+      if category.isdigit():
+        try:
+          category_id = int(category)
+        except ValueError:
+          return None
+      else:
+        category_id = self.category_by_slug.get(category, UNKNOWN)
+    if to_price:
+      try:
+        limit = MenuItem._meta.get_field('price').to_python(to_price)
+      except ValidationError:
+        return None
+      if not limit.is_finite():
+        return None
+    return category_id, limit
+
+  def listing(self, category, to_price, ordering, page, perpage, cursor):
+    """The data of a menu_items GET, or None when the index cannot answer it"""
+    field = (ordering or 'id').lstrip('-')
+    if field not in SORT_FIELDS or ',' in (ordering or ''):
+      return None
+    descending = (ordering or '').startswith('-')
+    filters = self.filters(category, to_price)
+    if filters is None:
+      return None
+    category_id, limit = filters
+
+    entries = self.sorted.get((category_id, field), [])
+    prices = self.prices.get(category_id, [])
+    count = len(prices) if limit is None else bisect_right(prices, limit)
+    start, stop, keep = 0, len(entries), None
+    if limit is not None:
+      if field == 'price':
+        # The items under the cap are the start of the price ordering
+        stop = count
+      else:
+        keep = lambda entry: entry.price <= limit
+    if cursor is not None:
+      return self.keyset_page(field, entries, start, stop, descending, keep, perpage, cursor)
+
+    paginator = Paginator(Matches(entries, start, stop, descending, keep, count), per_page=perpage)
+    try:
+      entries = paginator.page(number=page).object_list
+    except EmptyPage:
+      entries = []
+    return MenuItemListSerializer(entries).data
+
+  def keyset_page(self, field, entries, start, stop, descending, keep, perpage, cursor):
+    if cursor:
+      value, last_id = KeysetPaginator(MenuItem.objects.all(), field, perpage).decode(cursor)
+      key = last_id if field == 'id' else (value, last_id)
+      if descending:
+        stop = min(stop, bisect_left(entries, key, key=sort_key(field)))
+      else:
+        start = max(start, bisect_right(entries, key, key=sort_key(field)))
+
+    rows = list(itertools.islice(walk(entries, start, stop, descending, keep), int(perpage) + 1))
+    rows, next_cursor = KeysetPaginator(None, field, perpage).split(rows)
+    return {"results": MenuItemListSerializer(rows).data, "next": next_cursor}
+
+
+class MenuIndexHolder:
+  """The process's current MenuIndex, rebuilt on first use after the menu version changes
+
+  The menu version lives in the shared cache and is bumped after every catalog change commits, in
+  whichever process, so every process rebuilds its own index. One thread rebuilds it while the others
+  go to the database. The index stays off without a shared cache, as it could miss changes.
+  """
+
+  def __init__(self):
+    self._index = None
+    self._lock = threading.Lock()
+    self.rebuilds = 0
+
+  def enabled(self):
+    return getattr(settings, 'MENU_INDEX', False) and is_shared()
+
+  def fresh(self):
+    """The index if it matches the menu version, None when it has to be loaded"""
+    token, timestamp = conditional.version('menu')
+    index = self._index
+    return index if index is not None and index.token == token else None
+
+  def current(self):
+    """The fresh index, loading it if needed, or None while another thread is loading it"""
+    index = self.fresh()
+    if index is not None or not self._lock.acquire(blocking=False):
+      return index
+    try:
+      index = self.fresh()
+      if index is None:
+        token, timestamp = conditional.version('menu')
+        index = self._index = MenuIndex.load(token)
+        self.rebuilds += 1
+    finally:
+      self._lock.release()
+    return index
+
+  def clear(self):
+    self._index = None
+    self.rebuilds = 0
+
+
+menu_index = MenuIndexHolder()
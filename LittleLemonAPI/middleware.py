@@ -0,0 +1,224 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from . import routers
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in milliseconds of the latency histogram buckets, the last one catches the rest
+LATENCY_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+TRANSACTION_CONTROL = ('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class RequestMetrics:
+  """What one request spent, attached to it as request.metrics"""
+
+  def __init__(self):
+    self.queries = 0
+    self.db_seconds = 0.0
+    self.render_seconds = 0.0
+    self.total_seconds = 0.0
+    self._render_start = None
+
+  def __call__(self, execute, sql, params, many, context):
+    # Installed as a database execute wrapper, so queries are counted without DEBUG
+    start = time.perf_counter()
+    try:
+      return execute(sql, params, many, context)
+    finally:
+      self.db_seconds += time.perf_counter() - start
+      # Transaction control depends on the backend and its settings, not on what the view asked for
+      if not sql.startswith(TRANSACTION_CONTROL):
+        self.queries += 1
+
+
+class RouteStats:
+  def __init__(self):
+    self.requests = 0
+    self.queries = 0
+    self.max_queries = 0
+    self.db_seconds = 0.0
+    self.render_seconds = 0.0
+    self.total_seconds = 0.0
+    self.over_budget = 0
+    self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+  def add(self, metrics, over_budget):
+    self.requests += 1
+    self.queries += metrics.queries
+    self.max_queries = max(self.max_queries, metrics.queries)
+    self.db_seconds += metrics.db_seconds
+    self.render_seconds += metrics.render_seconds
+    self.total_seconds += metrics.total_seconds
+    self.over_budget += over_budget
+    self.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, metrics.total_seconds * 1000)] += 1
+
+  def as_dict(self):
+    requests = self.requests or 1
+    labels = ['<=%dms' % bound for bound in LATENCY_BUCKETS] + ['>%dms' % LATENCY_BUCKETS[-1]]
+    return {
+      "requests": self.requests,
+      "queries_per_request": round(self.queries / requests, 2),
+      "max_queries": self.max_queries,
+      "budget": None,
+      "over_budget": self.over_budget,
+      "db_ms_per_request": round(self.db_seconds * 1000 / requests, 3),
+      "render_ms_per_request": round(self.render_seconds * 1000 / requests, 3),
+      "total_ms_per_request": round(self.total_seconds * 1000 / requests, 3),
+      "latency": dict(zip(labels, self.latency_buckets)),
+    }
+
+
+class MetricsRegistry:
+  """Per route aggregates of every request since the process started"""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._routes = {}
+
+  def record(self, key, metrics, over_budget):
+    with self._lock:
+      self._routes.setdefault(key, RouteStats()).add(metrics, over_budget)
+
+  def snapshot(self):
+    with self._lock:
+      routes = {key: stats.as_dict() for key, stats in sorted(self._routes.items())}
+    for key, stats in routes.items():
+      stats['budget'] = budget_for(*key.split(' ', 1))
+    return routes
+
+  def reset(self):
+    with self._lock:
+      self._routes.clear()
+
+
+registry = MetricsRegistry()
+
+
+class QueryBudgetExceeded(AssertionError):
+  pass
+
+
+def query_budgets():
+  return getattr(settings, 'QUERY_BUDGETS', {})
+
+
+def budget_for(method, route):
+  """Budgets are declared per route, or per method and route as in 'POST api/orders'"""
+  budgets = query_budgets()
+  return budgets.get('%s %s' % (method, route), budgets.get(route))
+
+
+def route_of(request):
+  match = getattr(request, 'resolver_match', None)
+  return match.route if match is not None else None
+
+
+class RequestMetricsMiddleware:
+  """Records queries, database time, rendering time and total latency of every request by route"""
+
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+    self.is_async = iscoroutinefunction(get_response)
+    if self.is_async:
+      markcoroutinefunction(self)
+
+  def __call__(self, request):
+    if self.is_async:
+      return self.__acall__(request)
+    request.metrics = metrics = RequestMetrics()
+    start = time.perf_counter()
+    with ExitStack() as stack:
+      for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(metrics))
+      response = self.get_response(request)
+    return self.finish(request, response, start)
+
+  async def __acall__(self, request):
+    # Async views run their queries in other threads, only the latency is measured for them
+    request.metrics = RequestMetrics()
+    start = time.perf_counter()
+    response = await self.get_response(request)
+    return self.finish(request, response, start)
+
+  def process_template_response(self, request, response):
+    # DRF responses are rendered right after this hook, which is where serialization to JSON happens
+    metrics = request.metrics
+    metrics._render_start = time.perf_counter()
+    response.add_post_render_callback(lambda rendered: self._rendered(metrics))
+    return response
+
+  @staticmethod
+  def _rendered(metrics):
+    metrics.render_seconds = time.perf_counter() - metrics._render_start
+
+  def finish(self, request, response, start):
+    metrics = request.metrics
+    metrics.total_seconds = time.perf_counter() - start
+    route = route_of(request)
+    if route is None:
+      return response
+
+    budget = budget_for(request.method, route)
+    over_budget = budget is not None and metrics.queries > budget
+    registry.record('%s %s' % (request.method, route), metrics, over_budget)
+    if over_budget:
+      message = '%s %s ran %d queries, its budget is %d' % (request.method, route, metrics.queries, budget)
+      if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+      logger.warning(message)
+    response['Server-Timing'] = 'db;desc="%d queries";dur=%.1f, render;dur=%.1f, total;dur=%.1f' % (
+      metrics.queries, metrics.db_seconds * 1000, metrics.render_seconds * 1000, metrics.total_seconds * 1000,
+    )
+    return response
+
+
+class ReplicaRoutingMiddleware:
+  """Lets safe requests read from the replicas, unless their client wrote in the last few seconds"""
+
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+    self.is_async = iscoroutinefunction(get_response)
+    if self.is_async:
+      markcoroutinefunction(self)
+
+  def __call__(self, request):
+    if self.is_async:
+      return self.__acall__(request)
+    token = self.start(request)
+    try:
+      response = self.get_response(request)
+    finally:
+      routers.restore_reads(token)
+    return self.finish(request, response)
+
+  async def __acall__(self, request):
+    token = self.start(request)
+    try:
+      response = await self.get_response(request)
+    finally:
+      routers.restore_reads(token)
+    return self.finish(request, response)
+
+  def start(self, request):
+    if not routers.replica_aliases():
+      return routers.route_reads(False)
+    safe = request.method in routers.SAFE_METHODS
+    return routers.route_reads(safe and not routers.is_pinned(request))
+
+  def finish(self, request, response):
+    if routers.replica_aliases() and request.method not in routers.SAFE_METHODS and response.status_code < 400:
+      routers.pin_to_primary(request)
+    return response
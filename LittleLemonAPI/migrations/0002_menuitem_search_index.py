@@ -0,0 +1,21 @@
+from django.db import migrations
+from LittleLemonAPI import search
+
+
+def create_index(apps, schema_editor):
+    search.create_index(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    search.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:51
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill(apps, schema_editor):
+    Order = apps.get_model('LittleLemonAPI', 'Order')
+    OrderItem = apps.get_model('LittleLemonAPI', 'OrderItem')
+    User = apps.get_model('auth', 'User')
+    counts = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order').annotate(count=Count('id')).values('count')
+    Order.objects.update(item_count=Coalesce(Subquery(counts), 0))
+    usernames = User.objects.filter(pk=OuterRef('delivery_crew')).values('username')
+    Order.objects.filter(delivery_crew__isnull=False).update(crew_username=Subquery(usernames))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0004_dailysales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='crew_username',
+            field=models.CharField(blank=True, default='', max_length=150),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
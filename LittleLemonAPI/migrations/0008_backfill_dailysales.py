@@ -0,0 +1,32 @@
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Sum
+
+
+def backfill(apps, schema_editor):
+    DailySales = apps.get_model('LittleLemonAPI', 'DailySales')
+    totals = {}
+    for name in ('OrderItem', 'ArchivedOrderItem'):
+        items = apps.get_model('LittleLemonAPI', name).objects.values_list('order__date', 'menuitem_id').annotate(
+            total_quantity=Sum('quantity'), total_revenue=Sum('price'),
+        ).order_by()
+        for date, menuitem_id, quantity, revenue in items.iterator(chunk_size=2000):
+            previous_quantity, previous_revenue = totals.get((date, menuitem_id), (0, Decimal(0)))
+            totals[(date, menuitem_id)] = (previous_quantity + quantity, previous_revenue + Decimal(revenue).quantize(Decimal('0.01')))
+    DailySales.objects.all().delete()
+    DailySales.objects.bulk_create([
+        DailySales(date=date, menuitem_id=menuitem_id, quantity=quantity, revenue=revenue)
+        for (date, menuitem_id), (quantity, revenue) in totals.items()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0007_order_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
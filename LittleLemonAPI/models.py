@@ -3,7 +3,7 @@ from django.contrib.auth.models import User
 
 # Create your models here.
 class Category(models.Model):
-  slug = models.SlugField()
+  slug = models.SlugField(unique=True)
   title = models.CharField(max_length=255, db_index=True)
   
   def __str__(self):
@@ -16,6 +16,10 @@ class MenuItem(models.Model):
   featured = models.BooleanField(db_index=True)
   category = models.ForeignKey(Category, on_delete=models.PROTECT)
   
+  class Meta:
+    # The menu is filtered by category and price together, and often ordered by price
+    indexes = [models.Index(fields=['category', 'price'])]
+  
   def __str__(self):
     return self.title
   
@@ -41,6 +45,13 @@ class Order(models.Model):
   status = models.BooleanField(db_index=True, default=0)
   total = models.DecimalField(max_digits=6, decimal_places=2)
   date = models.DateField(db_index=True)
+  # Copies kept up to date on write, so the order listing needs neither a join nor a count
+  item_count = models.PositiveIntegerField(default=0)
+  crew_username = models.CharField(max_length=150, blank=True, default='')
+  
+  class Meta:
+    # Customers and delivery crew list their own orders, newest first
+    indexes = [models.Index(fields=['user', 'date']), models.Index(fields=['delivery_crew', 'date'])]
   
   
 class OrderItem(models.Model):
@@ -52,3 +63,49 @@ class OrderItem(models.Model):
   
   class Meta:
     unique_together = ('order', 'menuitem')
+  
+  
+class ArchivedOrder(models.Model):
+  """A delivered order moved out of Order by archive_orders, with its id and columns unchanged"""
+  id = models.BigIntegerField(primary_key=True)
+  user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+  delivery_crew = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='+', null=True)
+  status = models.BooleanField(default=1)
+  total = models.DecimalField(max_digits=6, decimal_places=2)
+  date = models.DateField(db_index=True)
+  item_count = models.PositiveIntegerField(default=0)
+  crew_username = models.CharField(max_length=150, blank=True, default='')
+  
+  class Meta:
+    indexes = [models.Index(fields=['user', 'date']), models.Index(fields=['delivery_crew', 'date'])]
+  
+  
+class ArchivedOrderItem(models.Model):
+  id = models.BigIntegerField(primary_key=True)
+  # Named like the items of a live order, so archived orders are read and serialized the same way
+  order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='orderitem_set')
+  menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+  quantity = models.SmallIntegerField()
+  unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+  price = models.DecimalField(max_digits=6, decimal_places=2)
+  
+  class Meta:
+    unique_together = ('order', 'menuitem')
+  
+  
+class OrderEvent(models.Model):
+  """Outbox row written in the checkout transaction so no new order is lost before it is dispatched"""
+  order = models.ForeignKey(Order, on_delete=models.CASCADE)
+  created = models.DateTimeField(auto_now_add=True)
+  processed = models.DateTimeField(null=True, db_index=True)
+  
+  
+class DailySales(models.Model):
+  """Rollup of the quantity and revenue of each menu item per day, kept up to date on checkout"""
+  date = models.DateField(db_index=True)
+  menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+  quantity = models.IntegerField(default=0)
+  revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+  
+  class Meta:
+    unique_together = ('date', 'menuitem')
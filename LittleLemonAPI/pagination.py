@@ -0,0 +1,91 @@
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+import base64
+import binascii
+import heapq
+import json
+
+
+class InvalidCursor(Exception):
+  pass
+
+
+class KeysetPaginator:
+  """Pages through a queryset with a (field, id) cursor so deep pages cost the same as the first one"""
+
+  def __init__(self, queryset, ordering, per_page):
+    self.queryset = queryset
+    self.descending = ordering.startswith('-')
+    self.field = ordering.lstrip('-')
+    self.per_page = int(per_page)
+
+  def page(self, cursor):
+    """Returns the rows after the cursor and the cursor of the next page, or None on the last page"""
+    return self.split(list(self.query(cursor)))
+
+  async def apage(self, cursor):
+    """page() for async views"""
+    return self.split([row async for row in self.query(cursor)])
+
+  def page_across(self, querysets, cursor):
+    """page() over the queryset and others with ids of their own, such as the live and archived orders"""
+    pages = [list(self.query(cursor))] + [list(self.for_queryset(queryset).query(cursor)) for queryset in querysets]
+    return self.split(self.merge(pages))
+
+  async def apage_across(self, querysets, cursor):
+    """page_across() for async views"""
+    pages = [[row async for row in self.query(cursor)]]
+    for queryset in querysets:
+      pages.append([row async for row in self.for_queryset(queryset).query(cursor)])
+    return self.split(self.merge(pages))
+
+  def for_queryset(self, queryset):
+    return KeysetPaginator(queryset, ('-' if self.descending else '') + self.field, self.per_page)
+
+  def merge(self, pages):
+    key = lambda row: (getattr(row, self.field), row.id)
+    return list(heapq.merge(*pages, key=key, reverse=self.descending))[:self.per_page + 1]
+
+  def query(self, cursor):
+    rows = self.queryset
+    if cursor:
+      value, last_id = self.decode(cursor)
+      rows = rows.filter(self.after(value, last_id))
+    if self.field == 'id':
+      order = ['-id' if self.descending else 'id']
+    else:
+      order = ['-' + self.field, '-id'] if self.descending else [self.field, 'id']
+    # One row past the page tells whether there is a next one
+    return rows.order_by(*order)[:self.per_page + 1]
+
+  def split(self, rows):
+    next_cursor = None
+    if len(rows) > self.per_page:
+      rows = rows[:self.per_page]
+      last = rows[-1]
+      next_cursor = self.encode(getattr(last, self.field), last.id)
+    return rows, next_cursor
+
+  def after(self, value, last_id):
+    # The outer bound on the field itself lets the database use its index for the range scan
+    lookup = 'lt' if self.descending else 'gt'
+    if self.field == 'id':
+      return Q(**{'id__' + lookup: last_id})
+    bound = Q(**{self.field + '__' + lookup + 'e': value})
+    return bound & (Q(**{self.field + '__' + lookup: value}) | Q(**{'id__' + lookup: last_id}))
+
+  @staticmethod
+  def encode(value, last_id):
+    payload = json.dumps([value, last_id], default=str).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+  def decode(self, cursor):
+    """The (value, id) a cursor holds, checked against the ordering field so any other value is an InvalidCursor"""
+    try:
+      value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+      last_id = self.queryset.model._meta.pk.clean(last_id, None)
+      if self.field == 'id':
+        return last_id, last_id
+      return self.queryset.model._meta.get_field(self.field).clean(value, None), last_id
+    except (binascii.Error, ValueError, TypeError, ValidationError):
+      raise InvalidCursor(cursor)
@@ -0,0 +1,9 @@
+from rest_framework.permissions import BasePermission
+from .roles import has_role, MANAGER
+
+
+class IsManager(BasePermission):
+  message = 'Unauthorized'
+
+  def has_permission(self, request, view):
+    return has_role(request, MANAGER)
@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from .models import OrderItem, ArchivedOrderItem, DailySales
+from .catalog import EchoBuffer
+from decimal import Decimal
+import csv
+import itertools
+import json
+
+# Columns of each report, then where they come from in the raw order items and in the rollup
+GROUPS = {
+  'day': (['date'], ['order__date'], ['date']),
+  'item': (['menuitem', 'title'], ['menuitem_id', 'menuitem__title'], ['menuitem_id', 'menuitem__title']),
+  'category': (
+    ['category', 'slug', 'title'],
+    ['menuitem__category_id', 'menuitem__category__slug', 'menuitem__category__title'],
+    ['menuitem__category_id', 'menuitem__category__slug', 'menuitem__category__title'],
+  ),
+}
+
+CENTS = Decimal('0.01')
+
+
+def rollup_enabled():
+  return getattr(settings, 'SALES_ROLLUP', False)
+
+
+def record_sales(date, lines, sign=1):
+  """Adds (menuitem id, quantity, price) lines sold on a date to the rollup, in one upsert per 200 items"""
+  totals = {}
+  for menuitem_id, quantity, price in lines:
+    current = totals.get(menuitem_id, (0, 0))
+    totals[menuitem_id] = (current[0] + sign * quantity, current[1] + sign * price)
+  if not totals:
+    return
+
+  table = DailySales._meta.db_table
+  date = connection.ops.adapt_datefield_value(date)
+  items = [(menuitem_id, (quantity, connection.ops.adapt_decimalfield_value(revenue, 12, 2))) for menuitem_id, (quantity, revenue) in totals.items()]
+  with connection.cursor() as cursor:
+    for start in range(0, len(items), 200):
+      chunk = items[start:start + 200]
+      # Incrementing in the database keeps concurrent checkouts from overwriting each other's totals
+      cursor.execute(
+        'INSERT INTO "%(table)s" (date, menuitem_id, quantity, revenue) VALUES %(values)s '
+        'ON CONFLICT (date, menuitem_id) DO UPDATE SET '
+        'quantity = "%(table)s".quantity + excluded.quantity, revenue = "%(table)s".revenue + excluded.revenue'
+        % {'table': table, 'values': ', '.join(['(%s, %s, %s, %s)'] * len(chunk))},
+        [value for menuitem_id, (quantity, revenue) in chunk for value in (date, menuitem_id, quantity, revenue)],
+      )
+
+
+def rebuild_rollup():
+  """Recomputes the whole rollup from the order items, archived ones included"""
+  with transaction.atomic():
+    DailySales.objects.all().delete()
+    rows = OrderItem.objects.values_list('order__date', 'menuitem_id').annotate(
+      total_quantity=Sum('quantity'), total_revenue=Sum('price'),
+    ).order_by()
+    batch = []
+    for date, menuitem_id, quantity, revenue in rows.iterator(chunk_size=2000):
+      batch.append(DailySales(date=date, menuitem_id=menuitem_id, quantity=quantity, revenue=revenue))
+      if len(batch) == 2000:
+        DailySales.objects.bulk_create(batch)
+        batch = []
+    DailySales.objects.bulk_create(batch)
+
+    # Archived sales are added on top, a day at a time, as they may share days and items with live ones
+    archived = ArchivedOrderItem.objects.values_list('order__date', 'menuitem_id').annotate(
+      total_quantity=Sum('quantity'), total_revenue=Sum('price'),
+    ).order_by('order__date')
+    for date, lines in itertools.groupby(archived.iterator(chunk_size=2000), key=lambda row: row[0]):
+      record_sales(date, [(menuitem_id, quantity, Decimal(revenue).quantize(CENTS)) for day, menuitem_id, quantity, revenue in lines])
+
+
+def sales(group, start, end, use_rollup=None):
+  """Yields the quantity and revenue per group between two dates, aggregated by the database"""
+  labels, raw_paths, rollup_paths = GROUPS[group]
+  if use_rollup is None:
+    use_rollup = rollup_enabled()
+  if use_rollup:
+    rows = DailySales.objects.filter(date__range=(start, end)).values_list(*rollup_paths).annotate(
+      total_quantity=Sum('quantity'), total_revenue=Sum('revenue'),
+    ).order_by(*rollup_paths)
+  else:
+    # Live and archived items are summed apart, then merged
+    totals = {}
+    for model in (OrderItem, ArchivedOrderItem):
+      raw = model.objects.filter(order__date__range=(start, end)).values_list(*raw_paths).annotate(
+        total_quantity=Sum('quantity'), total_revenue=Sum('price'),
+      ).order_by()
+      for row in raw.iterator(chunk_size=2000):
+        quantity, revenue = totals.get(row[:-2], (0, 0))
+        totals[row[:-2]] = (quantity + row[-2], revenue + Decimal(row[-1]).quantize(CENTS))
+    rows = (key + totals[key] for key in sorted(totals))
+  for row in rows:
+    # SQLite sums decimals without keeping their scale
+    yield dict(zip(labels + ['quantity', 'revenue'], row[:-1] + (Decimal(row[-1]).quantize(CENTS),)))
+
+
+def as_ndjson(rows):
+  for row in rows:
+    yield json.dumps(row, default=str) + '\n'
+
+
+def as_csv(rows, group):
+  writer = csv.writer(EchoBuffer())
+  yield writer.writerow(GROUPS[group][0] + ['quantity', 'revenue'])
+  for row in rows:
+    yield writer.writerow(row.values())
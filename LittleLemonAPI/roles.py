@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.cache import cache
+
+MANAGER = 'Manager'
+DELIVERY_CREW = 'Delivery Crew'
+
+
+def _cache_key(user_id):
+  return 'roles:%d' % user_id
+
+
+def user_roles(user):
+  """Returns the names of the user's groups, cached across requests for ROLE_CACHE_TIMEOUT seconds"""
+  if not user.is_authenticated:
+    return frozenset()
+
+  timeout = getattr(settings, 'ROLE_CACHE_TIMEOUT', 0)
+  roles = cache.get(_cache_key(user.pk)) if timeout else None
+  if roles is None:
+    roles = frozenset(user.groups.values_list('name', flat=True))
+    if timeout:
+      cache.set(_cache_key(user.pk), roles, timeout)
+  return roles
+
+
+async def auser_roles(user):
+  """user_roles() for async views, reading the groups through the async ORM"""
+  if not user.is_authenticated:
+    return frozenset()
+
+  timeout = getattr(settings, 'ROLE_CACHE_TIMEOUT', 0)
+  roles = cache.get(_cache_key(user.pk)) if timeout else None
+  if roles is None:
+    roles = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+    if timeout:
+      cache.set(_cache_key(user.pk), roles, timeout)
+  return roles
+
+
+def get_roles(request):
+  """Resolves the roles of the requesting user once per request"""
+  roles = getattr(request, '_roles', None)
+  if roles is None:
+    roles = user_roles(request.user)
+    request._roles = roles
+  return roles
+
+
+async def aget_roles(request):
+  roles = getattr(request, '_roles', None)
+  if roles is None:
+    roles = await auser_roles(request.user)
+    request._roles = roles
+  return roles
+
+
+def has_role(request, role):
+  return role in get_roles(request)
+
+
+def forget_roles(user_ids):
+  """Drops cached roles after a change in group membership"""
+  cache.delete_many([_cache_key(user_id) for user_id in user_ids])
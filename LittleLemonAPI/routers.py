@@ -0,0 +1,78 @@
+from contextvars import ContextVar
+from django.conf import settings
+from .shared import shared_cache
+import hashlib
+import random
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Whether the current request may read from a replica, set by ReplicaRoutingMiddleware
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_aliases():
+  return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def sticky_seconds():
+  return getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+
+def reads_from_replica():
+  return bool(replica_aliases()) and _use_replica.get()
+
+
+def client_key(request):
+  """Identifies the client before authentication runs, from its token, its session or its address"""
+  identity = (
+    request.META.get('HTTP_AUTHORIZATION')
+    or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    or request.META.get('REMOTE_ADDR', '')
+  )
+  return 'replica-pin:' + hashlib.sha1(identity.encode()).hexdigest()
+
+
+def is_pinned(request):
+  return shared_cache().get(client_key(request)) is not None
+
+
+def pin_to_primary(request):
+  """The client reads from the primary for a while, so it sees what it just wrote despite replication lag
+
+  The pin is kept in the shared cache, so whichever process serves the next request honours it.
+  """
+  shared_cache().set(client_key(request), True, sticky_seconds())
+
+
+def route_reads(use_replica):
+  """Returns a token to hand back to restore_reads once the request is done"""
+  return _use_replica.set(use_replica)
+
+
+def restore_reads(token):
+  _use_replica.reset(token)
+
+
+class ReplicaRouter:
+  """Sends reads of safe requests to a replica from REPLICA_DATABASES and everything else to the primary"""
+
+  def db_for_read(self, model, **hints):
+    if reads_from_replica():
+      return random.choice(replica_aliases())
+    return 'default'
+
+  def db_for_write(self, model, **hints):
+    return 'default'
+
+  def allow_relation(self, obj1, obj2, **hints):
+    # Replicas hold the same rows as the primary
+    databases = {'default', *replica_aliases()}
+    if obj1._state.db in databases and obj2._state.db in databases:
+      return True
+    return None
+
+  def allow_migrate(self, db, app_label, **hints):
+    # Replicas get their schema from the primary through replication
+    if db in replica_aliases():
+      return False
+    return None
@@ -0,0 +1,121 @@
+from django.db import connections
+from django.db.models.expressions import RawSQL
+import re
+
+MENU_TABLE = 'LittleLemonAPI_menuitem'
+FTS_TABLE = 'LittleLemonAPI_menuitem_fts'
+TSVECTOR_COLUMN = 'search_vector'
+
+_ready = {}
+
+
+def is_supported(connection):
+  if connection.vendor == 'postgresql':
+    return True
+  if connection.vendor == 'sqlite':
+    with connection.cursor() as cursor:
+      cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+      return bool(cursor.fetchone()[0])
+  return False
+
+
+def create_index(connection):
+  """Creates the full-text index on menu item titles along with what keeps it in sync"""
+  if not is_supported(connection):
+    return
+  with connection.cursor() as cursor:
+    if connection.vendor == 'postgresql':
+      # A generated column is maintained by PostgreSQL on every write, bulk ones included
+      cursor.execute(
+        'ALTER TABLE "%s" ADD COLUMN IF NOT EXISTS %s tsvector '
+        "GENERATED ALWAYS AS (to_tsvector('simple', title)) STORED" % (MENU_TABLE, TSVECTOR_COLUMN)
+      )
+      cursor.execute('CREATE INDEX IF NOT EXISTS "%s_search_idx" ON "%s" USING GIN (%s)' % (MENU_TABLE, MENU_TABLE, TSVECTOR_COLUMN))
+      return
+
+    cursor.execute(
+      'CREATE VIRTUAL TABLE IF NOT EXISTS "%s" USING fts5('
+      "title, content='%s', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')" % (FTS_TABLE, MENU_TABLE)
+    )
+    create_triggers(connection)
+    cursor.execute('INSERT INTO "%s"("%s") VALUES (\'rebuild\')' % (FTS_TABLE, FTS_TABLE))
+
+
+def create_triggers(connection):
+  """Triggers keeping the SQLite index in sync, to be recreated whenever the menu item table is rebuilt"""
+  if connection.vendor != 'sqlite' or not is_supported(connection):
+    return
+  names = {'menu': MENU_TABLE, 'fts': FTS_TABLE}
+  with connection.cursor() as cursor:
+    cursor.execute(
+      'CREATE TRIGGER IF NOT EXISTS "%(fts)s_ai" AFTER INSERT ON "%(menu)s" BEGIN '
+      'INSERT INTO "%(fts)s"(rowid, title) VALUES (new.id, new.title); END' % names
+    )
+    cursor.execute(
+      'CREATE TRIGGER IF NOT EXISTS "%(fts)s_ad" AFTER DELETE ON "%(menu)s" BEGIN '
+      'INSERT INTO "%(fts)s"("%(fts)s", rowid, title) VALUES (\'delete\', old.id, old.title); END' % names
+    )
+    cursor.execute(
+      'CREATE TRIGGER IF NOT EXISTS "%(fts)s_au" AFTER UPDATE OF title ON "%(menu)s" BEGIN '
+      'INSERT INTO "%(fts)s"("%(fts)s", rowid, title) VALUES (\'delete\', old.id, old.title); '
+      'INSERT INTO "%(fts)s"(rowid, title) VALUES (new.id, new.title); END' % names
+    )
+
+
+def drop_index(connection):
+  with connection.cursor() as cursor:
+    if connection.vendor == 'postgresql':
+      cursor.execute('ALTER TABLE "%s" DROP COLUMN IF EXISTS %s' % (MENU_TABLE, TSVECTOR_COLUMN))
+    elif connection.vendor == 'sqlite':
+      for suffix in ('ai', 'ad', 'au'):
+        cursor.execute('DROP TRIGGER IF EXISTS "%s_%s"' % (FTS_TABLE, suffix))
+      cursor.execute('DROP TABLE IF EXISTS "%s"' % FTS_TABLE)
+  _ready.pop(connection.alias, None)
+
+
+def rebuild_index(connection):
+  """Recreates the index contents from the menu item table"""
+  create_index(connection)
+  with connection.cursor() as cursor:
+    if connection.vendor == 'postgresql':
+      cursor.execute('REINDEX INDEX "%s_search_idx"' % MENU_TABLE)
+    elif connection.vendor == 'sqlite':
+      cursor.execute('INSERT INTO "%s"("%s") VALUES (\'optimize\')' % (FTS_TABLE, FTS_TABLE))
+  _ready.pop(connection.alias, None)
+
+
+def index_ready(connection):
+  """Whether the index exists on this database, checked once per process"""
+  if connection.alias not in _ready:
+    if connection.vendor == 'postgresql':
+      columns = [column.name for column in connection.introspection.get_table_description(connection.cursor(), MENU_TABLE)]
+      _ready[connection.alias] = TSVECTOR_COLUMN in columns
+    else:
+      _ready[connection.alias] = FTS_TABLE in connection.introspection.table_names()
+  return _ready[connection.alias]
+
+
+def search_titles(queryset, text):
+  """Filters menu items on their title with prefix matching, annotating each one with a search_rank
+
+  Lower ranks are better matches. Falls back to a substring match when there is no index.
+  """
+  connection = connections[queryset.db]
+  terms = re.findall(r'\w+', text)
+  if not terms or not index_ready(connection):
+    return queryset.filter(title__icontains=text)
+
+  if connection.vendor == 'postgresql':
+    query = ' & '.join(term + ':*' for term in terms)
+    return queryset.extra(
+      where=["%s @@ to_tsquery('simple', %%s)" % TSVECTOR_COLUMN], params=[query],
+    ).annotate(search_rank=RawSQL("-ts_rank(%s, to_tsquery('simple', %%s))" % TSVECTOR_COLUMN, [query]))
+
+  # Joining the index table lets SQLite drive the query from the MATCH and read the rank once per row
+  query = ' '.join('"%s"*' % term for term in terms)
+  return queryset.extra(
+    tables=[FTS_TABLE],
+    where=['"%s".rowid = "%s"."id"' % (FTS_TABLE, MENU_TABLE), '"%s" MATCH %%s' % FTS_TABLE],
+    params=[query],
+    select={'search_rank': '"%s".rank' % FTS_TABLE},
+  )
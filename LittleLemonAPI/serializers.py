@@ -1,3 +1,4 @@
+from django.db.models import QuerySet
 from rest_framework import serializers
 from .models import Category, MenuItem, Cart, Order, OrderItem
 import bleach
@@ -31,7 +32,8 @@ class CartSerializer(serializers.ModelSerializer):
 class OrderSerializer(serializers.ModelSerializer):
   class Meta:
     model = Order
-    fields = ['user', 'delivery_crew', 'status', 'total', 'date']
+    fields = ['user', 'delivery_crew', 'status', 'total', 'date', 'item_count', 'crew_username']
+    read_only_fields = ['item_count', 'crew_username']
     
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -40,4 +42,116 @@ class OrderItemSerializer(serializers.ModelSerializer):
     fields = ['order', 'menuitem', 'quantity', 'unit_price', 'price']
     extra_kwargs = {
       'unit_price': {'min_value': 1},
-    }
\ No newline at end of file
+    }
+    
+    
+class MenuItemImportSerializer(serializers.Serializer):
+  """Validates one imported menu item without touching the database, the category is resolved per batch"""
+  title = serializers.CharField(max_length=255)
+  price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=1)
+  featured = serializers.BooleanField(default=False)
+  category = serializers.SlugField()
+  
+  def validate_title(self, value):
+    # Imports validate thousands of rows with one serializer, so its sanitizer is built once instead of per row
+    if not hasattr(self, '_cleaner'):
+      self._cleaner = bleach.sanitizer.Cleaner()
+    return self._cleaner.clean(value)
+
+
+class CartItemSerializer(serializers.Serializer):
+  """One line of a cart request, as {"menu item": title, "quantity": n}"""
+  quantity = serializers.IntegerField(min_value=1, max_value=32767)
+  
+  def get_fields(self):
+    # The request key has a space in it, so it cannot be declared as a class attribute
+    fields = super().get_fields()
+    fields['menu item'] = serializers.CharField(max_length=255)
+    return fields
+
+
+def _decimal(value):
+  # What DecimalField renders for values already at the column's scale
+  return None if value is None else '{:f}'.format(value)
+
+
+def _date(value):
+  return None if value is None else value.isoformat()
+
+
+class ValuesSerializer:
+  """Read-only listing serializer that builds the dicts itself, with the output of the matching ModelSerializer
+
+  Querysets are read with .values_list(), so no model instances are built. Lists of instances work too.
+  """
+  # (key, model attribute, formatter or None)
+  fields = ()
+
+  def __init__(self, rows):
+    self.rows = rows
+
+  @property
+  def data(self):
+    columns = [column for name, column, formatter in self.fields]
+    if isinstance(self.rows, QuerySet):
+      rows = self.rows.values_list(*columns)
+    else:
+      rows = ([getattr(row, column) for column in columns] for row in self.rows)
+    return self.format(rows)
+
+  async def adata(self):
+    """data for async views, reading a queryset through the async ORM"""
+    if not isinstance(self.rows, QuerySet):
+      return self.data
+    columns = [column for name, column, formatter in self.fields]
+    return self.format([row async for row in self.rows.values_list(*columns)])
+
+  def format(self, rows):
+    names = [name for name, column, formatter in self.fields]
+    formatters = [(index, formatter) for index, (name, column, formatter) in enumerate(self.fields) if formatter]
+    data = []
+    for row in rows:
+      row = list(row)
+      for index, formatter in formatters:
+        row[index] = formatter(row[index])
+      data.append(dict(zip(names, row)))
+    return data
+
+
+class MenuItemListSerializer(ValuesSerializer):
+  fields = (('title', 'title', None), ('price', 'price', _decimal), ('featured', 'featured', None), ('category', 'category_id', None))
+
+
+class OrderListSerializer(ValuesSerializer):
+  fields = (
+    ('user', 'user_id', None), ('delivery_crew', 'delivery_crew_id', None), ('status', 'status', None),
+    ('total', 'total', _decimal), ('date', 'date', _date), ('item_count', 'item_count', None),
+    ('crew_username', 'crew_username', None),
+  )
+
+
+class ExpandedOrderListSerializer(OrderListSerializer):
+  """Orders with their items nested, from orders whose items were prefetched with their menu item"""
+
+  def __init__(self, rows):
+    super().__init__(list(rows))
+
+  @property
+  def data(self):
+    data = super().data
+    for order, row in zip(self.rows, data):
+      row['items'] = [
+        {
+          "menuitem": item.menuitem_id, "title": item.menuitem.title, "quantity": item.quantity,
+          "unit_price": _decimal(item.unit_price), "price": _decimal(item.price),
+        }
+        for item in order.orderitem_set.all()
+      ]
+    return data
+
+
+class OrderItemListSerializer(ValuesSerializer):
+  fields = (
+    ('order', 'order_id', None), ('menuitem', 'menuitem_id', None), ('quantity', 'quantity', None),
+    ('unit_price', 'unit_price', _decimal), ('price', 'price', _decimal),
+  )
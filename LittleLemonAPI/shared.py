@@ -0,0 +1,14 @@
+"""The cache every process reads, for state that a change made in one process has to change for all of them"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def shared_cache():
+  return caches[getattr(settings, 'SHARED_CACHE', 'shared')]
+
+
+def is_shared():
+  """False when the shared cache lives in each process, where other processes never see what is stored"""
+  return not isinstance(shared_cache(), (LocMemCache, DummyCache))
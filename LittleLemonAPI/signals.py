@@ -0,0 +1,146 @@
+from django.contrib.auth.models import User, Group
+from django.core.signals import request_started
+from rest_framework.authtoken.models import Token
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Category, MenuItem, Order, OrderItem, ArchivedOrder
+from .cache import menu_cache
+from .authentication import token_cache
+from .roles import forget_roles
+from . import conditional, dispatch, reports, sqlite
+
+
+@receiver([post_save, post_delete], sender=MenuItem)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_menu_cache(sender, **kwargs):
+  """Any change to the catalog makes every cached menu page stale"""
+  # Bumping after commit keeps a concurrent reader from caching the old rows under the new version
+  transaction.on_commit(menu_cache.bump_version)
+  conditional.bump_on_commit('menu')
+
+
+def _forget_users(user_ids):
+  forget_roles(user_ids)
+  token_cache.forget_users(user_ids)
+
+
+def _forget_roles_now_and_on_commit(user_ids):
+  user_ids = list(user_ids)
+  _forget_users(user_ids)
+  # A request reading the old membership before the commit may have cached it again
+  transaction.on_commit(lambda: _forget_users(user_ids))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_roles(sender, instance, action, reverse, pk_set, **kwargs):
+  """Group membership changed, either from the user side or from the group side"""
+  if action not in ('post_add', 'post_remove', 'pre_clear'):
+    return
+  if not reverse:
+    _forget_roles_now_and_on_commit([instance.pk])
+  elif pk_set is not None:
+    _forget_roles_now_and_on_commit(pk_set)
+  else:
+    _forget_roles_now_and_on_commit(instance.user_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+  """A deactivated or otherwise changed user is authenticated afresh"""
+  if not created:
+    _forget_roles_now_and_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def rename_crew_on_orders(sender, instance, created, update_fields=None, **kwargs):
+  """Orders keep a copy of their delivery crew's username"""
+  if not created and (update_fields is None or 'username' in update_fields):
+    renamed = 0
+    for model in (Order, ArchivedOrder):
+      renamed += model.objects.filter(delivery_crew=instance).exclude(crew_username=instance.username).update(crew_username=instance.username)
+    if renamed:
+      # A queryset update sends no signals
+      conditional.bump_on_commit('orders')
+
+
+@receiver(pre_delete, sender=User)
+def forget_deleted_crew_on_orders(sender, instance, **kwargs):
+  """Deleting a crew member leaves their orders without a crew, so the copy of the username goes too"""
+  cleared = 0
+  for model in (Order, ArchivedOrder):
+    cleared += model.objects.filter(delivery_crew=instance).exclude(crew_username='').update(crew_username='')
+  if cleared:
+    conditional.bump_on_commit('orders')
+
+
+@receiver(pre_save, sender=Order)
+def copy_crew_username(sender, instance, **kwargs):
+  """Fills the copy of the username from the assigned crew member when it is at hand
+
+  Code that assigns a crew by id alone, like the dispatcher's update, sets crew_username itself.
+  """
+  if instance.delivery_crew_id is None:
+    instance.crew_username = ''
+  elif Order.delivery_crew.is_cached(instance) and instance.delivery_crew is not None:
+    instance.crew_username = instance.delivery_crew.username
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+  """Logging out deletes the token, which must stop working at once"""
+  token_cache.forget_token(instance.key, instance.user_id)
+  transaction.on_commit(lambda: token_cache.forget_token(instance.key, instance.user_id))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_group_roles(sender, instance, **kwargs):
+  """Renaming or deleting a group changes the roles of all of its members"""
+  if kwargs.get('created'):
+    return
+  _forget_roles_now_and_on_commit(instance.user_set.values_list('id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Order)
+@receiver([post_save, post_delete], sender=OrderItem)
+@receiver([post_save, post_delete], sender=ArchivedOrder)
+def invalidate_order_validators(sender, **kwargs):
+  """ETags handed out for order responses no longer match"""
+  conditional.bump_on_commit('orders')
+
+
+@receiver(pre_delete, sender=Order)
+@receiver(pre_delete, sender=ArchivedOrder)
+def remove_order_from_rollup(sender, instance, **kwargs):
+  """A deleted order no longer counts towards the sales rollup, archived or not"""
+  if reports.rollup_enabled():
+    lines = instance.orderitem_set.values_list('menuitem_id', 'quantity', 'price')
+    reports.record_sales(instance.date, lines, sign=-1)
+
+
+@receiver(pre_save, sender=Order)
+@receiver(pre_save, sender=ArchivedOrder)
+def move_order_in_rollup(sender, instance, update_fields=None, **kwargs):
+  """An order whose date changes takes its sales from the old day of the rollup to the new one"""
+  if not reports.rollup_enabled() or instance._state.adding or (update_fields is not None and 'date' not in update_fields):
+    return
+  previous = sender.objects.filter(pk=instance.pk).values_list('date', flat=True).first()
+  date = sender._meta.get_field('date').to_python(instance.date)
+  if previous is None or previous == date:
+    return
+  lines = list(instance.orderitem_set.values_list('menuitem_id', 'quantity', 'price'))
+  reports.record_sales(previous, lines, sign=-1)
+  reports.record_sales(date, lines)
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+  sqlite.tune_connection(connection)
+
+
+@receiver(request_started)
+def start_dispatcher(sender, **kwargs):
+  """The in-process dispatcher starts with the first request, so it drains what a restart left in the outbox"""
+  dispatch.start_worker()
@@ -0,0 +1,50 @@
+"""Production tuning of SQLite connections, see SQLITE_TUNING in the settings"""
+from django.conf import settings
+import django
+
+DEFAULT_TUNING = {
+  'ENABLED': False,
+  'JOURNAL_MODE': 'WAL',
+  'SYNCHRONOUS': 'NORMAL',
+  'CACHE_SIZE': -20000,
+  'MMAP_SIZE': 256 * 1024 * 1024,
+  'BUSY_TIMEOUT': 5000,
+  'CONN_MAX_AGE': 600,
+}
+
+
+def tuning(overrides=None):
+  if overrides is None:
+    overrides = getattr(settings, 'SQLITE_TUNING', {})
+  return {**DEFAULT_TUNING, **overrides}
+
+
+def configure_database(database, overrides=None):
+  """Updates a DATABASES entry in place for the tuned mode, a no-op unless it is enabled"""
+  options = tuning(overrides)
+  if not options['ENABLED'] or not database['ENGINE'].endswith('sqlite3'):
+    return database
+  database['CONN_MAX_AGE'] = options['CONN_MAX_AGE']
+  database['CONN_HEALTH_CHECKS'] = True
+  database.setdefault('OPTIONS', {})
+  # Seconds the driver waits on a locked database, the pragma below covers connections made elsewhere
+  database['OPTIONS'].setdefault('timeout', options['BUSY_TIMEOUT'] / 1000)
+  if django.VERSION >= (5, 1):
+    # A transaction that reads then writes would otherwise fail at once when another writer holds the lock
+    database['OPTIONS'].setdefault('transaction_mode', 'IMMEDIATE')
+  return database
+
+
+def tune_connection(connection):
+  """Applies the tuning pragmas to a freshly opened connection"""
+  options = tuning()
+  if not options['ENABLED'] or connection.vendor != 'sqlite':
+    return
+  # Straight on the driver connection, so the pragmas are not counted as queries of the request that connected
+  raw = connection.connection
+  # Readers keep going while a writer commits, instead of waiting on the rollback journal
+  raw.execute('PRAGMA journal_mode = %s' % options['JOURNAL_MODE'])
+  raw.execute('PRAGMA synchronous = %s' % options['SYNCHRONOUS'])
+  raw.execute('PRAGMA cache_size = %d' % options['CACHE_SIZE'])
+  raw.execute('PRAGMA mmap_size = %d' % options['MMAP_SIZE'])
+  raw.execute('PRAGMA busy_timeout = %d' % options['BUSY_TIMEOUT'])
@@ -0,0 +1,143 @@
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from .roles import MANAGER, DELIVERY_CREW
+import asyncio
+import json
+import threading
+
+
+class Subscription:
+  """One connected client, seeing the same orders as it would through GET /api/orders"""
+
+  def __init__(self, user_id, roles, max_pending):
+    self.user_id = user_id
+    if MANAGER in roles:
+      self.scope = 'all'
+    elif DELIVERY_CREW in roles:
+      self.scope = 'crew'
+    else:
+      self.scope = 'customer'
+    self.loop = asyncio.get_running_loop()
+    self.queue = asyncio.Queue(maxsize=max_pending)
+    # Set when events had to be dropped, the client is then told to fetch its orders again
+    self.lagged = False
+
+  def wants(self, event):
+    if self.scope == 'all':
+      return True
+    if self.scope == 'crew':
+      return self.user_id in (event['delivery_crew'], event['previous_delivery_crew'])
+    return self.user_id == event['user']
+
+  def deliver(self, event):
+    try:
+      self.queue.put_nowait(event)
+    except asyncio.QueueFull:
+      self.lagged = True
+
+  async def get(self):
+    if self.lagged:
+      self.lagged = False
+      return {'type': 'resync'}
+    return await self.queue.get()
+
+
+class OrderStreamBroker:
+  """Fans order changes out to the clients connected to this process"""
+
+  def __init__(self, max_pending=16):
+    self.max_pending = max_pending
+    self._subscriptions = set()
+    self._lock = threading.Lock()
+
+  def subscribe(self, user_id, roles):
+    subscription = Subscription(user_id, roles, self.max_pending)
+    with self._lock:
+      self._subscriptions.add(subscription)
+    return subscription
+
+  def unsubscribe(self, subscription):
+    with self._lock:
+      self._subscriptions.discard(subscription)
+
+  def __len__(self):
+    return len(self._subscriptions)
+
+  def publish(self, event):
+    """Thread safe, views call it from worker threads while clients wait on their event loop"""
+    with self._lock:
+      subscriptions = [subscription for subscription in self._subscriptions if subscription.wants(event)]
+    for subscription in subscriptions:
+      try:
+        subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+      except RuntimeError:
+        # The loop of a client that went away without unsubscribing is closed
+        self.unsubscribe(subscription)
+
+
+broker = OrderStreamBroker()
+
+
+def order_changed(order, previous_delivery_crew=None):
+  """Publishes the order's status and delivery crew once the current transaction commits"""
+  event = {
+    'type': 'order',
+    'id': order.pk,
+    'user': order.user_id,
+    'status': order.status,
+    'delivery_crew': order.delivery_crew_id,
+    'previous_delivery_crew': previous_delivery_crew,
+  }
+  transaction.on_commit(lambda: broker.publish(event))
+
+
+class EventStream:
+  """Server-sent events body of one subscription, closed by Django once the client is gone"""
+
+  # Seconds between keepalive comments on idle streams
+  keepalive = 15
+
+  def __init__(self, subscription):
+    self.subscription = subscription
+
+  def __aiter__(self):
+    return self.events()
+
+  async def events(self):
+    try:
+      yield 'retry: 5000\n\n'
+      while True:
+        try:
+          event = await asyncio.wait_for(self.subscription.get(), self.keepalive)
+        except asyncio.TimeoutError:
+          # Comments keep proxies from closing idle connections and reveal clients that went away
+          yield ': keepalive\n\n'
+          continue
+        yield format_event(event)
+    finally:
+      self.close()
+
+  def close(self):
+    broker.unsubscribe(self.subscription)
+
+
+def format_event(event):
+  if event['type'] == 'resync':
+    return 'event: resync\ndata: {}\n\n'
+  data = {key: event[key] for key in ('id', 'status', 'delivery_crew')}
+  return 'event: order\ndata: %s\n\n' % json.dumps(data)
+
+
+async def authenticate(request):
+  """Token authentication for the stream, which also accepts ?token= since EventSource cannot set headers"""
+  key = request.GET.get('token')
+  header = request.headers.get('Authorization', '').split()
+  if len(header) == 2 and header[0] == 'Token':
+    key = header[1]
+  if not key:
+    return None
+  try:
+    token = await Token.objects.select_related('user').aget(key=key)
+  except Token.DoesNotExist:
+    return None
+  return token.user if token.user.is_active else None
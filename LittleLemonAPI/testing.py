@@ -0,0 +1,10 @@
+from .middleware import budget_for, route_of
+
+
+def assert_query_budget(response):
+  """Fails when the request behind a test client response ran more queries than its route's budget"""
+  request = response.wsgi_request
+  method, route = request.method, route_of(request)
+  budget = budget_for(method, route)
+  assert budget is not None, 'No query budget is declared for %s %s' % (method, route)
+  assert request.metrics.queries <= budget, '%s %s ran %d queries, its budget is %d' % (method, route, request.metrics.queries, budget)
@@ -1,3 +1,1288 @@
-from django.test import TestCase
+from django.apps import apps as django_apps
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections
+from django.contrib.auth.models import User, Group
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework.authtoken.models import Token
+from .models import Category, MenuItem, Cart, Order, OrderItem, OrderEvent, ArchivedOrder, DailySales
+from .archive import archive_orders
+from .dispatch import DispatchWorker, process_pending
+from .streams import broker
+from .middleware import QueryBudgetExceeded
+from .testing import assert_query_budget
+from .pagination import KeysetPaginator
+from .renderers import FastJSONRenderer
+from .serializers import MenuItemSerializer, OrderSerializer, OrderItemSerializer
+from .serializers import MenuItemListSerializer, OrderListSerializer, OrderItemListSerializer
+from .cache import LocalMenuCache, menu_cache
+from .menu_index import menu_index
+from .coalesce import SingleFlight, single_flight
+from .shared import shared_cache
+from .authentication import token_cache
+from .throttling import SQLiteRateStore, UserRateThrottle
+from . import conditional, dispatch, listings, reports, sqlite, throttling, views
+from decimal import Decimal
+import datetime
+import importlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+
+# The tests keep their throttle history and shared cache in a temporary directory instead of next to the
+# database, and run without the in-process dispatcher, which would start with the first request and poll the
+# test database
+_test_state = {}
+
+
+def setUpModule():
+  directory = _test_state['directory'] = tempfile.mkdtemp()
+  _test_state['settings'] = override_settings(
+    ORDER_DISPATCH={'IN_PROCESS': False},
+    THROTTLE_STORE={'PATH': os.path.join(directory, 'throttle.sqlite3')},
+    CACHES={
+      'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+      'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': os.path.join(directory, 'shared_cache')},
+    },
+  )
+  _test_state['settings'].enable()
+  _test_state['throttle_store'] = mock.patch.object(throttling, 'throttle_store', throttling.build_throttle_store())
+  _test_state['throttle_store'].start()
+
+
+def tearDownModule():
+  _test_state['throttle_store'].stop()
+  _test_state['settings'].disable()
+  shutil.rmtree(_test_state['directory'])
+
+
+# Any request going over its route's query budget fails the test that made it
+@override_settings(QUERY_BUDGET_STRICT=True)
+class APITestCase(TestCase):
+  def setUp(self):
+    # Throttle history lives in the cache and the throttle store, and would otherwise leak between tests
+    cache.clear()
+    shared_cache().clear()
+    throttling.throttle_store.clear()
+    menu_cache.clear()
+    menu_index.clear()
+    token_cache.clear()
+    self.client = APIClient()
+    self.category = Category.objects.create(slug='mains', title='Mains')
+    self.manager_group = Group.objects.create(name='Manager')
+    self.crew_group = Group.objects.create(name='Delivery Crew')
+    self.customer = User.objects.create_user('customer')
+
+  def add_items(self, count, price='5.00'):
+    return MenuItem.objects.bulk_create([
+      MenuItem(title='Item %d' % i, price=Decimal(price), featured=False, category=self.category)
+      for i in range(count)
+    ])
+
+  def fill_cart(self, user, items, quantity=2):
+    Cart.objects.bulk_create([
+      Cart(user=user, menuitem=item, quantity=quantity, unit_price=item.price, price=item.price * quantity)
+      for item in items
+    ])
+
+
+class CheckoutTests(APITestCase):
+  def test_checkout_creates_order_and_empties_cart(self):
+    self.fill_cart(self.customer, self.add_items(3))
+    self.client.force_authenticate(self.customer)
+
+    response = self.client.post('/api/orders')
+
+    self.assertEqual(response.status_code, 201)
+    order = Order.objects.get(user=self.customer)
+    self.assertEqual(order.total, Decimal('30.00'))
+    self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+    self.assertFalse(Cart.objects.filter(user=self.customer).exists())
+
+  def test_checkout_query_count_does_not_grow_with_cart(self):
+    self.client.force_authenticate(self.customer)
+    items = self.add_items(30)
+
+    self.fill_cart(self.customer, items[:1])
+    with self.assertNumQueries(8):
+      self.client.post('/api/orders')
+
+    self.fill_cart(self.customer, items)
+    with self.assertNumQueries(8):
+      self.client.post('/api/orders')
+
+
+class CartTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    self.items = self.add_items(20, price='2.35')
+    self.client.force_authenticate(self.customer)
+
+  def test_adding_an_item_twice_updates_its_row(self):
+    self.client.post('/api/cart/menu-items', {'menu item': 'Item 1', 'quantity': 2}, format='json')
+    response = self.client.post('/api/cart/menu-items', {'menu item': 'Item 1', 'quantity': 3}, format='json')
+
+    self.assertEqual(response.status_code, 201)
+    row = Cart.objects.get(user=self.customer)
+    self.assertEqual((row.quantity, row.price), (3, Decimal('7.05')))
+
+  def test_line_price_must_fit_the_cart(self):
+    MenuItem.objects.create(title='Platter', price=Decimal('3.00'), featured=False, category=self.category)
+    response = self.client.post('/api/cart/menu-items', {'menu item': 'Platter', 'quantity': 30000}, format='json')
+    self.assertEqual(response.status_code, 400)
+    self.assertFalse(Cart.objects.exists())
+
+    # Every line fits, the order total does not
+    self.client.post('/api/cart/menu-items', [{'menu item': 'Platter', 'quantity': 3000}, {'menu item': 'Item 0', 'quantity': 1000}], format='json')
+    response = self.client.post('/api/orders')
+    self.assertEqual((response.status_code, response.data), (400, {"message": "The cart costs more than an order can hold"}))
+    self.assertEqual(self.client.get('/api/cart/menu-items').status_code, 200)
+
+  def test_batch_add_takes_two_queries_whatever_its_size(self):
+    with self.assertNumQueries(2):
+      self.client.post('/api/cart/menu-items', [{'menu item': 'Item 1', 'quantity': 1}], format='json')
+    with self.assertNumQueries(2):
+      response = self.client.post('/api/cart/menu-items', [
+        {'menu item': item.title, 'quantity': 3} for item in self.items
+      ], format='json')
+
+    self.assertEqual(response.data['count'], 20)
+    self.assertEqual(Cart.objects.filter(user=self.customer).count(), 20)
+
+  def test_unknown_item_adds_nothing(self):
+    response = self.client.post('/api/cart/menu-items', [
+      {'menu item': 'Item 1', 'quantity': 1}, {'menu item': 'Missing', 'quantity': 1},
+    ], format='json')
+
+    self.assertEqual(response.status_code, 400)
+    self.assertFalse(Cart.objects.exists())
+
+  def test_listing_is_one_query_with_the_total(self):
+    self.fill_cart(self.customer, self.items, quantity=3)
+
+    with self.assertNumQueries(1):
+      response = self.client.get('/api/cart/menu-items', {'include_total': '1'})
+
+    self.assertEqual(len(response.data['items']), 20)
+    self.assertEqual(response.data['items'][0]['menuitem'], 'Item 0')
+    self.assertEqual(response.data['total'], Decimal('141.00'))
+
+  def test_listing_stays_a_list_without_the_opt_in(self):
+    self.fill_cart(self.customer, self.items[:2])
+    response = self.client.get('/api/cart/menu-items')
+    self.assertEqual([row['menuitem'] for row in response.data], ['Item 0', 'Item 1'])
+
+  def test_empty_cart_totals_zero(self):
+    response = self.client.get('/api/cart/menu-items', {'include_total': '1'})
+    self.assertEqual(response.data, {"items": [], "total": Decimal('0.00')})
+
+
+class MenuCacheTests(APITestCase):
+  def test_repeated_listing_is_served_from_cache(self):
+    self.add_items(3)
+    first = self.client.get('/api/menu-items', {'perpage': 3})
+
+    with self.assertNumQueries(0):
+      second = self.client.get('/api/menu-items', {'perpage': 3})
+
+    self.assertEqual(first.data, second.data)
+
+  def test_catalog_change_invalidates_cached_pages(self):
+    item = self.add_items(1)[0]
+    self.client.get('/api/menu-items')
+
+    with self.captureOnCommitCallbacks(execute=True):
+      item.title = 'Renamed'
+      item.save()
+
+    response = self.client.get('/api/menu-items')
+    self.assertEqual(response.data[0]['title'], 'Renamed')
+
+  def test_change_in_another_process_invalidates_local_pages(self):
+    item = self.add_items(1)[0]
+    self.client.get('/api/menu-items')
+    # An update fires no signal here, as when the change is committed by another process
+    MenuItem.objects.filter(pk=item.pk).update(title='Renamed')
+    conditional.bump('menu')
+
+    response = self.client.get('/api/menu-items')
+    self.assertEqual(response.data[0]['title'], 'Renamed')
+
+  def test_least_recently_used_page_is_evicted(self):
+    local = LocalMenuCache(max_entries=2)
+    for page in ('1', '2', '3'):
+      local.set(local.make_key(page), [page])
+
+    self.assertIsNone(local.get(local.make_key('1')))
+    self.assertEqual(local.get(local.make_key('3')), ['3'])
+    self.assertEqual(local.stats()['evictions'], 1)
+
+
+class CursorPaginationTests(APITestCase):
+  def test_cursor_walks_every_menu_item_once(self):
+    for i, price in enumerate(['3.00', '1.00', '2.00', '1.00', '3.00']):
+      MenuItem.objects.create(title='Dish %d' % i, price=Decimal(price), featured=False, category=self.category)
+
+    titles = []
+    cursor = ''
+    while cursor is not None:
+      response = self.client.get('/api/menu-items', {'cursor': cursor, 'ordering': 'price', 'perpage': 2})
+      self.assertEqual(response.status_code, 200)
+      titles += [row['title'] for row in response.data['results']]
+      cursor = response.data['next']
+
+    self.assertEqual(titles, ['Dish 1', 'Dish 3', 'Dish 2', 'Dish 0', 'Dish 4'])
+
+  def test_cursor_pages_manager_orders(self):
+    manager = User.objects.create_user('manager')
+    manager.groups.add(self.manager_group)
+    Order.objects.bulk_create([Order(user=self.customer, total=1, date='2023-03-0%d' % day) for day in range(1, 6)])
+    self.client.force_authenticate(manager)
+
+    first = self.client.get('/api/orders', {'cursor': '', 'ordering': '-date', 'perpage': 3})
+    second = self.client.get('/api/orders', {'cursor': first.data['next'], 'ordering': '-date', 'perpage': 3})
+
+    self.assertEqual([row['date'] for row in first.data['results']], ['2023-03-05', '2023-03-04', '2023-03-03'])
+    self.assertEqual([row['date'] for row in second.data['results']], ['2023-03-02', '2023-03-01'])
+    self.assertIsNone(second.data['next'])
+
+  def test_offset_paging_still_returns_a_list(self):
+    self.add_items(3)
+    response = self.client.get('/api/menu-items', {'page': 2})
+    self.assertEqual([row['title'] for row in response.data], ['Item 2'])
+
+  def test_invalid_cursor_is_rejected(self):
+    response = self.client.get('/api/menu-items', {'cursor': 'not-a-cursor'})
+    self.assertEqual(response.status_code, 400)
+
+  def test_cursor_values_the_ordering_cannot_hold_are_rejected(self):
+    self.add_items(3)
+    headers = {'Authorization': 'Token ' + Token.objects.create(user=self.customer).key}
+    encode = KeysetPaginator.encode
+    cases = [
+      ('/api/menu-items', {'ordering': 'price', 'cursor': encode('abc', 1)}),
+      ('/api/menu-items', {'ordering': 'price', 'cursor': encode(None, 1)}),
+      ('/api/menu-items', {'ordering': 'title', 'cursor': encode('Item 1', 'x')}),
+      ('/api/menu-items', {'cursor': encode(1, 10 ** 30)}),
+      ('/api/orders', {'ordering': 'date', 'cursor': encode('zzz', 1)}),
+      ('/api/orders', {'ordering': 'date', 'cursor': encode(None, 1)}),
+    ]
+    for path, params in cases:
+      self.assertEqual(self.client.get(path, params, HTTP_AUTHORIZATION=headers['Authorization']).status_code, 400, params)
+      with self.settings(ROOT_URLCONF=AsyncRoutes):
+        self.assertEqual(async_to_sync(self.async_client.get)(path, params, headers=headers).status_code, 400, params)
+
+  def test_page_size_must_be_a_positive_number(self):
+    self.client.force_authenticate(self.customer)
+    for perpage in ['0', '-1', 'many']:
+      for path, params in [('/api/menu-items', {}), ('/api/menu-items', {'cursor': ''}), ('/api/orders', {'cursor': ''})]:
+        self.assertEqual(self.client.get(path, dict(params, perpage=perpage)).status_code, 400, (path, perpage))
+
+
+class RoleResolutionTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    self.crew = User.objects.create_user('crew')
+    self.crew.groups.add(self.crew_group)
+    self.client.force_authenticate(self.crew)
+
+  def test_roles_are_resolved_once_per_request(self):
+    # One query for the group names and one for the orders, instead of a query per role check
+    with self.assertNumQueries(2):
+      self.client.get('/api/orders')
+
+  @override_settings(ROLE_CACHE_TIMEOUT=300)
+  def test_roles_are_cached_across_requests(self):
+    self.client.get('/api/orders')
+    with self.assertNumQueries(1):
+      self.client.get('/api/orders')
+
+  @override_settings(ROLE_CACHE_TIMEOUT=300)
+  def test_membership_change_invalidates_cached_roles(self):
+    manager = User.objects.create_user('manager')
+    manager.groups.add(self.manager_group)
+    self.client.force_authenticate(manager)
+    self.assertEqual(self.client.get('/api/groups/delivery-crew/users').status_code, 200)
+
+    self.manager_group.user_set.remove(manager)
+
+    self.assertEqual(self.client.get('/api/groups/delivery-crew/users').status_code, 403)
+
+
+class AccessPatternTests(APITestCase):
+  def explain(self, path, params):
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(self.client.get(path, params).status_code, 200)
+    with connection.cursor() as cursor:
+      cursor.execute('EXPLAIN QUERY PLAN ' + queries.captured_queries[-1]['sql'])
+      return '\n'.join(row[-1] for row in cursor.fetchall())
+
+  def test_category_filter_takes_slug_or_id(self):
+    self.add_items(2)
+    drinks = Category.objects.create(slug='drinks', title='Drinks')
+    MenuItem.objects.create(title='Tea', price=Decimal('2.00'), featured=False, category=drinks)
+    self.client.force_authenticate(self.customer)
+    for category in ('drinks', str(drinks.pk)):
+      response = self.client.get('/api/menu-items', {'category': category, 'perpage': 10})
+      self.assertEqual([item['title'] for item in response.json()], ['Tea'])
+
+  def test_filtered_listings_seek_their_composite_index(self):
+    self.add_items(3)
+    Order.objects.create(user=self.customer, total=0, date='2023-03-01')
+    self.client.force_authenticate(self.customer)
+    plan = self.explain('/api/menu-items', {'category': 'mains', 'to_price': '6', 'ordering': 'price'})
+    self.assertIn('(category_id=? AND price<?)', plan)
+    self.assertNotIn('TEMP B-TREE', plan)
+
+    plan = self.explain('/api/orders', {'cursor': '', 'ordering': '-date'})
+    self.assertIn('SEARCH LittleLemonAPI_order USING INDEX LittleLemon_user_id_65d2ad_idx (user_id=?)', plan)
+    self.assertNotIn('TEMP B-TREE', plan)
+
+
+class MenuSearchTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    for title in ['Lemon Dessert', 'Grilled Fish', 'Lemon Lemon Tart']:
+      MenuItem.objects.create(title=title, price=Decimal('5.00'), featured=False, category=self.category)
+
+  def search(self, text):
+    response = self.client.get('/api/menu-items', {'search': text, 'perpage': 10})
+    return [row['title'] for row in response.data]
+
+  def test_prefix_search_ranks_best_matches_first(self):
+    self.assertEqual(self.search('lem'), ['Lemon Lemon Tart', 'Lemon Dessert'])
+
+  def test_index_follows_title_updates(self):
+    MenuItem.objects.filter(title='Grilled Fish').update(title='Lemon Grilled Fish')
+    menu_cache.clear()
+    self.assertIn('Lemon Grilled Fish', self.search('lemon grill'))
+
+
+@override_settings(MENU_INDEX=True)
+class MenuIndexTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    desserts = Category.objects.create(slug='desserts', title='Desserts')
+    # Repeated prices and titles, so the tie-breaks are exercised
+    MenuItem.objects.bulk_create([
+      MenuItem(title='Dish %d' % (i % 7), price=Decimal('%d.50' % (i % 5 + 1)), featured=i % 3 == 0, category=self.category if i % 2 else desserts)
+      for i in range(23)
+    ])
+    self.category_ids = [str(self.category.pk), str(desserts.pk)]
+
+  def listing(self, params):
+    menu_cache.clear()
+    throttling.throttle_store.clear()
+    response = self.client.get('/api/menu-items', params)
+    self.assertEqual(response.status_code, 200)
+    return response.data
+
+  def both(self, params):
+    with override_settings(MENU_INDEX=False):
+      expected = self.listing(params)
+    return self.listing(params), expected
+
+  def test_pages_match_the_database(self):
+    for category in [None, 'mains', 'unknown', self.category_ids[1]]:
+      for to_price in [None, '3.50', '3', '0']:
+        for ordering in [None, 'price', '-price', 'title', '-title', '-id', 'featured', 'title,price']:
+          for page in [1, 3, 12]:
+            params = {key: value for key, value in [('category', category), ('to_price', to_price), ('ordering', ordering)] if value}
+            params.update(page=page, perpage=4)
+            index, database = self.both(params)
+            self.assertEqual(index, database, params)
+    self.assertEqual(menu_index.rebuilds, 1)
+
+  def test_cursor_chains_match_the_database(self):
+    for category in [None, 'mains', self.category_ids[1]]:
+      for to_price in [None, '2.50']:
+        for ordering in ['id', 'price', '-price', 'title', '-title', '-id']:
+          cursor = ''
+          while cursor is not None:
+            params = {'cursor': cursor, 'ordering': ordering, 'perpage': 3, 'category': category or '', 'to_price': to_price or ''}
+            index, database = self.both(params)
+            self.assertEqual(index, database, params)
+            cursor = index['next']
+
+  def test_warm_index_answers_without_queries(self):
+    self.listing({'ordering': 'price'})
+    menu_cache.clear()
+    with self.assertNumQueries(0):
+      self.client.get('/api/menu-items', {'ordering': '-price', 'category': 'mains', 'to_price': '4'})
+    self.assertEqual(menu_index.rebuilds, 1)
+
+  def test_catalog_change_rebuilds_the_index(self):
+    self.listing({})
+    with self.captureOnCommitCallbacks(execute=True):
+      MenuItem.objects.create(title='Aaa', price=Decimal('0.50'), featured=False, category=self.category)
+
+    self.assertEqual(self.listing({'ordering': 'price', 'perpage': 1})[0]['title'], 'Aaa')
+    self.assertEqual(menu_index.rebuilds, 2)
+
+  def test_async_view_answers_from_the_index(self):
+    params = {'ordering': '-title', 'category': 'mains', 'page': 2, 'perpage': 3}
+    expected = self.listing(params)
+    menu_cache.clear()
+    with self.settings(ROOT_URLCONF=AsyncRoutes), self.assertNumQueries(0):
+      response = async_to_sync(self.async_client.get)('/api/menu-items', params)
+    self.assertEqual(response.json(), expected)
+
+  def test_searches_and_bad_cursors_are_not_answered_by_the_index(self):
+    self.assertEqual([row['title'] for row in self.listing({'search': 'dish 3', 'perpage': 10})], ['Dish 3'] * 3)
+    self.assertEqual(self.client.get('/api/menu-items', {'cursor': 'not-a-cursor'}).status_code, 400)
+    self.assertEqual(self.client.get('/api/menu-items', {'ordering': 'price', 'cursor': KeysetPaginator.encode('abc', 1)}).status_code, 400)
+
+
+class OrderDispatchTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    self.busy, self.idle = User.objects.create_user('busy'), User.objects.create_user('idle')
+    self.crew_group.user_set.add(self.busy, self.idle)
+    Order.objects.create(user=self.customer, delivery_crew=self.busy, total=1, date='2023-03-01')
+
+  def test_checkout_writes_outbox_row(self):
+    self.client.force_authenticate(self.customer)
+    self.client.post('/api/orders')
+    self.assertEqual(OrderEvent.objects.filter(processed__isnull=True).count(), 1)
+
+  def test_new_order_goes_to_least_loaded_crew(self):
+    self.client.force_authenticate(self.customer)
+    self.client.post('/api/orders')
+
+    self.assertEqual(process_pending(), 1)
+    self.assertEqual(Order.objects.latest('id').delivery_crew, self.idle)
+    self.assertEqual(process_pending(), 0)
+
+  @override_settings(ORDER_DISPATCH={'IN_PROCESS': True})
+  def test_first_request_starts_the_in_process_worker(self):
+    # Outbox rows left by a restart are drained without waiting for a checkout
+    with mock.patch.object(dispatch, '_worker', None), mock.patch.object(DispatchWorker, 'start') as start:
+      self.client.get('/api/menu-items')
+    start.assert_called_once_with()
+
+
+class DispatchWorkerTests(TransactionTestCase):
+  def test_worker_drains_outbox_in_background(self):
+    crew = User.objects.create_user('crew')
+    crew.groups.add(Group.objects.create(name='Delivery Crew'))
+    order = Order.objects.create(user=User.objects.create_user('customer'), total=1, date='2023-03-01')
+    OrderEvent.objects.create(order=order)
+
+    worker = DispatchWorker(poll_interval=0.05)
+    worker.start()
+    try:
+      for _ in range(100):
+        try:
+          if not OrderEvent.objects.filter(processed__isnull=True).exists():
+            break
+        except OperationalError:
+          # The in-memory test database reports its tables locked instead of waiting while the worker writes
+          pass
+        time.sleep(0.05)
+    finally:
+      worker.stop(timeout=5)
+
+    order.refresh_from_db()
+    self.assertEqual(order.delivery_crew, crew)
+
+
+class CoalescingTests(TransactionTestCase):
+  def setUp(self):
+    cache.clear()
+    shared_cache().clear()
+    throttling.throttle_store.clear()
+    menu_cache.clear()
+    single_flight.clear()
+    category = Category.objects.create(slug='mains', title='Mains')
+    MenuItem.objects.bulk_create([MenuItem(title='Item %d' % i, price=Decimal('5.00'), featured=False, category=category) for i in range(3)])
+    self.users = [User.objects.create_user('customer-%d' % i) for i in range(2)]
+    for user in self.users:
+      Order.objects.create(user=user, total=1, date='2023-03-01')
+
+  def concurrent_gets(self, path, users, module, serializer_name):
+    """GETs path as each of the users at once, holding every serialization by module's serializer until all of them are in flight"""
+    calls = []
+
+    class Blocking(getattr(module, serializer_name)):
+      @property
+      def data(self):
+        calls.append(self)
+        deadline = time.monotonic() + 5
+        while single_flight.leaders + single_flight.followers < len(users) and time.monotonic() < deadline:
+          time.sleep(0.01)
+        return super().data
+
+    responses = [None] * len(users)
+
+    def get(index):
+      client = APIClient()
+      client.force_authenticate(users[index])
+      try:
+        responses[index] = client.get(path)
+      finally:
+        connections.close_all()
+
+    with mock.patch.object(module, serializer_name, Blocking):
+      threads = [threading.Thread(target=get, args=(index,)) for index in range(len(users))]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+    return len(calls), responses
+
+  def test_identical_menu_reads_run_once(self):
+    calls, responses = self.concurrent_gets('/api/menu-items?perpage=3', self.users * 4, views, 'MenuItemListSerializer')
+
+    self.assertEqual(calls, 1)
+    self.assertEqual([response.status_code for response in responses], [200] * 8)
+    self.assertEqual(len({response.content for response in responses}), 1)
+    self.assertEqual(single_flight.stats(), {"leaders": 1, "followers": 7, "timeouts": 0})
+
+  def test_order_reads_are_only_shared_by_the_same_user(self):
+    calls, responses = self.concurrent_gets('/api/orders', self.users * 3, listings, 'OrderListSerializer')
+
+    self.assertEqual(calls, 2)
+    for user, response in zip(self.users * 3, responses):
+      self.assertEqual([row['user'] for row in response.json()], [user.pk])
+
+  def test_waiters_compute_their_own_after_the_timeout(self):
+    flights = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flights.run, args=('key', lambda: release.wait(5) and Response(['slow']), 5))
+    leader.start()
+    while flights.stats()['leaders'] == 0:
+      time.sleep(0.01)
+
+    response = flights.run('key', lambda: Response(['own']), timeout=0.05)
+    release.set()
+    leader.join()
+    self.assertEqual(response.data, ['own'])
+    self.assertEqual(flights.stats()['timeouts'], 1)
+
+
+class OrderStreamTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    self.token = Token.objects.create(user=self.customer)
+    self.own = Order.objects.create(user=self.customer, total=1, date='2023-03-01')
+    self.other = Order.objects.create(user=User.objects.create_user('other'), total=1, date='2023-03-01')
+
+  def event(self, order):
+    return {'type': 'order', 'id': order.pk, 'user': order.user_id, 'status': True, 'delivery_crew': None, 'previous_delivery_crew': None}
+
+  async def test_customer_only_receives_changes_to_own_orders(self):
+    response = await self.async_client.get('/api/orders/stream', headers={'Authorization': 'Token ' + self.token.key})
+    content = response.streaming_content
+    self.assertEqual(await anext(content), b'retry: 5000\n\n')
+
+    broker.publish(self.event(self.other))
+    broker.publish(self.event(self.own))
+
+    self.assertEqual(await anext(content), b'event: order\ndata: {"id": %d, "status": true, "delivery_crew": null}\n\n' % self.own.pk)
+    response.close()
+    self.assertEqual(len(broker), 0)
+
+  async def test_stream_requires_a_token(self):
+    response = await self.async_client.get('/api/orders/stream')
+    self.assertEqual(response.status_code, 401)
+
+  def test_stream_is_not_served_over_wsgi(self):
+    response = self.client.get('/api/orders/stream', headers={'Authorization': 'Token ' + self.token.key})
+    self.assertEqual(response.status_code, 501)
+    self.assertEqual(len(broker), 0)
+
+
+class AsyncRoutes:
+  urlpatterns = [path('api/', include('LittleLemonAPI.async_urls'))]
+
+
+class AsyncViewTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    self.items = self.add_items(3)
+    crew = User.objects.create_user('crew')
+    self.order = Order.objects.create(user=self.customer, delivery_crew=crew, crew_username='crew', total=10, date='2023-03-01', item_count=3)
+    OrderItem.objects.bulk_create([
+      OrderItem(order=self.order, menuitem=item, quantity=2, unit_price=item.price, price=item.price * 2) for item in self.items
+    ])
+    manager = User.objects.create_user('manager')
+    self.manager_group.user_set.add(manager)
+    self.tokens = {user: Token.objects.create(user=user).key for user in (self.customer, manager)}
+    self.manager = manager
+
+  def get(self, user, path, params=None, routes=None, **headers):
+    menu_cache.clear()
+    if user is not None:
+      headers['Authorization'] = 'Token ' + self.tokens[user]
+    if routes is None:
+      return self.client.get(path, params, headers=headers)
+    with self.settings(ROOT_URLCONF=routes):
+      return async_to_sync(self.async_client.get)(path, params, headers=headers)
+
+  def test_reads_are_routed_to_coroutines(self):
+    for path in ['/api/menu-items', '/api/menu-items/1', '/api/orders', '/api/orders/1']:
+      self.assertTrue(iscoroutinefunction(resolve(path, urlconf=AsyncRoutes).func), path)
+
+  def test_reads_match_the_sync_views(self):
+    requests = [
+      (None, '/api/menu-items', {'perpage': 10, 'ordering': 'price'}),
+      (None, '/api/menu-items', {'category': 'mains', 'to_price': '5', 'page': 2}),
+      (None, '/api/menu-items', {'category': str(self.category.pk), 'cursor': '', 'ordering': 'price'}),
+      (None, '/api/menu-items', {'perpage': 11}),
+      (self.customer, '/api/menu-items/%d' % self.items[0].pk, None),
+      (self.customer, '/api/menu-items/0', None),
+      (self.customer, '/api/orders', None),
+      (self.customer, '/api/orders', {'expand': 'items'}),
+      (self.manager, '/api/orders', {'cursor': '', 'ordering': '-date', 'expand': 'items'}),
+      (self.manager, '/api/orders', {'cursor': 'nonsense'}),
+      (self.manager, '/api/orders', {'cursor': '', 'perpage': '-1'}),
+      (None, '/api/menu-items', {'cursor': '', 'perpage': '0'}),
+      (self.customer, '/api/orders', {'include_archived': '1', 'expand': 'items'}),
+      (self.manager, '/api/orders', {'include_archived': '1', 'cursor': '', 'ordering': 'date'}),
+      (self.customer, '/api/orders/%d' % self.order.pk, None),
+      (self.manager, '/api/orders/%d' % self.order.pk, None),
+      (self.customer, '/api/orders/0', None),
+    ]
+    for user, path, params in requests:
+      expected = self.get(user, path, params)
+      response = self.get(user, path, params, routes=AsyncRoutes)
+      self.assertEqual((response.status_code, response.content), (expected.status_code, expected.content), (path, params))
+      self.assertEqual(response.get('ETag'), expected.get('ETag'))
+
+  def test_unchanged_orders_are_not_modified(self):
+    response = self.get(self.customer, '/api/orders', routes=AsyncRoutes)
+    response = self.get(self.customer, '/api/orders', routes=AsyncRoutes, If_None_Match=response['ETag'])
+    self.assertEqual(response.status_code, 304)
+
+  def test_credentials_and_throttles_are_checked(self):
+    self.assertEqual(self.get(None, '/api/orders', routes=AsyncRoutes).status_code, 401)
+    response = self.get(None, '/api/orders', routes=AsyncRoutes, Authorization='Token nonsense')
+    self.assertEqual((response.status_code, response.json()), (401, {"detail": "Invalid token."}))
+
+    with mock.patch.dict(UserRateThrottle.THROTTLE_RATES, {'user': '2/minute'}):
+      statuses = [self.get(self.customer, '/api/orders', routes=AsyncRoutes).status_code for _ in range(3)]
+    self.assertEqual(statuses, [200, 200, 429])
+
+  def test_writes_go_to_the_sync_views(self):
+    self.fill_cart(self.customer, self.items)
+    with self.settings(ROOT_URLCONF=AsyncRoutes):
+      response = async_to_sync(self.async_client.post)('/api/orders', headers={'Authorization': 'Token ' + self.tokens[self.customer]})
+    self.assertEqual(response.status_code, 201)
+    self.assertEqual(Order.objects.filter(user=self.customer).count(), 2)
+
+
+class MenuImportTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    manager = User.objects.create_user('manager')
+    manager.groups.add(self.manager_group)
+    self.client.force_authenticate(manager)
+
+  def test_csv_import_creates_updates_and_reports_invalid_rows(self):
+    MenuItem.objects.create(title='Pasta', price=Decimal('5.00'), featured=False, category=self.category)
+    body = 'title,price,featured,category\nPasta,7.50,true,mains\nSoup,4.00,false,mains\nCake,0.50,false,mains\nTea,2.00,false,drinks\n'
+
+    response = self.client.generic('POST', '/api/menu-items/import', body, content_type='text/csv')
+
+    self.assertEqual((response.data['created'], response.data['updated'], response.data['invalid']), (1, 1, 2))
+    self.assertEqual([error['line'] for error in response.data['errors']], [4, 5])
+    self.assertEqual(MenuItem.objects.get(title='Pasta').price, Decimal('7.50'))
+    self.assertTrue(MenuItem.objects.filter(title='Soup').exists())
+
+  def test_import_queries_do_not_grow_with_rows(self):
+    lines = ''.join('{"title": "Dish %d", "price": "3.00", "category": "mains"}\n' % i for i in range(200))
+    # The manager's roles, the categories, the existing items and the inserts in their transaction
+    with self.assertNumQueries(6):
+      self.client.generic('POST', '/api/menu-items/import', lines, content_type='application/x-ndjson')
+    self.assertEqual(MenuItem.objects.count(), 200)
+
+  def test_export_streams_the_catalog(self):
+    self.add_items(2)
+    response = self.client.get('/api/menu-items/export', {'type': 'csv'})
+    content = b''.join(response.streaming_content).decode()
+    self.assertEqual(content.splitlines(), ['title,price,featured,category', 'Item 0,5.00,False,mains', 'Item 1,5.00,False,mains'])
+
+
+class SalesReportTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    self.items = self.add_items(2)
+    self.client.force_authenticate(self.customer)
+    for quantity in (1, 3):
+      self.fill_cart(self.customer, self.items, quantity=quantity)
+      self.client.post('/api/orders')
+    manager = User.objects.create_user('manager')
+    manager.groups.add(self.manager_group)
+    self.client.force_authenticate(manager)
+
+  def report(self, **params):
+    response = self.client.get('/api/reports/sales', params)
+    return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+  def test_rollup_matches_raw_order_items(self):
+    for group in ('day', 'item', 'category'):
+      with self.settings(SALES_ROLLUP=False):
+        raw = self.report(group=group)
+      self.assertEqual(self.report(group=group), raw)
+    self.assertEqual(self.report(group='item')[0], {'menuitem': self.items[0].id, 'title': 'Item 0', 'quantity': 4, 'revenue': '20.00'})
+
+  def test_migration_backfills_the_rollup(self):
+    backfill = importlib.import_module('LittleLemonAPI.migrations.0008_backfill_dailysales').backfill
+    report = self.report(group='day')
+    DailySales.objects.all().delete()
+    backfill(django_apps, None)
+    self.assertEqual(self.report(group='day'), report)
+
+  def test_deleted_order_leaves_the_rollup(self):
+    Order.objects.first().delete()
+    self.assertEqual(self.report(group='category'), [{'category': self.category.id, 'slug': 'mains', 'title': 'Mains', 'quantity': 6, 'revenue': '30.00'}])
+
+  def test_order_moved_to_another_day_moves_its_sales(self):
+    order = Order.objects.first()
+    self.assertEqual(self.client.patch('/api/orders/%d' % order.pk, {'date': '2023-01-02'}).status_code, 200)
+    with self.settings(SALES_ROLLUP=False):
+      raw = self.report(group='day', **{'from': '2023-01-01'})
+    self.assertEqual(self.report(group='day', **{'from': '2023-01-01'}), raw)
+    self.assertIn({'date': '2023-01-02', 'quantity': 2, 'revenue': '10.00'}, raw)
+
+    order.delete()
+    self.assertFalse(DailySales.objects.filter(quantity__lt=0).exists())
+
+
+class ArchiveTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    items = self.add_items(2)
+    self.other = User.objects.create_user('other')
+    self.crew = User.objects.create_user('crew')
+    for user in (self.customer, self.customer, self.other, self.customer):
+      self.fill_cart(user, items)
+      self.client.force_authenticate(user)
+      self.client.post('/api/orders')
+    self.old, self.recent, self.others, self.newest = Order.objects.order_by('id')
+    Order.objects.exclude(pk=self.recent.pk).update(status=True)
+    Order.objects.filter(pk=self.old.pk).update(delivery_crew=self.crew, crew_username='crew')
+    OrderEvent.objects.update(processed=datetime.datetime.now(datetime.timezone.utc))
+    self.client.force_authenticate(self.customer)
+
+  def archive(self):
+    return archive_orders(age_days=0, today=datetime.date.today() + datetime.timedelta(days=1))
+
+  def test_delivered_orders_move_with_their_items(self):
+    self.assertEqual(self.archive(), (3, 6))
+    self.assertEqual(sorted(ArchivedOrder.objects.values_list('id', flat=True)), [self.old.pk, self.others.pk, self.newest.pk])
+    self.assertEqual(list(Order.objects.values_list('id', flat=True)), [self.recent.pk])
+    archived = ArchivedOrder.objects.get(pk=self.old.pk)
+    self.assertEqual((archived.total, archived.item_count, archived.crew_username), (self.old.total, 2, 'crew'))
+    self.assertEqual(self.archive(), (0, 0))
+
+  def test_archived_ids_are_not_handed_out_again(self):
+    # Order ids are AUTOINCREMENT, so the id of the newest order is not reused once it is archived
+    self.archive()
+    self.fill_cart(self.customer, MenuItem.objects.all())
+    self.assertEqual(self.client.post('/api/orders').status_code, 201)
+    self.assertGreater(Order.objects.latest('id').pk, self.newest.pk)
+
+  def test_orders_waiting_for_dispatch_stay(self):
+    OrderEvent.objects.filter(order=self.old).update(processed=None)
+    self.assertEqual(self.archive(), (2, 4))
+    self.assertTrue(Order.objects.filter(pk=self.old.pk).exists())
+
+  def test_sales_are_unchanged(self):
+    report = list(reports.sales('item', datetime.date.min, datetime.date.max))
+    self.archive()
+    self.assertEqual(list(reports.sales('item', datetime.date.min, datetime.date.max)), report)
+    self.assertEqual(list(reports.sales('item', datetime.date.min, datetime.date.max, use_rollup=False)), report)
+    reports.rebuild_rollup()
+    self.assertEqual(list(reports.sales('item', datetime.date.min, datetime.date.max)), report)
+
+  def test_archived_order_is_still_found(self):
+    path = '/api/orders/%d' % self.old.pk
+    items = self.client.get(path).data
+    listing = self.client.get('/api/orders')
+    with self.captureOnCommitCallbacks(execute=True):
+      self.archive()
+
+    self.assertEqual(self.client.get(path).data, items)
+    headers = {'Authorization': 'Token ' + Token.objects.create(user=self.customer).key}
+    with self.settings(ROOT_URLCONF=AsyncRoutes):
+      self.assertEqual(async_to_sync(self.async_client.get)(path, headers=headers).json(), items)
+    self.assertNotEqual(self.client.get('/api/orders', HTTP_IF_NONE_MATCH=listing['ETag']).status_code, 304)
+    self.client.force_authenticate(self.other)
+    self.assertEqual(self.client.get(path).status_code, 403)
+    self.assertEqual(self.client.get('/api/orders/0').status_code, 404)
+
+  def test_listing_includes_archived_orders_on_request(self):
+    self.archive()
+    self.assertEqual(len(self.client.get('/api/orders').data), 1)
+    self.assertEqual([order['total'] for order in self.client.get('/api/orders', {'include_archived': '1'}).data], ['20.00'] * 3)
+    self.assertEqual(self.client.get('/api/orders', {'include_archived': 'maybe'}).status_code, 400)
+
+    pages, cursor = [], ''
+    while cursor is not None:
+      response = self.client.get('/api/orders', {'include_archived': '1', 'expand': 'items', 'cursor': cursor, 'ordering': '-id', 'perpage': 2})
+      pages.append([order['status'] for order in response.data['results']])
+      self.assertTrue(all(len(order['items']) == 2 for order in response.data['results']))
+      cursor = response.data['next']
+    self.assertEqual(pages, [[True, False], [True]])
+
+  def test_renamed_crew_is_copied_to_archived_orders(self):
+    self.archive()
+    self.crew.username = 'rider'
+    self.crew.save()
+    self.assertEqual(ArchivedOrder.objects.get(pk=self.old.pk).crew_username, 'rider')
+
+
+class QueryBudgetTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    items = self.add_items(5)
+    self.fill_cart(self.customer, items)
+    self.order = Order.objects.create(user=self.customer, total=1, date='2023-03-01')
+    OrderItem.objects.bulk_create([OrderItem(order=self.order, menuitem=item, quantity=1, unit_price=item.price, price=item.price) for item in items])
+    self.client.force_authenticate(self.customer)
+
+  def test_read_routes_stay_within_budget(self):
+    for url in ['/api/menu-items', '/api/menu-items/%d' % self.order.orderitem_set.first().menuitem_id,
+                '/api/cart/menu-items', '/api/orders', '/api/orders/%d' % self.order.pk]:
+      assert_query_budget(self.client.get(url))
+
+  def test_checkout_stays_within_budget(self):
+    assert_query_budget(self.client.post('/api/orders'))
+
+  @override_settings(QUERY_BUDGETS={'GET api/cart/menu-items': 0})
+  def test_going_over_budget_fails(self):
+    with self.assertRaises(QueryBudgetExceeded):
+      self.client.get('/api/cart/menu-items')
+
+  def test_metrics_are_reported_per_route(self):
+    self.client.get('/api/orders')
+    self.client.force_authenticate(User.objects.create_superuser('admin'))
+    routes = self.client.get('/api/metrics').data['routes']
+    self.assertEqual(routes['GET api/orders']['budget'], 6)
+    self.assertGreaterEqual(routes['GET api/orders']['requests'], 1)
+
+
+class ConditionalGetTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    self.item = self.add_items(3)[0]
+    Order.objects.create(user=self.customer, total=1, date='2023-03-01')
+    self.client.force_authenticate(self.customer)
+
+  def revalidate(self, url, response):
+    return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+  def test_unchanged_menu_is_not_modified_without_queries(self):
+    for url in ['/api/menu-items', '/api/menu-items/%d' % self.item.pk]:
+      response = self.client.get(url)
+      self.assertIn('Last-Modified', response)
+
+      with self.assertNumQueries(0):
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+  def test_menu_change_invalidates_the_etag(self):
+    url = '/api/menu-items/%d' % self.item.pk
+    response = self.client.get(url)
+    with self.captureOnCommitCallbacks(execute=True):
+      self.item.price = 9
+      self.item.save()
+
+    self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+  def test_order_etags_belong_to_their_user(self):
+    url = '/api/orders/%d' % Order.objects.get().pk
+    response = self.client.get('/api/orders')
+    # Only the user's roles, which the validator depends on
+    with self.assertNumQueries(1):
+      self.assertEqual(self.revalidate('/api/orders', response).status_code, 304)
+    self.assertEqual(self.revalidate(url, self.client.get(url)).status_code, 304)
+
+    self.client.force_authenticate(User.objects.create_user('other'))
+    self.assertEqual(self.revalidate('/api/orders', response).status_code, 200)
+
+  @override_settings(ORDER_DISPATCH={'IN_PROCESS': False})
+  def test_checkout_invalidates_order_etags(self):
+    response = self.client.get('/api/orders')
+    self.fill_cart(self.customer, [self.item])
+    with self.captureOnCommitCallbacks(execute=True):
+      self.client.post('/api/orders')
+
+    self.assertEqual(len(self.revalidate('/api/orders', response).data), 2)
+
+  def test_if_modified_since_is_answered(self):
+    response = self.client.get('/api/menu-items')
+    self.assertEqual(self.client.get('/api/menu-items', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+  def test_change_in_another_process_invalidates_the_etag(self):
+    # What a second worker or a management command such as import_menu does after committing
+    url = '/api/menu-items/%d' % self.item.pk
+    response = self.client.get(url)
+    process = multiprocessing.get_context('fork').Process(target=conditional.bump, args=('menu',))
+    process.start()
+    process.join()
+
+    self.assertEqual(process.exitcode, 0)
+    self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+  def test_no_validators_without_a_shared_cache(self):
+    local = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    with self.settings(CACHES={'default': local, 'shared': local}, MENU_INDEX=True):
+      self.assertNotIn('ETag', self.client.get('/api/menu-items'))
+      self.assertFalse(menu_index.enabled())
+
+
+class FastSerializerTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    items = self.add_items(3, price='12.50')
+    items.append(MenuItem.objects.create(title='Crème brûlée \u2028 "best"', price=Decimal('7'), featured=True, category=self.category))
+    crew = User.objects.create_user('crew')
+    self.orders = [
+      Order.objects.create(user=self.customer, delivery_crew=crew, status=True, total=Decimal('20.5'), date='2023-03-01'),
+      Order.objects.create(user=self.customer, total=0, date='2023-03-02'),
+    ]
+    OrderItem.objects.bulk_create([
+      OrderItem(order=self.orders[0], menuitem=item, quantity=2, unit_price=item.price, price=item.price * 2) for item in items
+    ])
+
+  def assertSameBytes(self, fast_serializer, model_serializer, queryset):
+    slow = JSONRenderer().render(model_serializer(queryset, many=True).data)
+    self.assertEqual(FastJSONRenderer().render(fast_serializer(queryset).data), slow)
+    self.assertEqual(FastJSONRenderer().render(fast_serializer(list(queryset)).data), slow)
+
+  def test_output_matches_model_serializers(self):
+    self.assertSameBytes(MenuItemListSerializer, MenuItemSerializer, MenuItem.objects.order_by('id'))
+    self.assertSameBytes(OrderListSerializer, OrderSerializer, Order.objects.order_by('id'))
+    self.assertSameBytes(OrderItemListSerializer, OrderItemSerializer, OrderItem.objects.order_by('id'))
+
+  def test_listings_render_as_before(self):
+    self.client.force_authenticate(self.customer)
+    response = self.client.get('/api/orders/%d' % self.orders[0].pk)
+    self.assertEqual(response.content, JSONRenderer().render(OrderItemSerializer(OrderItem.objects.all(), many=True).data))
+
+    response = self.client.get('/api/menu-items', {'perpage': 10, 'ordering': 'id'})
+    self.assertEqual(response.content, JSONRenderer().render(MenuItemSerializer(MenuItem.objects.order_by('id'), many=True).data))
+
+
+class OrderExpandTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    self.items = self.add_items(2)
+    self.crew = User.objects.create_user('crew')
+    self.client.force_authenticate(self.customer)
+
+  def add_orders(self, count):
+    orders = Order.objects.bulk_create([
+      Order(user=self.customer, delivery_crew=self.crew, crew_username='crew', total=Decimal('10'), date='2023-03-01', item_count=2)
+      for _ in range(count)
+    ])
+    OrderItem.objects.bulk_create([
+      OrderItem(order=order, menuitem=item, quantity=1, unit_price=item.price, price=item.price)
+      for order in orders for item in self.items
+    ])
+
+  def expanded_queries(self):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.get('/api/orders', {'expand': 'items'})
+    self.assertEqual(response.status_code, 200)
+    return response, len(queries)
+
+  def test_query_count_does_not_grow_with_orders(self):
+    self.add_orders(1)
+    response, one = self.expanded_queries()
+    self.assertEqual(response.json()[0]['items'][0]['title'], 'Item 0')
+
+    self.add_orders(999)
+    response, thousand = self.expanded_queries()
+    self.assertEqual(len(response.json()), 1000)
+    self.assertEqual(one, thousand)
+
+  def test_expanded_order_carries_its_items(self):
+    self.add_orders(1)
+    order = self.client.get('/api/orders', {'expand': 'items'}).json()[0]
+    self.assertEqual((order['item_count'], order['crew_username']), (2, 'crew'))
+    self.assertEqual(order['items'], [
+      {"menuitem": item.pk, "title": item.title, "quantity": 1, "unit_price": "5.00", "price": "5.00"} for item in self.items
+    ])
+    self.assertEqual(self.client.get('/api/orders', {'expand': 'menuitem'}).status_code, 400)
+
+  @override_settings(ORDER_DISPATCH={'IN_PROCESS': False})
+  def test_summary_columns_follow_checkout_and_assignment(self):
+    self.fill_cart(self.customer, self.items)
+    with self.captureOnCommitCallbacks(execute=True):
+      self.client.post('/api/orders')
+    order = Order.objects.get()
+    self.assertEqual((order.item_count, order.crew_username), (2, ''))
+
+    manager = User.objects.create_user('manager')
+    self.manager_group.user_set.add(manager)
+    self.client.force_authenticate(manager)
+    with self.captureOnCommitCallbacks(execute=True):
+      self.client.patch('/api/orders/%d' % order.pk, {'delivery_crew': self.crew.pk})
+    listing = self.client.get('/api/orders')
+    self.assertEqual(listing.json()[0]['crew_username'], 'crew')
+
+    with self.captureOnCommitCallbacks(execute=True):
+      self.crew.username = 'renamed'
+      self.crew.save()
+    self.assertEqual(Order.objects.get().crew_username, 'renamed')
+    response = self.client.get('/api/orders', HTTP_IF_NONE_MATCH=listing['ETag'])
+    self.assertEqual(response.json()[0]['crew_username'], 'renamed')
+
+  def test_deleted_crew_leaves_no_username_behind(self):
+    self.add_orders(2)
+    ArchivedOrder.objects.create(id=1000, user=self.customer, delivery_crew=self.crew, crew_username='crew', total=Decimal('10'), date='2023-02-01', item_count=2)
+    listing = self.client.get('/api/orders')
+
+    with self.captureOnCommitCallbacks(execute=True):
+      self.crew.delete()
+    response = self.client.get('/api/orders', {'include_archived': '1'}, HTTP_IF_NONE_MATCH=listing['ETag'])
+    self.assertEqual([(order['delivery_crew'], order['crew_username']) for order in response.json()], [(None, '')] * 3)
+    self.assertEqual(self.client.get('/api/orders', HTTP_IF_NONE_MATCH=listing['ETag']).status_code, 200)
+
+
+class TokenCacheTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    self.token = Token.objects.create(user=self.customer)
+    self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+  def test_known_token_skips_the_token_query(self):
+    before = token_cache.stats()
+    with self.assertNumQueries(2):
+      self.client.get('/api/cart/menu-items')
+    with self.assertNumQueries(1):
+      self.client.get('/api/cart/menu-items')
+
+    after = token_cache.stats()
+    self.assertEqual((after['hits'] - before['hits'], after['misses'] - before['misses']), (1, 1))
+
+  def test_deleted_token_stops_working(self):
+    self.client.get('/api/cart/menu-items')
+    with self.captureOnCommitCallbacks(execute=True):
+      self.token.delete()
+    self.assertEqual(self.client.get('/api/cart/menu-items').status_code, 401)
+
+  def test_deactivated_user_stops_working(self):
+    self.client.get('/api/cart/menu-items')
+    with self.captureOnCommitCallbacks(execute=True):
+      self.customer.is_active = False
+      self.customer.save()
+    self.assertEqual(self.client.get('/api/cart/menu-items').status_code, 401)
+
+  def test_change_in_another_process_reaches_cached_tokens(self):
+    self.client.get('/api/cart/menu-items')
+    # The update sends no signal here, the process that made the change sends it
+    User.objects.filter(pk=self.customer.pk).update(is_active=False)
+    process = multiprocessing.get_context('fork').Process(target=token_cache.forget_users, args=([self.customer.pk],))
+    process.start()
+    process.join()
+
+    self.assertEqual(process.exitcode, 0)
+    self.assertEqual(self.client.get('/api/cart/menu-items').status_code, 401)
+
+  def test_removed_manager_loses_access(self):
+    self.manager_group.user_set.add(self.customer)
+    self.assertEqual(self.client.get('/api/groups/delivery-crew/users').status_code, 200)
+
+    admin = APIClient()
+    admin.force_authenticate(User.objects.create_superuser('admin'))
+    with self.captureOnCommitCallbacks(execute=True):
+      admin.delete('/api/groups/manager/users/%d' % self.customer.pk)
+
+    self.assertEqual(self.client.get('/api/groups/delivery-crew/users').status_code, 403)
+
+
+def hit_store(path, attempts):
+  store = SQLiteRateStore(path)
+  return sum(store.hit('throttle_user_1', 60, 3600) == 0 for _ in range(attempts))
+
+
+class ThrottleTests(APITestCase):
+  def test_limit_holds_across_processes(self):
+    path = os.path.join(tempfile.mkdtemp(), 'throttle.sqlite3')
+    self.addCleanup(shutil.rmtree, os.path.dirname(path))
+    with multiprocessing.get_context('fork').Pool(4) as pool:
+      allowed = pool.starmap(hit_store, [(path, 50)] * 4)
+    self.assertEqual(sum(allowed), 60)
+
+  def test_denied_request_waits_for_the_next_slot(self):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    store = SQLiteRateStore(os.path.join(directory, 'throttle.sqlite3'))
+    self.assertEqual([store.hit('key', 2, 60) for _ in range(2)], [0, 0])
+    self.assertAlmostEqual(store.hit('key', 2, 60), 30, delta=1)
+
+  def test_views_are_throttled_per_user(self):
+    self.client.force_authenticate(self.customer)
+    with mock.patch.dict(UserRateThrottle.THROTTLE_RATES, {'user': '3/minute'}):
+      statuses = [self.client.get('/api/cart/menu-items').status_code for _ in range(4)]
+    self.assertEqual(statuses, [200, 200, 200, 429])
+
+
+class BatchTests(APITestCase):
+  def setUp(self):
+    super().setUp()
+    desserts = Category.objects.create(slug='desserts', title='Desserts')
+    self.add_items(3)
+    MenuItem.objects.create(title='Tart', price=Decimal('4.00'), featured=False, category=desserts)
+    Order.objects.create(user=self.customer, total=1, date='2023-03-01')
+    Order.objects.create(user=User.objects.create_user('other'), total=2, date='2023-03-01')
+    self.client.force_authenticate(self.customer)
+
+  def batch(self, requests, **options):
+    return self.client.post('/api/batch', dict(options, requests=requests), format='json')
+
+  def test_results_match_separate_calls(self):
+    paths = ['/api/menu-items?category=mains&perpage=5', '/api/menu-items?category=desserts', '/api/cart/menu-items', '/api/orders']
+    response = self.batch([{'path': path} for path in paths])
+
+    self.assertEqual(response.status_code, 200)
+    for path, result in zip(paths, response.json()):
+      menu_cache.clear()
+      self.assertEqual(result, {"status": 200, "body": self.client.get(path).json()}, path)
+
+  def test_writes_run_in_order(self):
+    response = self.batch([
+      {'method': 'POST', 'path': '/api/cart/menu-items', 'body': {'menu item': 'Tart', 'quantity': 2}},
+      {'path': '/api/cart/menu-items'},
+      {'path': '/api/menu-items/0'},
+    ])
+
+    self.assertEqual([result['status'] for result in response.data], [201, 200, 404])
+    self.assertEqual(response.data[1]['body'][0]['menuitem'], 'Tart')
+
+  def test_batch_counts_once_against_the_rate_limit(self):
+    with mock.patch.dict(UserRateThrottle.THROTTLE_RATES, {'user': '1/minute'}):
+      first = self.batch([{'path': '/api/cart/menu-items'}] * 5)
+      second = self.batch([{'path': '/api/cart/menu-items'}])
+
+    self.assertEqual([result['status'] for result in first.data], [200] * 5)
+    self.assertEqual(second.status_code, 429)
+
+  @override_settings(BATCH_REQUESTS={'MAX_REQUESTS': 2})
+  def test_invalid_batches_are_rejected(self):
+    for requests in [[], [{'path': '/api/orders'}] * 3, [{'path': '/api/nowhere'}], [{'path': '/api/batch'}], [{'path': '/api/orders/stream'}], [{'method': 'TRACE', 'path': '/api/orders'}]]:
+      self.assertEqual(self.batch(requests).status_code, 400, requests)
+
+  def test_batch_needs_authentication(self):
+    self.client.force_authenticate(None)
+    self.assertEqual(self.batch([{'path': '/api/menu-items'}]).status_code, 401)
+
+
+class BatchConcurrencyTests(TransactionTestCase):
+  def test_concurrent_reads_match_sequential_ones(self):
+    cache.clear()
+    shared_cache().clear()
+    throttling.throttle_store.clear()
+    category = Category.objects.create(slug='mains', title='Mains')
+    MenuItem.objects.bulk_create([MenuItem(title='Item %d' % i, price=Decimal('5.00'), featured=False, category=category) for i in range(6)])
+    client = APIClient()
+    client.force_authenticate(User.objects.create_user('customer'))
+    requests = [{'path': '/api/menu-items?page=%d' % page} for page in range(1, 4)] + [
+      {'method': 'POST', 'path': '/api/cart/menu-items', 'body': {'menu item': 'Item 1', 'quantity': 1}},
+      {'path': '/api/cart/menu-items'},
+    ]
+
+    results = []
+    for concurrent in (False, True):
+      menu_cache.clear()
+      Cart.objects.all().delete()
+      results.append(client.post('/api/batch', {'requests': requests, 'concurrent': concurrent}, format='json').json())
+    self.assertEqual(results[0], results[1])
+    self.assertEqual(results[1][4]['body'][0]['menuitem'], 'Item 1')
+
+
+class SQLiteTuningTests(TransactionTestCase):
+  def pragma(self, name):
+    with connection.cursor() as cursor:
+      cursor.execute('PRAGMA %s' % name)
+      return cursor.fetchone()[0]
+
+  @override_settings(SQLITE_TUNING={'ENABLED': True, 'BUSY_TIMEOUT': 2500, 'CACHE_SIZE': -4000})
+  def test_new_connections_are_tuned(self):
+    sqlite.tune_connection(connection)
+    self.assertEqual(self.pragma('busy_timeout'), 2500)
+    self.assertEqual(self.pragma('cache_size'), -4000)
+    # NORMAL
+    self.assertEqual(self.pragma('synchronous'), 1)
+
+  def test_disabled_tuning_leaves_the_database_settings_alone(self):
+    database = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'db.sqlite3'}
+    self.assertEqual(sqlite.configure_database(dict(database), {'ENABLED': False}), database)
+
+    tuned = sqlite.configure_database(dict(database), {'ENABLED': True, 'CONN_MAX_AGE': 60})
+    self.assertEqual(tuned['CONN_MAX_AGE'], 60)
+    self.assertEqual(tuned['OPTIONS']['timeout'], 5)
+
+
+@override_settings(REPLICA_DATABASES=['replica'], ORDER_DISPATCH={'IN_PROCESS': False})
+class ReplicaRoutingTests(TransactionTestCase):
+  @classmethod
+  def setUpClass(cls):
+    # A second SQLite file stands in for the replica, sync_replica plays the part of replication.
+    # It is added once the test databases exist, so the runner does not try to create it.
+    cls.directory = tempfile.mkdtemp()
+    connections.settings['replica'] = {**connections['default'].settings_dict, 'NAME': os.path.join(cls.directory, 'replica.sqlite3')}
+    cls.databases = {'default', 'replica'}
+    super().setUpClass()
+
+  @classmethod
+  def tearDownClass(cls):
+    super().tearDownClass()
+    connections['replica'].close()
+    del connections['replica']
+    del connections.settings['replica']
+    shutil.rmtree(cls.directory)
+
+  def setUp(self):
+    cache.clear()
+    shared_cache().clear()
+    throttling.throttle_store.clear()
+    category = Category.objects.create(slug='mains', title='Mains')
+    self.item = MenuItem.objects.create(title='Soup', price=4, featured=False, category=category)
+    self.customer = User.objects.create_user('customer')
+    self.client = APIClient()
+    self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.customer).key)
+    Cart.objects.create(user=self.customer, menuitem=self.item, quantity=1, unit_price=4, price=4)
+    self.sync_replica()
+
+  def sync_replica(self):
+    for alias in ('default', 'replica'):
+      connections[alias].ensure_connection()
+    connections['default'].connection.backup(connections['replica'].connection)
+
+  def test_reads_go_to_the_replica(self):
+    item = MenuItem.objects.create(title='Stew', price=6, featured=False, category=self.item.category)
+    self.assertEqual(self.client.get('/api/menu-items/%d' % item.pk).status_code, 404)
+
+    self.sync_replica()
+    self.assertEqual(self.client.get('/api/menu-items/%d' % item.pk).status_code, 200)
+
+  def test_pages_read_from_the_replica_are_not_cached(self):
+    MenuItem.objects.create(title='Stew', price=6, featured=False, category=self.item.category)
+    self.assertEqual(len(self.client.get('/api/menu-items', {'perpage': 10}).data), 1)
+
+    # Otherwise the page the lagging replica gave would be served until the menu changes again
+    self.sync_replica()
+    self.assertEqual(len(self.client.get('/api/menu-items', {'perpage': 10}).data), 2)
+
+  def test_client_reads_its_own_writes_after_a_write(self):
+    self.assertEqual(self.client.post('/api/orders').status_code, 201)
+    self.assertEqual(len(self.client.get('/api/orders').data), 1)
+
+    # Once the stickiness window is over, reads go back to the lagging replica
+    shared_cache().clear()
+    self.assertEqual(len(self.client.get('/api/orders').data), 0)
@@ -0,0 +1,124 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework import throttling
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+
+
+class SQLiteRateStore:
+  """GCRA rate limiting state in a SQLite file shared by every worker process on the host
+
+  Each key holds its theoretical arrival time, moved forward by one emission interval per allowed request
+  in a single upsert, so a check costs one statement whatever the rate and is atomic across processes.
+  """
+
+  def __init__(self, path, timeout=5):
+    self.path = str(path)
+    self.timeout = timeout
+    self._local = threading.local()
+
+  def _connection(self):
+    # One connection per thread, and a new one after a fork
+    connection = getattr(self._local, 'connection', None)
+    if connection is None or self._local.pid != os.getpid():
+      connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+      connection.execute('PRAGMA journal_mode = WAL')
+      connection.execute('PRAGMA synchronous = NORMAL')
+      connection.execute('CREATE TABLE IF NOT EXISTS throttle (key TEXT PRIMARY KEY, tat REAL NOT NULL)')
+      self._local.connection, self._local.pid = connection, os.getpid()
+    return connection
+
+  def hit(self, key, limit, duration):
+    """Counts a request against the key and returns how many seconds to wait, 0 when it is allowed"""
+    now = time.time()
+    interval = duration / limit
+    connection = self._connection()
+    # The update only happens, and only returns a row, when the request fits in the burst
+    allowed = connection.execute(
+      'INSERT INTO throttle (key, tat) VALUES (:key, :now + :interval) '
+      'ON CONFLICT (key) DO UPDATE SET tat = max(tat, :now) + :interval '
+      'WHERE max(tat, :now) + :interval - :now <= :duration RETURNING tat',
+      {'key': key, 'now': now, 'interval': interval, 'duration': duration},
+    ).fetchone()
+    if random.random() < 0.001:
+      # Keys whose arrival time has passed hold no state worth keeping
+      connection.execute('DELETE FROM throttle WHERE tat < ?', (now,))
+    if allowed is not None:
+      return 0
+    row = connection.execute('SELECT tat FROM throttle WHERE key = ?', (key,)).fetchone()
+    return max(row[0] + interval - duration - now, 0) if row else 0
+
+  def clear(self):
+    self._connection().execute('DELETE FROM throttle')
+
+
+class CacheRateStore:
+  """Fixed window counters in a Django cache whose incr is atomic, such as Redis or Memcached"""
+
+  def __init__(self, alias='default'):
+    self.alias = alias
+
+  def hit(self, key, limit, duration):
+    cache = caches[self.alias]
+    now = time.time()
+    window = math.floor(now / duration)
+    window_key = '%s:%d' % (key, window)
+    cache.add(window_key, 0, duration + 1)
+    try:
+      count = cache.incr(window_key)
+    except ValueError:
+      # Expired between add and incr
+      cache.add(window_key, 1, duration + 1)
+      count = 1
+    if count <= limit:
+      return 0
+    return (window + 1) * duration - now
+
+  def clear(self):
+    caches[self.alias].clear()
+
+
+def build_throttle_store():
+  options = dict(getattr(settings, 'THROTTLE_STORE', {}))
+  backend = import_string(options.pop('BACKEND', 'LittleLemonAPI.throttling.SQLiteRateStore'))
+  if backend is SQLiteRateStore:
+    return SQLiteRateStore(path=options.get('PATH', settings.BASE_DIR / 'throttle.sqlite3'), timeout=options.get('TIMEOUT', 5))
+  return backend(**{key.lower(): value for key, value in options.items()})
+
+
+throttle_store = build_throttle_store()
+
+
+class SharedRateThrottle(throttling.SimpleRateThrottle):
+  """SimpleRateThrottle with its history in the shared throttle store instead of a list per key in the cache"""
+
+  def allow_request(self, request, view):
+    # Sub-requests of a batch were counted with the batch
+    if self.rate is None or getattr(request, 'batched', False):
+      return True
+    self.key = self.get_cache_key(request, view)
+    if self.key is None:
+      return True
+    self._wait = throttle_store.hit(self.key, self.num_requests, self.duration)
+    return self._wait == 0
+
+  async def aallow_request(self, request, view):
+    """allow_request() for async views, the store is written from a worker thread as it may wait on a lock"""
+    return await sync_to_async(self.allow_request, thread_sensitive=False)(request, view)
+
+  def wait(self):
+    return self._wait
+
+
+class UserRateThrottle(SharedRateThrottle, throttling.UserRateThrottle):
+  pass
+
+
+class AnonRateThrottle(SharedRateThrottle, throttling.AnonRateThrottle):
+  pass
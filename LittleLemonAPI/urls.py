@@ -4,6 +4,9 @@ from . import views
 urlpatterns = [
   path('menu-items',views.menu_items),
   path('menu-items/<int:id>', views.single_menu_item),
+  path('menu-items/cache-stats', views.menu_cache_stats),
+  path('menu-items/import', views.import_menu_items),
+  path('menu-items/export', views.export_menu_items),
   path('groups/manager/users', views.managers),
   path('groups/manager/users/<int:id>', views.remove_manager),
   path('groups/delivery-crew/users', views.delivery_crew),
@@ -11,4 +14,9 @@ urlpatterns = [
   path('cart/menu-items', views.cart),
   path('orders', views.orders),
   path('orders/<int:id>', views.single_order),
+  path('orders/dispatch-stats', views.dispatch_stats),
+  path('orders/stream', views.order_stream),
+  path('reports/sales', views.sales_report),
+  path('metrics', views.metrics),
+  path('batch', views.batch),
 ]
\ No newline at end of file
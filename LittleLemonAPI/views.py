@@ -1,49 +1,81 @@
 from django.shortcuts import get_object_or_404
-from .models import MenuItem, Cart, Order, OrderItem
-from .serializers import MenuItemSerializer, OrderSerializer, OrderItemSerializer
+from .models import MenuItem, Cart, Order, ArchivedOrder
+from .serializers import MenuItemSerializer, OrderSerializer, OrderItemSerializer, CartItemSerializer
+from .serializers import MenuItemListSerializer, OrderItemListSerializer
+from .checkout import checkout
+from .carts import add_to_cart, cart_contents
+from .cache import menu_cache
+from .menu_index import menu_index
+from .authentication import token_cache
+from .pagination import InvalidCursor
+from .roles import get_roles, has_role, user_roles, MANAGER, DELIVERY_CREW
+from .permissions import IsManager
+from .conditional import conditional
+from .coalesce import coalesce, single_flight
+from . import batches, catalog, dispatch, listings, middleware, reports, routers, streams
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.contrib.auth.models import User, Group
+from .throttling import UserRateThrottle, AnonRateThrottle
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
 import datetime
-from django.core.paginator import Paginator, EmptyPage
-from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
 
+def cache_menu_page(cache_key, data):
+  """Keeps a menu page for the next request, unless it was read from a replica that may not have the latest change"""
+  if not routers.reads_from_replica():
+    menu_cache.set(cache_key, data)
+
+
+IMPORT_FORMATS = {
+  'text/csv': 'csv',
+  'application/x-ndjson': 'ndjson',
+  'application/jsonl': 'ndjson',
+}
 
 
 @api_view(['GET', 'POST'])
 @throttle_classes([UserRateThrottle, AnonRateThrottle])
+@conditional('menu')
+@coalesce('menu')
 def menu_items(request):
   if request.method == 'GET':
-    menu_items = MenuItem.objects.select_related('category').all()
-    category_name = request.query_params.get('category')
-    to_price = request.query_params.get('to_price')
-    search = request.query_params.get('search')
-    ordering = request.query_params.get('ordering')
-    perpage = request.query_params.get('perpage', default=2)
-    if int(perpage) > 10:
-      return Response({"message": "You are limited to 10 results per page"}, status=status.HTTP_400_BAD_REQUEST)
+    listing = listings.MenuListing(request.query_params)
+    if listing.message:
+      return Response({"message": listing.message}, status=status.HTTP_400_BAD_REQUEST)
     
-    page = request.query_params.get('page', default=1)
-    if category_name:
-      menu_items = menu_items.filter(category__title=category_name)
-    if to_price:
-      menu_items = menu_items.filter(price__lte=to_price)
-    if search:
-      menu_items = menu_items.filter(title__icontains=search)
-    if ordering:
-      ordering_fields = ordering.split(',')
-      menu_items = menu_items.order_by(*ordering_fields)
-    paginator = Paginator(menu_items, per_page=perpage)
-    try:
-      menu_items = paginator.page(number=page)
-    except EmptyPage:
-      menu_items = []
-    serialized_items = MenuItemSerializer(menu_items, many=True)
-    return Response(serialized_items.data, status=status.HTTP_200_OK)
+    cache_key = menu_cache.make_key(listing.cache_params())
+    cached_items = menu_cache.get(cache_key)
+    if cached_items is not None:
+      return Response(cached_items, status=status.HTTP_200_OK)
+    
+    # The in-process index answers the filters and orderings it keeps, without a query
+    index = menu_index.current() if listing.uses_index(menu_index.enabled()) else None
+    if index is not None:
+      try:
+        data = listing.from_index(index)
+      except InvalidCursor:
+        return Response({"message": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+      if data is not None:
+        cache_menu_page(cache_key, data)
+        return Response(data, status=status.HTTP_200_OK)
+    
+    menu_items = listing.queryset()
+    if listing.cursor is not None:
+      try:
+        menu_items, next_cursor = listing.keyset(menu_items).page(listing.cursor)
+      except InvalidCursor:
+        return Response({"message": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+      data = {"results": MenuItemListSerializer(menu_items).data, "next": next_cursor}
+    else:
+      data = MenuItemListSerializer(listing.offset_page(listing.ordered(menu_items))).data
+    cache_menu_page(cache_key, data)
+    return Response(data, status=status.HTTP_200_OK)
   
-  if not request.user.groups.filter(name='Manager').exists():
+  if not has_role(request, MANAGER):
     return Response({"message": "You do not have permission to do this."}, status=status.HTTP_403_FORBIDDEN)
   
   if request.method == 'POST':
@@ -53,9 +85,51 @@ def menu_items(request):
     return Response(serialized_item.data, status=status.HTTP_201_CREATED)
   
   
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, IsManager])
+@throttle_classes([UserRateThrottle])
+def import_menu_items(request):
+  """Allows managers to create or update many menu items at once from a CSV or NDJSON body"""
+  content_type = request.content_type.split(';')[0].strip()
+  file_format = IMPORT_FORMATS.get(content_type)
+  if file_format is None:
+    return Response({"message": "Send the items as text/csv or application/x-ndjson"}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+  
+  if request.stream is None:
+    return Response({"message": "The body is empty"}, status=status.HTTP_400_BAD_REQUEST)
+  
+  rows = catalog.PARSERS[file_format](catalog.read_lines(request.stream))
+  report = catalog.import_menu(rows)
+  return Response(report.as_dict(), status=status.HTTP_200_OK)
+  
+  
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsManager])
+@throttle_classes([UserRateThrottle])
+def export_menu_items(request):
+  """Allows managers to download the whole catalog, ?type=csv (default) or ?type=ndjson"""
+  file_format = request.query_params.get('type', default='csv')
+  if file_format not in catalog.PARSERS:
+    return Response({"message": "The type can be csv or ndjson"}, status=status.HTTP_400_BAD_REQUEST)
+  
+  content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+  response = StreamingHttpResponse(catalog.export_menu(file_format), content_type=content_type)
+  response['Content-Disposition'] = 'attachment; filename="menu.%s"' % file_format
+  return response
+  
+  
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def menu_cache_stats(request):
+  """Allows admin to see the menu cache counters to size it"""
+  return Response(menu_cache.stats(), status=status.HTTP_200_OK)
+  
+  
 @api_view(['GET', 'PUT', 'PATCH', 'DELETE'])
 @permission_classes([IsAuthenticated])
 @throttle_classes([UserRateThrottle])
+@conditional('menu')
+@coalesce('menu')
 def single_menu_item(request, id):
   # Allows authenticated users to access one item's details
   try:
@@ -65,11 +139,10 @@ def single_menu_item(request, id):
     
   if request.method == 'GET':
     item_serializer = MenuItemSerializer(item)
-    print(item_serializer.data)
     return Response(item_serializer.data, status=status.HTTP_200_OK)
   
   # Ensures only managers can use PUT, PATCH and DELETE
-  if not request.user.groups.filter(name='Manager').exists():
+  if not has_role(request, MANAGER):
     return Response({"message": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
   
   if request.method == 'PUT':
@@ -130,14 +203,11 @@ def remove_manager(request, id):
 
 
 @api_view(['GET', 'POST'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsManager])
 @throttle_classes([UserRateThrottle])
 def delivery_crew(request):
   """Allows managers to list users from the delivery crew group and to add users to the group"""
   
-  if not request.user.groups.filter(name='Manager').exists():
-    return Response({"message": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
-  
   if request.method == 'GET':
     members = User.objects.filter(groups__name='Delivery Crew')
     delivery_crew_dict = {}
@@ -157,13 +227,10 @@ def delivery_crew(request):
   
   
 @api_view(['DELETE'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsManager])
 @throttle_classes([UserRateThrottle])
 def remove_delivery_crew(request, id):
   """Allows managers to remove a user from the delivery crew"""
-  if not request.user.groups.filter(name='Manager').exists():
-    return Response({"message": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
-  
   delivery_person = get_object_or_404(User, pk=id)
   
   if delivery_person.groups.filter(name='Delivery Crew').exists():
@@ -182,28 +249,23 @@ def cart(request):
   
   user = request.user
   
+  # The list of rows, or with ?include_total=1 {"items": rows, "total": the cart total}
   if request.method == 'GET':
-    cart = Cart.objects.filter(user=user.id)
-    cart_list = [{"menuitem": row.menuitem.title, "quantity": row.quantity, "unit price": row.unit_price, "price": row.price} for row in cart]
-    return Response(cart_list, status=status.HTTP_200_OK)
+    items, total = cart_contents(user)
+    if request.query_params.get('include_total') in ('1', 'true'):
+      return Response({"items": items, "total": total}, status=status.HTTP_200_OK)
+    return Response(items, status=status.HTTP_200_OK)
     
-  # 
+  # A single item, or a list of them to add many at once
   if request.method == 'POST':
-    menu_item = MenuItem.objects.get(title=request.data['menu item'])
-    quantity = float(request.data['quantity'])
-    unit_price = float(menu_item.price)
-    try:
-      cart = Cart.objects.get(user=user.id, menuitem_id=menu_item.id)
-      cart.menuitem = menu_item
-      cart.quantity = quantity
-      cart.unit_price = unit_price
-      cart.price = quantity * unit_price
-      cart.save()
-    except Cart.DoesNotExist:
-      cart = Cart.objects.create(user=user, menuitem=menu_item, quantity=quantity, unit_price=unit_price, price=quantity*unit_price)
-      cart.save()
+    many = isinstance(request.data, list)
+    serialized_lines = CartItemSerializer(data=request.data, many=many)
+    serialized_lines.is_valid(raise_exception=True)
+    lines = serialized_lines.validated_data if many else [serialized_lines.validated_data]
+    rows = add_to_cart(user, [(line['menu item'], line['quantity']) for line in lines])
     
-    return Response({"message": "Item added to cart successfully"}, status=status.HTTP_201_CREATED)
+    message = "Items added to cart successfully" if many else "Item added to cart successfully"
+    return Response({"message": message, "count": len(rows)}, status=status.HTTP_201_CREATED)
   
   if request.method == 'DELETE':
     cart = Cart.objects.filter(user=user.id)
@@ -214,63 +276,54 @@ def cart(request):
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 @throttle_classes([UserRateThrottle])
+@conditional('orders', per_user=True)
+@coalesce('orders', per_user=True)
 def orders(request):
   """Allows managers to see every order, customer to see their order(s) and submit new orders, and delivery crew to see orders assigned to them"""
   
   if request.method == 'GET':
-    # Manager view
-    if request.user.groups.filter(name='Manager').exists():
-      orders = Order.objects.all()
-      serializer = OrderSerializer(orders, many=True)
-      return Response(serializer.data, status=status.HTTP_200_OK)
+    listing = listings.OrderListing(request.query_params, listings.visible_orders(get_roles(request), request.user))
+    if listing.message:
+      return Response({"message": listing.message}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Delivery crew view
-    elif request.user.groups.filter(name='Delivery Crew').exists():
-      orders = Order.objects.filter(delivery_crew=request.user)
-      serializer = OrderSerializer(orders, many=True)
-      return Response(serializer.data, status=status.HTTP_200_OK)
+    if listing.cursor is None:
+      return Response([row for rows in listing.unpaged() for row in listing.serializer_class(rows).data], status=status.HTTP_200_OK)
     
-    # Customer view
-    else:
-      orders = Order.objects.filter(user=request.user)
-      serializer = OrderSerializer(orders, many=True)
-      return Response(serializer.data, status=status.HTTP_200_OK)
+    try:
+      orders, next_cursor = listing.keyset().page_across(listing.archived, listing.cursor)
+    except InvalidCursor:
+      return Response({"message": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"results": listing.serializer_class(orders).data, "next": next_cursor}, status=status.HTTP_200_OK)
       
   # Customer submits an order
   if request.method == 'POST':
-    cart = Cart.objects.filter(user=request.user)
-    order = Order.objects.create(user=request.user, total=0, date=str(datetime.date.today()))
-    for item in cart:
-      data = {"order": order.id, "menuitem": item.menuitem.id, "quantity": item.quantity, "unit_price": item.unit_price, "price": item.price}
-      print(data)
-      order_item = OrderItemSerializer(data=data)
-      order.total += item.price
-      if order_item.is_valid():
-        order_item.save()
-      order.save()
-    cart.delete()
+    checkout(request.user)
     return Response({"message": "Order submitted"}, status=status.HTTP_201_CREATED)
   
   
 @api_view(['GET', 'PUT', 'PATCH', 'DELETE'])
 @permission_classes([IsAuthenticated])
 @throttle_classes([UserRateThrottle])
+@conditional('orders', per_user=True)
+@coalesce('orders', per_user=True)
 def single_order(request, id):
   
-  order = get_object_or_404(Order, pk=id)
-  
-  # Customers can see items in one of their orders
+  # Customers can see items in one of their orders, archived ones included
   if request.method == 'GET':
-    if order.user != request.user:
+    order = Order.objects.filter(pk=id).first() or ArchivedOrder.objects.filter(pk=id).first()
+    if order is None:
+      raise Http404("No Order matches the given query.")
+    if order.user_id != request.user.id:
       return Response({"message": "This order is not yours."}, status=status.HTTP_403_FORBIDDEN)
     
-    order_items = OrderItem.objects.filter(order=order)
-    serialized_items = OrderItemSerializer(order_items, many=True)
-    return Response(serialized_items.data, status=status.HTTP_200_OK)
+    order_items = order.orderitem_set.all()
+    return Response(OrderItemListSerializer(order_items).data, status=status.HTTP_200_OK)
+  
+  order = get_object_or_404(Order, pk=id)
   
   # Only managers can update every parameter of an order
   if request.method == 'PUT':
-    if not request.user.groups.filter(name='Manager').exists():
+    if not has_role(request, MANAGER):
       return Response({"message": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
     
     serialized_order = OrderItemSerializer(order, data=request.data)
@@ -280,14 +333,16 @@ def single_order(request, id):
     
   # Managers can update one by one every parameter of an order
   if request.method == 'PATCH':
-    if request.user.groups.filter(name='Manager').exists():
+    previous_delivery_crew = order.delivery_crew_id
+    if has_role(request, MANAGER):
       serialized_order = OrderSerializer(order, data=request.data, partial=True)
       serialized_order.is_valid(raise_exception=True)
       serialized_order.save()
+      streams.order_changed(order, previous_delivery_crew)
       return Response(serialized_order.data, status=status.HTTP_200_OK)
     
     # Delivery crew can update the status of orders assigned to them
-    elif request.user.groups.filter(name='Delivery Crew').exists():
+    elif has_role(request, DELIVERY_CREW):
       if order.delivery_crew != request.user:
         return Response({"message": "This order is not assigned to you"}, status=status.HTTP_403_FORBIDDEN)
       
@@ -297,6 +352,7 @@ def single_order(request, id):
       serialized_order = OrderSerializer(order, data=request.data, partial=True)
       serialized_order.is_valid(raise_exception=True)
       serialized_order.save()
+      streams.order_changed(order, previous_delivery_crew)
       return Response(serialized_order.data, status=status.HTTP_200_OK)
     
     else:
@@ -305,4 +361,82 @@ def single_order(request, id):
   # Managers can delete an order
   if request.method == 'DELETE':
     order.delete()
-    return Response({"message": "Order deleted"}, status=status.HTTP_200_OK)
\ No newline at end of file
+    return Response({"message": "Order deleted"}, status=status.HTTP_200_OK)
+  
+  
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@throttle_classes([UserRateThrottle])
+def batch(request):
+  """Allows authenticated users to make several API calls at once, counted as one against their rate limit
+
+  Takes {"requests": [{"method": "GET", "path": "/api/menu-items?category=mains", "body": null}, ...]} with
+  "concurrent": true to run the reads in parallel, and returns the [{"status", "body"}] of each call.
+  """
+  if not isinstance(request.data, dict):
+    return Response({"message": "Send an object with a list of requests"}, status=status.HTTP_400_BAD_REQUEST)
+  subs = batches.parse(request.data.get('requests'))
+  results = batches.execute(request, subs, concurrent=bool(request.data.get('concurrent')))
+  return Response(results, status=status.HTTP_200_OK)
+  
+  
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsManager])
+@throttle_classes([UserRateThrottle])
+def sales_report(request):
+  """Allows managers to stream revenue and quantities per day, item or category over a date range"""
+  group = request.query_params.get('group', default='day')
+  file_format = request.query_params.get('type', default='ndjson')
+  if group not in reports.GROUPS:
+    return Response({"message": "The group can be day, item or category"}, status=status.HTTP_400_BAD_REQUEST)
+  if file_format not in ('ndjson', 'csv'):
+    return Response({"message": "The type can be ndjson or csv"}, status=status.HTTP_400_BAD_REQUEST)
+  
+  try:
+    end = datetime.date.fromisoformat(request.query_params.get('to', str(datetime.date.today())))
+    start = datetime.date.fromisoformat(request.query_params.get('from', str(end - datetime.timedelta(days=30))))
+  except ValueError:
+    return Response({"message": "Dates must be formatted as YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+  
+  rows = reports.sales(group, start, end)
+  if file_format == 'csv':
+    return StreamingHttpResponse(reports.as_csv(rows, group), content_type='text/csv')
+  return StreamingHttpResponse(reports.as_ndjson(rows), content_type='application/x-ndjson')
+  
+  
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+  """Allows admin to see query counts, database, rendering and total time per route, and the cache counters"""
+  return Response({
+    "routes": middleware.registry.snapshot(),
+    "menu_cache": menu_cache.stats(),
+    "token_cache": token_cache.stats(),
+    "dispatch": dispatch.metrics.stats(),
+    "coalescing": single_flight.stats(),
+  }, status=status.HTTP_200_OK)
+  
+  
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def dispatch_stats(request):
+  """Allows admin to see how many orders were assigned automatically and how long it took"""
+  return Response(dispatch.metrics.stats(), status=status.HTTP_200_OK)
+  
+  
+async def order_stream(request):
+  """Streams changes to the orders the user can see as server-sent events, only served over ASGI"""
+  # A WSGI server would hold a worker thread for as long as the stream is open, which is forever
+  if not isinstance(request, ASGIRequest):
+    return JsonResponse({"message": "Order streams are only served by the ASGI application"}, status=status.HTTP_501_NOT_IMPLEMENTED)
+  
+  user = await streams.authenticate(request)
+  if user is None:
+    return JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+  
+  roles = await sync_to_async(user_roles)(user)
+  subscription = streams.broker.subscribe(user.pk, roles)
+  response = StreamingHttpResponse(streams.EventStream(subscription), content_type='text/event-stream')
+  response['Cache-Control'] = 'no-cache'
+  response['X-Accel-Buffering'] = 'no'
+  return response